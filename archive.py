@@ -0,0 +1,410 @@
+"""Streaming archive output: one tar or zip file per profile.
+
+Instead of one loose file per media item, everything a loader writes for a
+profile (media, ``.json``, ``.txt``) is appended to ``<folder>/<profile>.tar``
+(or ``.tar.zst``, ``.zip``). Members are named ``<profile>/<file>``, so
+unpacking gives the same layout as the folder output.
+
+Each member is appended as soon as it is downloaded; a re-sync appends to the
+existing archive. Where each member starts is kept in a small SQLite index
+next to the archive (``<archive>.index.sqlite3``), which is what makes single
+members readable without scanning the archive (``ArchiveReader``).
+
+* ``tar``     - a plain tar, valid after every member (an end marker is
+  written each time and overwritten by the next member)
+* ``tar.zst`` - the same tar stream with every member in its own zstd frame,
+  so a member can be decompressed on its own; needs ``zstandard``
+  (check ``HAS_ZSTD``)
+* ``zip``     - stored (images, videos) or deflated (.json, .txt) members;
+  the zip directory is only written when the archive is closed, and is
+  rebuilt from the index when the writer was killed before that
+
+Archives are append-only: a member that is already there is kept.
+"""
+import io
+import os
+import shutil
+import sqlite3
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+TAR = "tar"
+TAR_ZST = "tar.zst"
+ZIP = "zip"
+FORMATS = (TAR, TAR_ZST, ZIP)
+INDEX_SUFFIX = ".index.sqlite3"
+# Downloads are buffered in memory up to this size before being appended
+SPOOL_SIZE = 32 * 1024 * 1024
+
+_BLOCK = tarfile.BLOCKSIZE
+_TAR_END = bytes(2 * _BLOCK)
+_DEFLATED_EXTENSIONS = (".json", ".txt")
+_ZIP_HEADER = struct.Struct(zipfile.structFileHeader)
+_ZIP_UTF8 = 0x800
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    name        TEXT PRIMARY KEY,
+    offset      INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    data_offset INTEGER NOT NULL,
+    size        INTEGER NOT NULL,
+    mtime       REAL
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    alias TEXT PRIMARY KEY,
+    name  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_path(folder, target, fmt):
+    return os.path.join(folder, f"{target}.{fmt}")
+
+
+def _zip_info(f, offset):
+    """The ``ZipInfo`` of the zip member whose local header is at *offset*."""
+    f.seek(offset)
+    header = _ZIP_HEADER.unpack(f.read(_ZIP_HEADER.size))
+    if header[0] != zipfile.stringFileHeader:
+        raise ArchiveError(f"no zip member at offset {offset}")
+    flags, method, dostime, dosdate, crc, compress_size, file_size, name_length, extra_length = header[3:12]
+    name = f.read(name_length).decode("utf-8" if flags & _ZIP_UTF8 else "cp437")
+    extra = f.read(extra_length)
+    if 0xFFFFFFFF in (compress_size, file_size):
+        # Members are written with force_zip64: the sizes are in the ZIP64 extra field
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, length = struct.unpack_from("<HH", extra, pos)
+            if tag == 1:
+                file_size, compress_size = struct.unpack_from("<QQ", extra, pos + 4)
+                break
+            pos += 4 + length
+    date_time = ((dosdate >> 9) + 1980, (dosdate >> 5) & 0xF, dosdate & 0x1F,
+                 dostime >> 11, (dostime >> 5) & 0x3F, (dostime & 0x1F) * 2)
+    info = zipfile.ZipInfo(name, date_time=date_time)
+    info.flag_bits = flags
+    info.compress_type = method
+    info.CRC = crc
+    info.compress_size = compress_size
+    info.file_size = file_size
+    info.header_offset = offset
+    info.external_attr = 0o644 << 16
+    return info
+
+
+class _Index:
+    """Member offsets of one archive, plus its format and end offset."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def clear(self):
+        self._conn.execute("DELETE FROM members")
+        self._conn.execute("DELETE FROM aliases")
+        self._conn.execute("DELETE FROM meta")
+        self._conn.commit()
+
+    def get(self, name):
+        return self._conn.execute(
+            "SELECT offset, length, data_offset, size FROM members WHERE name = ?", (name,)).fetchone()
+
+    def resolve(self, name):
+        """*name* if it is a member, the member it is an alias of, or None."""
+        if self.get(name) is not None:
+            return name
+        row = self._conn.execute("SELECT name FROM aliases WHERE alias = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def add_alias(self, alias, name):
+        self._conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?)", (alias, name))
+        self._conn.commit()
+
+    def names(self):
+        return [row[0] for row in self._conn.execute("SELECT name FROM members ORDER BY offset")]
+
+    def offsets(self):
+        return [row[0] for row in self._conn.execute("SELECT offset FROM members ORDER BY offset")]
+
+    def members(self):
+        return self._conn.execute("SELECT name, size FROM members ORDER BY offset").fetchall()
+
+    def add(self, name, offset, length, data_offset, size, mtime, end):
+        self._conn.execute("INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?)",
+                           (name, offset, length, data_offset, size, mtime))
+        self.set_meta("end", end)
+        self._conn.commit()
+
+
+class ArchiveWriter:
+    def __init__(self, path, fmt=TAR, root=None):
+        """Append to the archive at *path*; member names are file paths relative to *root*."""
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown archive format: {fmt}")
+        if fmt == TAR_ZST and not HAS_ZSTD:
+            raise RuntimeError("tar.zst archives need zstandard (pip install zstandard)")
+        self.path = path
+        self.format = fmt
+        self.root = root if root is not None else os.path.dirname(path)
+        # Whether the archive was left broken (a zip without its directory) and repaired
+        self.repaired = False
+        self._lock = threading.Lock()
+        self._index = _Index(path + INDEX_SUFFIX)
+        try:
+            self._open()
+        except Exception:
+            self._index.close()
+            raise
+        self.added = 0
+
+    @classmethod
+    def for_profile(cls, folder, target, fmt=TAR):
+        os.makedirs(folder, exist_ok=True)
+        return cls(archive_path(folder, target, fmt), fmt, root=folder)
+
+    def _open(self):
+        index = self._index
+        if not os.path.isfile(self.path):
+            # New archive (or the old one was deleted)
+            index.clear()
+        if index.meta("format", self.format) != self.format:
+            raise ArchiveError(f"{self.path} is indexed as {index.meta('format')}, not {self.format}")
+        index.set_meta("format", self.format)
+        self._end = int(index.meta("end", 0))
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        if size < self._end:
+            raise ArchiveError(f"{self.path} is shorter than its index")
+        self._cctx = zstandard.ZstdCompressor() if self.format == TAR_ZST else None
+
+        if self.format == ZIP:
+            if size and not self._zip_intact():
+                self._rebuild_zip()
+            try:
+                self._zip = zipfile.ZipFile(self.path, "a")
+            except zipfile.BadZipFile as e:
+                raise ArchiveError(f"{self.path} was not closed properly ({e})") from e
+            self._file = None
+        else:
+            self._zip = None
+            self._file = open(self.path, "r+b" if size else "w+b")
+            # Anything after the end recorded in the index (the end marker, or a
+            # member interrupted before it was indexed) is overwritten
+            self._write_end()
+
+    def _zip_intact(self):
+        # zipfile would silently start a new archive behind a zip without a
+        # (current) directory, hiding every member that is already indexed
+        try:
+            with zipfile.ZipFile(self.path) as zf:
+                return zf.start_dir == self._end
+        except zipfile.BadZipFile:
+            return False
+
+    def _rebuild_zip(self):
+        """Write the zip directory of the indexed members, cutting off anything after them."""
+        with open(self.path, "r+b") as f:
+            infos = [_zip_info(f, offset) for offset in self._index.offsets()]
+            f.seek(self._end)
+            f.truncate()
+            with zipfile.ZipFile(f, "w") as zf:
+                for info in infos:
+                    zf.filelist.append(info)
+                    zf.NameToInfo[info.filename] = info
+        self.repaired = True
+
+    def __len__(self):
+        return len(self.names())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def name_for(self, path):
+        """Member name of the file *path* (relative to the archive root, ``/``-separated)."""
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def contains(self, path):
+        """Whether *path* is a member, or the name it was stored under was
+        recorded for it (``add(..., alias=path)``)."""
+        with self._lock:
+            return self._index.resolve(self.name_for(path)) is not None
+
+    def names(self):
+        with self._lock:
+            return self._index.names()
+
+    def add(self, path, f, mtime=None, alias=None):
+        """Append the content of the file object *f* (read to its end) as the file *path*.
+
+        Returns False (and writes nothing) when the member already exists.
+        *alias* is another file name that ``contains()`` should report for
+        it, e.g. the name expected before the download chose the extension.
+        """
+        name = self.name_for(path)
+        mtime = time.time() if mtime is None else mtime
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        with self._lock:
+            if alias is not None and self.name_for(alias) != name:
+                self._index.add_alias(self.name_for(alias), name)
+            if self._index.get(name) is not None:
+                return False
+            offset = self._end
+            if self._zip is not None:
+                data_offset = self._add_zip(name, f, mtime)
+            else:
+                data_offset = self._add_tar(name, f, size, mtime)
+                self._write_end()
+            end = self._end
+            self._index.add(name, offset, end - offset, data_offset, size, mtime, end)
+            self.added += 1
+        return True
+
+    def add_bytes(self, path, data, mtime=None):
+        return self.add(path, io.BytesIO(data), mtime)
+
+    def _add_tar(self, name, f, size, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.PAX_FORMAT)
+        padding = bytes(-size % _BLOCK)
+
+        self._file.seek(self._end)
+        if self._cctx is None:
+            self._file.write(header)
+            shutil.copyfileobj(f, self._file)
+            self._file.write(padding)
+        else:
+            # One frame per member: it decompresses without the frames before it
+            with self._cctx.stream_writer(self._file, size=len(header) + size + len(padding),
+                                          closefd=False) as out:
+                out.write(header)
+                shutil.copyfileobj(f, out)
+                out.write(padding)
+        self._end = self._file.tell()
+        return len(header)
+
+    def _add_zip(self, name, f, mtime):
+        info = zipfile.ZipInfo(name, date_time=time.localtime(mtime)[:6])
+        info.external_attr = 0o644 << 16
+        if name.lower().endswith(_DEFLATED_EXTENSIONS):
+            info.compress_type = zipfile.ZIP_DEFLATED
+        with self._zip.open(info, "w", force_zip64=True) as out:
+            shutil.copyfileobj(f, out)
+        # Readable through the index before the archive is closed
+        self._zip.fp.flush()
+        self._end = self._zip.start_dir
+        return 0
+
+    def _write_end(self):
+        """End the tar stream after the last member, so the file is always valid."""
+        self._file.seek(self._end)
+        if self._cctx is None:
+            self._file.write(_TAR_END)
+        else:
+            self._file.write(self._cctx.compress(_TAR_END))
+        self._file.truncate()
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+            elif self._file is not None:
+                self._file.close()
+            self._index.close()
+
+
+class ArchiveReader:
+    """Random access to single members, through the index."""
+
+    def __init__(self, path):
+        if not os.path.isfile(path + INDEX_SUFFIX):
+            raise ArchiveError(f"{path} has no index")
+        self.path = path
+        self._index = _Index(path + INDEX_SUFFIX)
+        self.format = self._index.meta("format", TAR)
+
+    def close(self):
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def names(self):
+        return self._index.names()
+
+    def members(self):
+        """``(name, size)`` of every member, in archive order."""
+        return self._index.members()
+
+    def read(self, name):
+        """The content of the member *name* (e.g. ``"cristiano/2024-05-31_12-00-00_UTC.jpg"``)."""
+        entry = self._index.get(name)
+        if entry is None:
+            raise KeyError(name)
+        offset, length, data_offset, size = entry
+        with open(self.path, "rb") as f:
+            if self.format == ZIP:
+                return self._read_zip(f, offset)
+            f.seek(offset)
+            if self.format == TAR:
+                f.seek(data_offset, os.SEEK_CUR)
+                return f.read(size)
+            if not HAS_ZSTD:
+                raise RuntimeError("tar.zst archives need zstandard (pip install zstandard)")
+            frame = f.read(length)
+        return zstandard.ZstdDecompressor().decompress(frame)[data_offset:data_offset + size]
+
+    @staticmethod
+    def _read_zip(f, offset):
+        # From the local header, so the directory is not needed (it is only
+        # written when the writer closes the archive)
+        info = _zip_info(f, offset)
+        data = f.read(info.compress_size)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif info.compress_type != zipfile.ZIP_STORED:
+            raise ArchiveError(f"unsupported compression of {info.filename}: {info.compress_type}")
+        if zlib.crc32(data) != info.CRC:
+            raise ArchiveError(f"bad CRC for {info.filename}")
+        return data
@@ -0,0 +1,105 @@
+"""Multi-profile batch queue.
+
+A batch is a list of target profiles that are downloaded by a small pool of
+concurrent jobs. Every job writes below an output folder that is passed to it
+explicitly (never through the process-wide working directory), and keeps its
+own status so a long overnight mirror can be followed account by account.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PARALLEL_PROFILES = 2
+MAX_PARALLEL_PROFILES = 8
+
+# Job states
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+DONE = "DONE"
+FAILED = "FAILED"
+
+
+def parse_profile_list(text):
+    """Split pasted text into unique profile names, keeping their order.
+
+    Names may be separated by commas, semicolons, spaces or newlines, may carry
+    a leading ``@`` or a full profile URL, and ``#`` starts a comment.
+    """
+    profiles = []
+    seen = set()
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        for token in re.split(r"[\s,;]+", line):
+            token = token.strip().rstrip("/")
+            if "instagram.com/" in token:
+                token = token.split("instagram.com/", 1)[1].split("/", 1)[0]
+            token = token.lstrip("@")
+            if token and token.lower() not in seen:
+                seen.add(token.lower())
+                profiles.append(token)
+    return profiles
+
+
+def load_profile_list(path):
+    with open(path, encoding="utf-8") as f:
+        return parse_profile_list(f.read())
+
+
+class BatchJob:
+    def __init__(self, profile, folder):
+        self.profile = profile
+        self.folder = folder
+        self.state = QUEUED
+        self.count = 0
+        self.error = None
+        # Instagram user ID, once the profile was looked up
+        self.userid = None
+
+    def __repr__(self):
+        return f"BatchJob({self.profile!r}, state={self.state})"
+
+    def describe(self):
+        if self.state == DONE:
+            return f"{self.profile}: {self.state} ({self.count} items)"
+        if self.state == FAILED:
+            return f"{self.profile}: {self.state} ({self.error})"
+        return f"{self.profile}: {self.state}"
+
+
+class BatchScheduler:
+    def __init__(self, run_job, max_parallel=DEFAULT_PARALLEL_PROFILES):
+        """*run_job* is called as ``run_job(job)`` on a pool thread and returns
+        the number of downloaded items; raising marks the job as failed."""
+        self.run_job = run_job
+        self.max_parallel = max(1, min(int(max_parallel), MAX_PARALLEL_PROFILES))
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Leave the jobs that have not started yet in the QUEUED state."""
+        self._stop.set()
+
+    def run(self, jobs, on_update=None):
+        """Run all *jobs* and block until they are finished.
+
+        ``on_update(job)`` is called from the pool threads whenever a job
+        changes state.
+        """
+        def _run(job):
+            if self._stop.is_set():
+                return
+            job.state = RUNNING
+            if on_update:
+                on_update(job)
+            try:
+                job.count = self.run_job(job) or 0
+                job.state = DONE
+            except Exception as e:
+                job.error = e
+                job.state = FAILED
+            if on_update:
+                on_update(job)
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            # list() so that unexpected errors in _run surface here
+            list(pool.map(_run, jobs))
+        return jobs
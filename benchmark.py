@@ -0,0 +1,242 @@
+"""Offline download benchmark.
+
+Runs the real download path (``Downloader`` -> ``MediaLoader`` ->
+``MediaTransfer``) against the local stand-in server of ``fake_instagram`` and
+reports throughput, memory peak and request counts. No network access is
+needed, so it can gate performance regressions::
+
+    python benchmark.py --json baseline.json
+    # ... change something ...
+    python benchmark.py --baseline baseline.json --tolerance 0.15
+
+With ``--baseline`` the exit code is 1 when throughput dropped, or memory or
+the request count grew, by more than the tolerance.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from download_engine import DEFAULT_WORKERS
+from batch import DEFAULT_PARALLEL_PROFILES
+from downloader_core import Downloader, DownloadOptions, has_instaloader
+from rate_limit import RequestScheduler
+from archive import ArchiveReader, FORMATS as ARCHIVE_FORMATS, INDEX_SUFFIX
+
+MEDIA_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".mp4")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmark",
+                                     description="Benchmark the download path against a local fake Instagram.")
+    data = parser.add_argument_group("synthetic profiles")
+    data.add_argument("--profiles", type=int, default=2, help="number of profiles (default: 2)")
+    data.add_argument("--posts", type=int, default=48, help="posts per profile (default: 48)")
+    data.add_argument("--sidecar-every", type=int, default=4, help="every Nth post is a sidecar (default: 4)")
+    data.add_argument("--sidecar-items", type=int, default=3, help="media per sidecar (default: 3)")
+    data.add_argument("--video-every", type=int, default=5, help="every Nth post is a video (default: 5)")
+    data.add_argument("--image-kb", type=int, default=150, help="image size in KiB (default: 150)")
+    data.add_argument("--video-mb", type=float, default=4, help="video size in MiB (default: 4)")
+    server = parser.add_argument_group("server behaviour")
+    server.add_argument("--latency-ms", type=float, default=20, help="added to every response (default: 20)")
+    server.add_argument("--bandwidth-mbps", type=float, default=0,
+                        help="media bandwidth per response in MB/s, 0 for unlimited (default: 0)")
+    server.add_argument("--throttle-every", type=int, default=0,
+                        help="answer every Nth media request with 429 (default: never)")
+    server.add_argument("--metadata-fail-every", type=int, default=0,
+                        help="answer every Nth metadata request with --metadata-status (default: never)")
+    server.add_argument("--metadata-status", type=int, choices=(429, 503), default=503,
+                        help="status of refused metadata requests (default: 503)")
+    run = parser.add_argument_group("download configuration")
+    run.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    run.add_argument("--parallel-profiles", type=int, default=DEFAULT_PARALLEL_PROFILES)
+    run.add_argument("--metadata", action="store_true", help="also save .json metadata")
+    run.add_argument("--dedupe", action="store_true", help="use a (fresh) content-addressed store")
+    run.add_argument("--archive", choices=ARCHIVE_FORMATS, help="write one archive per profile")
+    parser.add_argument("--rounds", type=int, default=1, help="run N times and keep the fastest (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for instaloader's random request pauses")
+    parser.add_argument("--json", metavar="PATH", help="write the result as JSON to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with a result written by --json")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression against the baseline (default: 0.2)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the download log")
+    return parser
+
+
+def config_of(args):
+    """The settings that must match for two results to be comparable."""
+    keys = ("profiles", "posts", "sidecar_every", "sidecar_items", "video_every", "image_kb", "video_mb",
+            "latency_ms", "bandwidth_mbps", "throttle_every", "metadata_fail_every", "metadata_status", "workers",
+            "parallel_profiles", "metadata", "dedupe", "archive")
+    return {key: getattr(args, key) for key in keys}
+
+
+def count_media(folder):
+    entries = []
+    for root, _dirs, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path + INDEX_SUFFIX):
+                with ArchiveReader(path) as archive:
+                    entries += archive.members()
+            else:
+                entries.append((name, os.path.getsize(path)))
+    sizes = [size for name, size in entries if name.lower().endswith(MEDIA_EXTENSIONS)]
+    return len(sizes), sum(sizes)
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_round(args, workdir):
+    from fake_instagram import FakeProfile, FakeInstagram, route_requests
+
+    profiles = [FakeProfile(f"bench_{i:03d}", posts=args.posts, sidecar_every=args.sidecar_every,
+                            sidecar_items=args.sidecar_items, video_every=args.video_every,
+                            image_bytes=args.image_kb * 1024, video_bytes=int(args.video_mb * 1024 * 1024))
+                for i in range(args.profiles)]
+    folder = os.path.join(workdir, "out")
+    options = DownloadOptions(folder, include_metadata=args.metadata, workers=args.workers,
+                              parallel_profiles=args.parallel_profiles,
+                              blob_store=os.path.join(workdir, "blobs") if args.dedupe else None,
+                              archive=args.archive,
+                              # Every round must request everything again
+                              response_cache=None)
+
+    def on_event(kind, data):
+        if kind == "log" and args.verbose:
+            print(data["message"], file=sys.__stdout__, flush=True)
+
+    server = FakeInstagram(profiles, latency=args.latency_ms / 1000,
+                           bandwidth=args.bandwidth_mbps * 1e6 or None,
+                           throttle_every=args.throttle_every, metadata_fail_every=args.metadata_fail_every,
+                           metadata_status=args.metadata_status)
+    # A fresh scheduler so earlier rounds do not leave their budgets behind
+    scheduler = RequestScheduler()
+    core = Downloader(options, on_event=on_event, scheduler=scheduler)
+    random.seed(args.seed)
+    with server, route_requests(server.url), open(os.devnull, "w") as devnull:
+        # instaloader prints every file name to stdout
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        tracemalloc.start()
+        start = time.perf_counter()
+        with quiet:
+            jobs = core.run([p.username for p in profiles])
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        served = server.stats()
+
+    snapshots = core.metrics_snapshot()
+    posts = sum(s["posts_done"] for s in snapshots)
+    files, size = count_media(folder)
+    return {
+        "elapsed": round(elapsed, 3),
+        "posts": posts,
+        "posts_failed": sum(s["posts_failed"] for s in snapshots),
+        "jobs_failed": sum(1 for job in jobs if job.error is not None),
+        "files": files,
+        "expected_files": sum(p.total_media() for p in profiles),
+        "bytes": size,
+        "posts_per_second": round(posts / elapsed, 3),
+        "mb_per_second": round(size / elapsed / 1e6, 3),
+        "peak_memory_mb": round(peak / (1024 * 1024), 2),
+        "max_rss_mb": max_rss_mb(),
+        "requests": served["requests"],
+        "total_requests": sum(served["requests"].values()),
+        "bytes_sent": served["bytes_sent"],
+        "throttled": served["throttled"],
+        "retries": sum(s["retries"] for s in snapshots),
+        "throttle_wait": round(sum(s["throttle_wait"] for s in snapshots), 3),
+        "scheduler": scheduler.stats(),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Regressions of *result* against *baseline*, as printable lines."""
+    regressions = []
+    for key in ("posts_per_second", "mb_per_second"):
+        floor = baseline[key] * (1 - tolerance)
+        if result[key] < floor:
+            regressions.append(f"{key}: {result[key]} < {floor:.3f} (baseline {baseline[key]})")
+    for key in ("peak_memory_mb", "total_requests"):
+        ceiling = baseline[key] * (1 + tolerance)
+        if result[key] > ceiling:
+            regressions.append(f"{key}: {result[key]} > {ceiling:.3f} (baseline {baseline[key]})")
+    return regressions
+
+
+def print_result(result):
+    print(f">> {result['posts']} posts, {result['files']}/{result['expected_files']} files, "
+          f"{result['bytes'] / 1e6:.1f} MB in {result['elapsed']:.2f}s")
+    print(f">> THROUGHPUT: {result['posts_per_second']:.2f} posts/s | {result['mb_per_second']:.2f} MB/s")
+    rss = "" if result["max_rss_mb"] is None else f" | max RSS {result['max_rss_mb']:.1f} MB"
+    print(f">> MEMORY: peak {result['peak_memory_mb']:.2f} MB (traced){rss}")
+    requests = ", ".join(f"{kind} {count}" for kind, count in sorted(result["requests"].items()))
+    print(f">> REQUESTS: {result['total_requests']} ({requests}) | throttled {result['throttled']} | "
+          f"retries {result['retries']} | waited {result['throttle_wait']:.1f}s")
+    if result["posts_failed"] or result["jobs_failed"]:
+        print(f">> FAILURES: {result['posts_failed']} posts, {result['jobs_failed']} jobs")
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not has_instaloader():
+        print(">> ERROR: instaloader is not installed (pip install instaloader)", file=sys.stderr)
+        return 2
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"could not read baseline: {e}")
+
+    rounds = []
+    for i in range(max(1, args.rounds)):
+        workdir = tempfile.mkdtemp(prefix="insta_bench_")
+        try:
+            rounds.append(run_round(args, workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if args.rounds > 1:
+            print(f">> ROUND {i + 1}: {rounds[-1]['elapsed']:.2f}s")
+    result = min(rounds, key=lambda r: r["elapsed"])
+    result["config"] = config_of(args)
+    print_result(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    ok = result["files"] == result["expected_files"] and not result["jobs_failed"]
+    if not ok:
+        print(">> ERROR: the download was incomplete")
+    if baseline is not None:
+        if baseline.get("config") != result["config"]:
+            print(">> WARNING: the baseline was recorded with different settings")
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f">> REGRESSION: {line}")
+        if not regressions:
+            print(f">> NO REGRESSION (tolerance {args.tolerance:.0%})")
+        ok = ok and not regressions
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
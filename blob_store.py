@@ -0,0 +1,139 @@
+"""Content-addressed media store shared across profiles and save folders.
+
+Every downloaded media file is hashed once (SHA-256) and kept a single time
+under ``<root>/objects/<xx>/<sha256><ext>``. The file inside the profile folder
+becomes a hardlink to that blob (a symlink, or as a last resort a copy, when
+hardlinks are not possible).
+
+The store also remembers which CDN asset each blob came from. Instagram CDN
+URLs are signed and change between requests, but their file name is a stable
+asset ID, so a repost that is already in the store is linked in place without
+being downloaded again.
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+HARDLINK = "hardlink"
+SYMLINK = "symlink"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256   TEXT PRIMARY KEY,
+    ext      TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    asset_id TEXT PRIMARY KEY,
+    sha256   TEXT NOT NULL REFERENCES blobs(sha256)
+);
+"""
+
+
+def asset_id(url):
+    """Stable ID of a CDN asset: the file name part of its URL path."""
+    return os.path.basename(urlsplit(url).path) or None
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root, link_mode=HARDLINK):
+        self.root = root
+        self.link_mode = link_mode
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+        # Counters
+        self.linked = 0
+        self.saved_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def blob_path(self, sha256, ext):
+        return os.path.join(self.root, "objects", sha256[:2], sha256 + ext)
+
+    def lookup(self, url):
+        """Path of the blob already fetched for *url*'s asset, or None."""
+        asset = asset_id(url)
+        if not asset:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blobs.sha256, blobs.ext FROM assets JOIN blobs USING (sha256) "
+                "WHERE asset_id = ?", (asset,)).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(*row)
+        return path if os.path.isfile(path) else None
+
+    def materialize(self, blob, dest):
+        """Expose *blob* at *dest* without downloading anything."""
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        self._link(blob, dest)
+        with self._lock:
+            self.linked += 1
+            self.saved_bytes += os.path.getsize(blob)
+
+    def ingest(self, path, url=None):
+        """Move a freshly downloaded file into the store and link it back.
+
+        Returns the blob path. When identical content is already stored the new
+        copy is dropped in favour of a link to the existing blob.
+        """
+        sha256 = file_sha256(path)
+        ext = os.path.splitext(path)[1]
+        size = os.path.getsize(path)
+        with self._lock:
+            row = self._conn.execute("SELECT ext FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            blob = self.blob_path(sha256, row[0] if row else ext)
+            if os.path.isfile(blob):
+                os.remove(path)
+                self.linked += 1
+                self.saved_bytes += size
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                shutil.move(path, blob)
+            self._conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+                               (sha256, os.path.splitext(blob)[1], size, time.time()))
+            asset = asset_id(url) if url else None
+            if asset:
+                self._conn.execute("INSERT OR REPLACE INTO assets VALUES (?, ?)", (asset, sha256))
+            self._conn.commit()
+        self._link(blob, path)
+        return blob
+
+    def _link(self, blob, dest):
+        if self.link_mode == HARDLINK:
+            try:
+                os.link(blob, dest)
+                return
+            except OSError:
+                # Different filesystem or no hardlink support
+                pass
+        try:
+            os.symlink(os.path.abspath(blob), dest)
+        except OSError:
+            shutil.copy2(blob, dest)
+
+    def stats(self):
+        with self._lock:
+            blobs, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"blobs": blobs, "bytes": size, "linked": self.linked, "saved_bytes": self.saved_bytes}
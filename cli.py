@@ -0,0 +1,254 @@
+"""Command-line front end for the headless download core.
+
+Usage examples::
+
+    python cli.py cristiano
+    python cli.py -l accounts.txt -o /data/mirror --parallel-profiles 4 --fast-update
+    python cli.py someone --stories --login my_account
+    python cli.py someone --since 2024-01-01 --only videos --max-posts 50
+    python cli.py someone --metadata-store
+    python cli.py someone --postprocess thumbnail,phash,reencode --quality 80
+    python cli.py someone --export-metadata
+    python cli.py -l accounts.txt -o /data/cold --archive tar.zst
+    python cli.py -l accounts.txt -o /data/mirror --watch --stories --login my_account
+
+Runs without a display: tkinter is never imported.
+"""
+import argparse
+import getpass
+import multiprocessing
+import os
+import sys
+import threading
+
+from download_engine import DEFAULT_WORKERS
+from batch import parse_profile_list, load_profile_list, DEFAULT_PARALLEL_PROFILES, FAILED
+from postprocess import (parse_tasks, TASKS, DEFAULT_THUMBNAIL_SIZE, DEFAULT_MAX_SIDE,
+                         DEFAULT_QUALITY)
+from post_filters import PostFilter, parse_date, MEDIA_TYPES, ALL
+from archive import FORMATS as ARCHIVE_FORMATS, TAR_ZST, HAS_ZSTD
+from downloader_core import (Downloader, DownloadOptions, LoginCancelled, force_utf8_console, has_instaloader,
+                             DEFAULT_BLOB_STORE, DEFAULT_RESPONSE_CACHE)
+from watch import Watcher, DEFAULT_INTERVAL, DEFAULT_STORY_INTERVAL, DEFAULT_BUDGET
+
+
+def date_arg(text):
+    try:
+        return parse_date(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {text!r}, expected YYYY-MM-DD")
+
+
+def positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"invalid count {text!r}, expected a positive number")
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="insta-downloader",
+                                     description="Download Instagram posts, videos and stories.")
+    parser.add_argument("profiles", nargs="*", help="target profile(s)")
+    parser.add_argument("-l", "--list", metavar="FILE",
+                        help="read target profiles from FILE (one per line, '#' starts a comment)")
+    parser.add_argument("-o", "--output", metavar="FOLDER", default=os.getcwd(),
+                        help="save folder; each profile goes to FOLDER/<username> (default: current directory)")
+    parser.add_argument("--metadata", action="store_true", help="also save .json metadata and .txt captions")
+    parser.add_argument("--metadata-store", action="store_true",
+                        help="keep metadata in one SQLite store per profile instead of per-post .json/.txt files")
+    parser.add_argument("--export-metadata", action="store_true",
+                        help="write the metadata stores of the given profiles back out as per-post files and exit")
+    parser.add_argument("--stories", action="store_true", help="also download stories (requires --login)")
+    parser.add_argument("--login", metavar="USER", help="log in as USER (password/2FA are prompted)")
+    parser.add_argument("--no-saved-session", action="store_true",
+                        help="ignore the saved login session and ask for the password again")
+    parser.add_argument("--fast-update", action="store_true", help="stop at the first already downloaded post")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="ignore pagination checkpoints of interrupted runs and start from the newest post")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the cache of profile lookups and post pages "
+                             f"({DEFAULT_RESPONSE_CACHE}, kept for minutes to hours)")
+    parser.add_argument("--dedupe", nargs="?", metavar="DIR", const=DEFAULT_BLOB_STORE,
+                        help=f"store media once in a content-addressed store and hardlink it into the "
+                             f"profile folders (default store: {DEFAULT_BLOB_STORE})")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS,
+                        help="append each profile to one FOLDER/<username>.<format> archive instead of "
+                             "writing loose files (tar.zst needs zstandard)")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="keep job metrics (throughput, latency, retries, ETA) in PATH: "
+                             "Prometheus text if it ends in .prom, JSON otherwise")
+    filters = parser.add_argument_group("filters (checked before any media is downloaded)")
+    filters.add_argument("--since", type=date_arg, metavar="YYYY-MM-DD",
+                         help="only posts from this day on; pagination stops at the first older post")
+    filters.add_argument("--until", type=date_arg, metavar="YYYY-MM-DD", help="only posts up to this day")
+    filters.add_argument("--only", choices=MEDIA_TYPES, default=ALL,
+                         help="posts (images and sidecars), videos or reels only (default: all)")
+    filters.add_argument("--skip-sidecars", action="store_true", help="skip multi-media posts")
+    filters.add_argument("--max-posts", type=positive_int, metavar="N", help="at most the N newest matching posts")
+    post = parser.add_argument_group("post-processing (needs Pillow)")
+    post.add_argument("--postprocess", metavar="TASKS",
+                      help=f"comma-separated tasks run on new images in a process pool: {', '.join(TASKS)}")
+    post.add_argument("--thumbnail-size", type=int, default=DEFAULT_THUMBNAIL_SIZE, metavar="PX",
+                      help=f"longest side of thumbnails (default: {DEFAULT_THUMBNAIL_SIZE})")
+    post.add_argument("--max-side", type=int, default=DEFAULT_MAX_SIDE, metavar="PX",
+                      help=f"reencode: shrink images to this longest side (default: {DEFAULT_MAX_SIDE})")
+    post.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                      help=f"reencode: JPEG quality (default: {DEFAULT_QUALITY})")
+    watch = parser.add_argument_group("watch mode (keeps running until Ctrl+C)")
+    watch.add_argument("--watch", action="store_true",
+                       help="keep polling the profiles and download only new posts (and stories with --stories)")
+    watch.add_argument("--interval", type=float, default=DEFAULT_INTERVAL / 60, metavar="MIN",
+                       help=f"minutes between two polls of a profile, stretched to stay within --budget "
+                            f"(default: {DEFAULT_INTERVAL // 60})")
+    watch.add_argument("--story-interval", type=float, default=DEFAULT_STORY_INTERVAL / 60, metavar="MIN",
+                       help=f"minutes between two story checks of all profiles (default: {DEFAULT_STORY_INTERVAL // 60})")
+    watch.add_argument("--budget", type=int, default=DEFAULT_BUDGET, metavar="N",
+                       help=f"at most N profile/story requests per hour, all profiles together "
+                            f"(default: {DEFAULT_BUDGET})")
+    watch.add_argument("--verbose", action="store_true", help="log every poll, not only new items and errors")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"parallel media downloads per profile (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--parallel-profiles", type=int, default=DEFAULT_PARALLEL_PROFILES,
+                        help=f"profiles downloaded at the same time (default: {DEFAULT_PARALLEL_PROFILES})")
+    return parser
+
+
+def print_event(kind, data):
+    if kind == "log":
+        print(data["message"], flush=True)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    profiles = parse_profile_list(" ".join(args.profiles))
+    if args.list:
+        try:
+            profiles += [p for p in load_profile_list(args.list) if p.lower() not in {q.lower() for q in profiles}]
+        except OSError as e:
+            parser.error(f"could not read list: {e}")
+    if not profiles:
+        parser.error("at least one target profile is required")
+    if args.stories and not args.login:
+        parser.error("--stories requires --login")
+    try:
+        params = {"thumbnail": {"size": args.thumbnail_size},
+                  "reencode": {"max_side": args.max_side, "quality": args.quality}}
+        postprocess = [(name, params.get(name, {})) for name, _ in parse_tasks(args.postprocess)]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.archive and (args.dedupe or postprocess or args.metadata_store):
+        parser.error("--archive cannot be combined with --dedupe, --postprocess or --metadata-store "
+                     "(they work on loose files)")
+    if args.watch and (args.interval <= 0 or args.story_interval <= 0 or args.budget <= 0):
+        parser.error("--interval, --story-interval and --budget must be positive")
+    if args.archive == TAR_ZST and not HAS_ZSTD:
+        parser.error("--archive tar.zst needs zstandard (pip install zstandard)")
+    if not has_instaloader():
+        print(">> ERROR: instaloader is not installed (pip install instaloader)", file=sys.stderr)
+        return 2
+
+    options = DownloadOptions(
+        os.path.abspath(args.output),
+        include_metadata=args.metadata,
+        stories=args.stories,
+        fast_update=args.fast_update,
+        resume=not args.no_resume,
+        workers=args.workers,
+        parallel_profiles=args.parallel_profiles,
+        blob_store=args.dedupe,
+        metrics_file=args.metrics_file,
+        metadata_store=args.metadata_store,
+        post_filter=PostFilter(since=args.since, until=args.until, media=args.only,
+                               skip_sidecars=args.skip_sidecars, max_posts=args.max_posts),
+        postprocess=postprocess,
+        archive=args.archive,
+        response_cache=None if args.no_cache else DEFAULT_RESPONSE_CACHE,
+    )
+    watcher = None
+    if args.watch:
+        watcher = Watcher(options, profiles, on_event=print_event, interval=args.interval * 60,
+                          story_interval=args.story_interval * 60, budget=args.budget, verbose=args.verbose)
+        core = watcher.core
+    else:
+        core = Downloader(options, on_event=print_event)
+
+    if args.export_metadata:
+        try:
+            core.export_metadata(profiles)
+        except Exception as e:
+            print(f">> ERROR: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    if args.login:
+        try:
+            core.login(args.login,
+                       lambda user: getpass.getpass(f"Enter Password for '{user}': "),
+                       lambda user: input(f"Enter 2FA Code (SMS/App) for '{user}': ").strip(),
+                       reuse_session=not args.no_saved_session)
+        except LoginCancelled:
+            print(">> LOGIN CANCELLED.", file=sys.stderr)
+            return 1
+        except Exception:
+            # The core has already logged why
+            return 1
+
+    if watcher is not None:
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            # The way to end watch mode; run() has already stopped
+            pass
+        return 0
+
+    # On a worker thread, so that Ctrl+C reaches the main thread while
+    # profiles are running rather than after the batch pool has joined them
+    result = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            result["jobs"] = core.run(profiles)
+        except Exception as e:
+            result["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=run, name="download", daemon=True).start()
+    try:
+        while not done.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        print(">> INTERRUPTED, STOPPING AFTER THE POSTS IN FLIGHT (Ctrl+C again to quit now)...",
+              file=sys.stderr)
+        core.stop()
+        try:
+            while not done.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+        return 130
+    if "error" in result:
+        print(f">> ERROR: {result['error']}", file=sys.stderr)
+        return 1
+    jobs = result["jobs"]
+
+    failed = [job for job in jobs if job.state == FAILED]
+    if failed:
+        print(f">> {len(failed)} OF {len(jobs)} PROFILES FAILED.", file=sys.stderr)
+        return 1
+    print(">> ALL TASKS COMPLETED SUCCESSFULLY.")
+    return 0
+
+
+if __name__ == "__main__":
+    # Post-processing uses a process pool, also from frozen builds
+    multiprocessing.freeze_support()
+    force_utf8_console()
+    sys.exit(main())
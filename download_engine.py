@@ -0,0 +1,119 @@
+"""Parallel post download engine.
+
+Post iteration (the GraphQL pagination) runs on a single producer thread that
+feeds a bounded queue. A pool of worker threads pulls posts off that queue and
+fetches their media at the same time. Results are handed back to the caller
+in the original post order, so progress reporting reads exactly like the old
+one-post-at-a-time loop.
+"""
+import queue
+import threading
+
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 16
+
+# Marker put on the result queue by the producer once pagination has ended
+_PRODUCER_DONE = object()
+
+
+class ParallelDownloader:
+    def __init__(self, download, workers=DEFAULT_WORKERS, queue_size=None):
+        """*download* is called as ``download(post)`` on a worker thread and
+        returns True when something new was written."""
+        self.download = download
+        self.workers = max(1, min(int(workers), MAX_WORKERS))
+        # Keep pagination only a little ahead of the workers
+        self.queue_size = queue_size or self.workers * 2
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stop paginating; posts already queued are skipped and not reported.
+
+        An engine is meant for a single ``run``; once stopped it stays stopped.
+        """
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def run(self, posts, on_result=None):
+        """Download every post yielded by *posts* and return the success count.
+
+        ``on_result(post, success, error)`` is called on the calling thread, in
+        the same order *posts* yielded them, for every post that was actually
+        processed (not for those skipped after ``stop()``). An exception
+        raised while paginating is re-raised once all queued posts have been
+        reported.
+        """
+        work = queue.Queue(maxsize=self.queue_size)
+        results = queue.Queue()
+
+        threads = [threading.Thread(target=self._produce, args=(posts, work, results), daemon=True)]
+        threads += [threading.Thread(target=self._work, args=(work, results), daemon=True)
+                    for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        pending = {}
+        next_seq = 0
+        total = None
+        error = None
+        count = 0
+        try:
+            while total is None or next_seq < total:
+                item = results.get()
+                if item[0] is _PRODUCER_DONE:
+                    _, total, error = item
+                    continue
+                pending[item[0]] = item
+                # Release results strictly in post order
+                while next_seq in pending:
+                    _, post, success, exc = pending.pop(next_seq)
+                    next_seq += 1
+                    if success is None:
+                        # Skipped after stop(): neither done nor failed
+                        continue
+                    if success:
+                        count += 1
+                    if on_result:
+                        on_result(post, success, exc)
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+
+        if error is not None:
+            raise error
+        return count
+
+    def _produce(self, posts, work, results):
+        total = 0
+        error = None
+        try:
+            for post in posts:
+                if self._stop.is_set():
+                    break
+                work.put((total, post))
+                total += 1
+        except Exception as e:
+            error = e
+        finally:
+            for _ in range(self.workers):
+                work.put(None)
+            results.put((_PRODUCER_DONE, total, error))
+
+    def _work(self, work, results):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            seq, post = item
+            if self._stop.is_set():
+                results.put((seq, post, None, None))
+                continue
+            try:
+                success = self.download(post)
+                results.put((seq, post, bool(success), None))
+            except Exception as e:
+                results.put((seq, post, False, e))
@@ -0,0 +1,88 @@
+"""Persistent on-disk index of downloaded posts.
+
+The index lives as a small SQLite database inside the save folder and is keyed
+by (profile, shortcode). It lets a re-sync skip posts that are already on disk
+without asking instaloader to stat every file, and powers the incremental
+("fast update") mode which stops paginating at the first known post.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+INDEX_FILENAME = ".insta_index.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    profile       TEXT NOT NULL,
+    shortcode     TEXT NOT NULL,
+    mediaid       INTEGER,
+    typename      TEXT,
+    date_utc      TEXT,
+    downloaded_at REAL NOT NULL,
+    PRIMARY KEY (profile, shortcode)
+)
+"""
+
+
+class DownloadIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    @classmethod
+    def for_folder(cls, folder):
+        """Open (or create) the index stored in *folder*."""
+        os.makedirs(folder, exist_ok=True)
+        return cls(os.path.join(folder, INDEX_FILENAME))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def contains(self, profile, shortcode):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM downloads WHERE profile = ? AND shortcode = ?",
+                (profile.lower(), shortcode)).fetchone()
+        return row is not None
+
+    def add(self, profile, post):
+        """Record *post* as downloaded for *profile*."""
+        date_utc = getattr(post, "date_utc", None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?)",
+                (profile.lower(), post.shortcode, getattr(post, "mediaid", None),
+                 getattr(post, "typename", None),
+                 date_utc.isoformat() if date_utc else None, time.time()))
+            self._conn.commit()
+
+    def count(self, profile):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM downloads WHERE profile = ?", (profile.lower(),)).fetchone()[0]
+
+    def filter_posts(self, profile, posts, fast_update=False):
+        """Yield the posts of *profile* that are not in the index yet.
+
+        With *fast_update* iteration stops at the first indexed post, so an
+        unchanged profile costs a single page request. Pinned posts are out of
+        date order and never end the iteration.
+        """
+        for post in posts:
+            if not self.contains(profile, post.shortcode):
+                yield post
+            elif fast_update and not getattr(post, "is_pinned", False):
+                return
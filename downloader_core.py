@@ -0,0 +1,494 @@
+"""Headless download core.
+
+Everything needed to log in and mirror profiles, without tkinter. Front ends
+(the Tk app, the command line) drive a ``Downloader`` and follow its progress
+through a single event callback::
+
+    def on_event(kind, data):
+        ...
+
+with these event kinds:
+
+* ``"log"``    - ``data["message"]`` is a console line, already formatted
+* ``"job"``    - ``data["job"]`` (a ``batch.BatchJob``) changed state
+* ``"post"``   - a post finished: ``job``, ``post``, ``success``, ``error``
+* ``"finished"`` - the run is over: ``data["jobs"]``
+
+Live throughput/latency numbers are available at any time from
+``Downloader.metrics_snapshot()``.
+
+instaloader is only imported once a loader is actually needed, so importing
+this module stays cheap.
+"""
+import io
+import os
+import sys
+import threading
+
+from download_engine import ParallelDownloader, DEFAULT_WORKERS
+from download_index import DownloadIndex
+from metadata_store import MetadataStore, METADATA_FILENAME
+from batch import BatchJob, BatchScheduler, DEFAULT_PARALLEL_PROFILES
+from rate_limit import shared_scheduler
+from metrics import JobMetrics, MetricsExporter
+
+# Per-user data shared by all save folders (dedup store, sessions, ...)
+APP_DATA_DIR = os.path.join(os.path.expanduser("~"), ".insta_downloader")
+DEFAULT_BLOB_STORE = os.path.join(APP_DATA_DIR, "blobs")
+DEFAULT_RESPONSE_CACHE = os.path.join(APP_DATA_DIR, "response_cache.sqlite3")
+# filename_target of a profile's stories
+STORY_TARGET = "{}/%Y-%m-%d_%H-%M-%S"
+
+
+def force_utf8_console():
+    """Force UTF-8 for stdout/stderr to avoid charmap errors (Only if console exists)"""
+    if sys.stdout is not None:
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    if sys.stderr is not None:
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+
+def has_instaloader():
+    try:
+        import instaloader
+        return True
+    except ImportError:
+        return False
+
+
+class LoginCancelled(Exception):
+    """The user gave no password or 2FA code."""
+
+
+class DownloadOptions:
+    def __init__(self, folder, include_metadata=False, stories=False, fast_update=False,
+                 workers=DEFAULT_WORKERS, parallel_profiles=DEFAULT_PARALLEL_PROFILES, blob_store=None,
+                 metrics_file=None, metadata_store=False, post_filter=None, postprocess=None, resume=True,
+                 archive=None, response_cache=DEFAULT_RESPONSE_CACHE, cache_ttl=None):
+        self.folder = folder
+        # Stream each profile into <folder>/<profile>.<archive> (archive.FORMATS) instead of loose files
+        self.archive = archive
+        # Metadata goes to one SQLite store per profile instead of per-post .json/.txt files
+        # (with archive output the .json/.txt files go into the archive instead)
+        self.metadata_store = metadata_store and not archive
+        self.include_metadata = include_metadata or metadata_store
+        self.stories = stories
+        self.fast_update = fast_update
+        # Continue an interrupted profile from its pagination checkpoint
+        self.resume = resume
+        self.workers = workers
+        self.parallel_profiles = parallel_profiles
+        # Directory of the content-addressed dedup store, or None to disable it
+        # (both it and post-processing work on loose files)
+        self.blob_store = None if archive else blob_store
+        # SQLite file caching profile lookups and post pages between runs, or None to bypass it
+        self.response_cache = response_cache
+        # Per-kind time to live overrides of the response cache (see response_cache.DEFAULT_TTL)
+        self.cache_ttl = cache_ttl
+        # JSON (or Prometheus text for *.prom) file refreshed with job metrics, or None
+        self.metrics_file = metrics_file
+        # post_filters.PostFilter applied while paginating, or None
+        self.post_filter = post_filter
+        # postprocess tasks ((name, params) pairs) run on new images in a process pool
+        self.postprocess = [] if archive else list(postprocess or [])
+
+
+class Downloader:
+    def __init__(self, options, on_event=None, scheduler=None, prefetched=None):
+        self.options = options
+        self.on_event = on_event
+        # All jobs (and all Downloaders, unless told otherwise) share one request budget
+        self.scheduler = scheduler or shared_scheduler()
+        # Profile structures looked up ahead of time (prewarm.Prewarmer.take), by lowercase name
+        self.prefetched = dict(prefetched or {})
+        self.login_user = None
+        self._session = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._batch = None
+        self._engines = set()
+        self._blob_store = None
+        self._response_cache = None
+        self._postprocessor = None
+        self.metrics = {}
+
+    # --- Events ---
+
+    def emit(self, kind, **data):
+        if self.on_event:
+            self.on_event(kind, data)
+
+    def log(self, text, job=None):
+        if job is not None:
+            text = f"[{job.profile}] {text}"
+        self.emit("log", message=f">> {text}")
+
+    # --- Loader / Login ---
+
+    def build_loader(self, folder=None):
+        """Create a loader writing to ``<folder>/<target>``, sharing the login session."""
+        from loader_ext import MediaLoader
+
+        # Output goes to <folder>/<target> without touching the process cwd
+        folder = folder or self.options.folder
+        escaped = folder.replace("{", "{{").replace("}", "}}")
+        loader = MediaLoader(
+            dirname_pattern=os.path.join(escaped, "{target}"),
+            download_pictures=True,
+            download_videos=True,
+            download_video_thumbnails=False,
+            download_geotags=False,
+            download_comments=False,
+            save_metadata=self.options.include_metadata,
+            compress_json=False,
+            post_metadata_txt_pattern="" if self.options.metadata_store else None,
+            scheduler=self.scheduler,
+            blob_store=self._open_blob_store(),
+            response_cache=self._open_response_cache()
+        )
+        if self._session is not None:
+            loader.load_session(self.login_user, self._session)
+        return loader
+
+    def _open_blob_store(self):
+        if not self.options.blob_store:
+            return None
+        with self._lock:
+            if self._blob_store is None:
+                from blob_store import BlobStore
+                self._blob_store = BlobStore(self.options.blob_store)
+            return self._blob_store
+
+    def _open_response_cache(self):
+        if not self.options.response_cache:
+            return None
+        with self._lock:
+            if self._response_cache is None:
+                from response_cache import ResponseCache
+                os.makedirs(os.path.dirname(self.options.response_cache) or ".", exist_ok=True)
+                self._response_cache = ResponseCache(self.options.response_cache, ttl=self.options.cache_ttl)
+            return self._response_cache
+
+    def login(self, username, ask_password, ask_two_factor, reuse_session=True):
+        """Log in as *username*, reusing a saved session when it is still valid.
+
+        ``ask_password(username)`` and ``ask_two_factor(username)`` are only
+        called when there is no usable saved session; they return the secret,
+        or None to cancel (which raises LoginCancelled). Login errors are logged
+        and re-raised. A successful login is saved to instaloader's session
+        file for *username*, so the next run can skip the login round-trips.
+        """
+        import instaloader
+
+        if reuse_session:
+            loader = self._restore_session(username)
+            if loader is not None:
+                self._use_session(loader, username)
+                return
+
+        password = ask_password(username)
+        if not password:
+            raise LoginCancelled("No password given")
+
+        loader = self.build_loader()
+        self.log(f"LOGGING IN AS: {username}...")
+        try:
+            loader.login(username, password)
+            self.log("LOGIN SUCCESS!")
+        except instaloader.TwoFactorAuthRequiredException:
+            # 2FA REQUIRED - Ask for Code
+            self.log("2FA REQUIRED! Asking for code...")
+            code = ask_two_factor(username)
+            if not code:
+                self.log("LOGIN CANCELLED (No 2FA Code).")
+                raise LoginCancelled("No 2FA code given")
+            try:
+                loader.two_factor_login(code)
+                self.log("2FA LOGIN SUCCESS!")
+            except Exception as e:
+                self.log(f"2FA FAILED: {e}")
+                raise
+        except Exception as e:
+            self.log(f"LOGIN FAILED: {e}")
+            raise
+
+        self._use_session(loader, username)
+        try:
+            loader.save_session_to_file()
+            self.log("SESSION SAVED.")
+        except OSError as e:
+            self.log(f"COULD NOT SAVE SESSION: {e}")
+
+    def _restore_session(self, username):
+        """A loader with the saved session of *username*, or None if there is no valid one."""
+        loader = self.build_loader()
+        try:
+            loader.load_session_from_file(username)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.log(f"SAVED SESSION UNREADABLE: {e}")
+            return None
+
+        # One lightweight query tells whether the cookies are still accepted
+        self.log(f"CHECKING SAVED SESSION FOR: {username}...")
+        try:
+            session_user = loader.test_login()
+        except Exception as e:
+            self.log(f"SESSION CHECK FAILED: {e}")
+            return None
+        if not session_user or session_user.lower() != username.lower():
+            self.log("SAVED SESSION EXPIRED, LOGGING IN AGAIN...")
+            return None
+        self.log("SESSION RESTORED (no password needed).")
+        return loader
+
+    def _use_session(self, loader, username):
+        # Every job gets its own loader that shares the logged-in session
+        self.login_user = username
+        self._session = loader.save_session()
+
+    # --- Download ---
+
+    def metrics_snapshot(self, running_only=False):
+        """Snapshots (dicts) of the metrics of this run's jobs."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        snapshots = [m.snapshot() for m in metrics]
+        return [s for s in snapshots if s["running"]] if running_only else snapshots
+
+    def stop(self):
+        """Stop after the posts that are currently in flight."""
+        self._stop.set()
+        with self._lock:
+            if self._batch:
+                self._batch.stop()
+            for engine in self._engines:
+                engine.stop()
+
+    def run(self, profiles):
+        """Download all *profiles* (a batch when more than one) and return the jobs."""
+        self._stop.clear()
+        folder = self.options.folder
+
+        if len(profiles) == 1:
+            self.log(f"TARGET: {profiles[0]}")
+        else:
+            self.log(f"BATCH: {len(profiles)} PROFILES, {self.options.parallel_profiles} AT ONCE")
+        self.log(f"SAVE TO: {folder}")
+
+        # Prepare Output Folder (passed to every job explicitly, no chdir)
+        os.makedirs(folder, exist_ok=True)
+
+        jobs = [BatchJob(profile, folder) for profile in profiles]
+        with self._lock:
+            self.metrics = {}
+        exporter = None
+        if self.options.metrics_file:
+            exporter = MetricsExporter(self.options.metrics_file, self.metrics_snapshot)
+            exporter.start()
+
+        def on_update(job):
+            if job.error is not None:
+                self.log(f"ERROR: {job.error}", job)
+            else:
+                self.log(job.state, job)
+            self.emit("job", job=job)
+
+        self._postprocessor = self._start_postprocessor()
+
+        with DownloadIndex.for_folder(folder) as index:
+            batch = BatchScheduler(lambda job: self.download_profile(self.build_loader(job.folder), job, index),
+                                   max_parallel=self.options.parallel_profiles)
+            with self._lock:
+                self._batch = batch
+            try:
+                batch.run(jobs, on_update=on_update)
+            finally:
+                with self._lock:
+                    self._batch = None
+                if self._postprocessor is not None:
+                    self._finish_postprocessor()
+                if exporter is not None:
+                    try:
+                        exporter.stop()
+                    except OSError as e:
+                        self.log(f"METRICS FILE ERROR: {e}")
+
+        if self._blob_store is not None:
+            stats = self._blob_store.stats()
+            self.log(f"DEDUP: {stats['linked']} files linked, {stats['saved_bytes'] / 1e6:.1f} MB saved")
+        if self._response_cache is not None:
+            from response_cache import format_stats
+            self.log(f"CACHE: {format_stats(self._response_cache.stats())}")
+
+        if len(jobs) > 1:
+            self.log("BATCH SUMMARY:")
+            for job in jobs:
+                self.log(f"  {job.describe()}")
+        self.emit("finished", jobs=jobs)
+        return jobs
+
+    def _start_postprocessor(self):
+        if not self.options.postprocess:
+            return None
+        from postprocess import PostProcessor, HAS_PIL
+        if not HAS_PIL:
+            self.log("POST-PROCESSING SKIPPED: Pillow is not installed (pip install Pillow)")
+            return None
+        names = ", ".join(task if isinstance(task, str) else task.__name__ for task, _ in self.options.postprocess)
+
+        def on_error(path, error):
+            self.log(f"POST-PROCESSING ERROR ({os.path.basename(path)}): {error}")
+
+        processor = PostProcessor(self.options.postprocess, on_error=on_error)
+        self.log(f"POST-PROCESSING: {names} ({processor.workers} processes)")
+        return processor.start()
+
+    def _finish_postprocessor(self):
+        processor, self._postprocessor = self._postprocessor, None
+        stopped = self._stop.is_set()
+        if not stopped and processor.pending():
+            self.log(f"FINISHING POST-PROCESSING ({processor.pending()} files)...")
+        processor.close(cancel=stopped)
+        stats = processor.stats()
+        self.log(f"POST-PROCESSED: {stats['done']} files, {stats['failed']} failed"
+                 + (f", {stats['saved_bytes'] / 1e6:.1f} MB saved" if stats["saved_bytes"] else ""))
+
+    def download_profile(self, loader, job, index):
+        """Download one profile of a (possibly single-entry) batch; returns the item count."""
+        metrics = JobMetrics(job.profile)
+        with self._lock:
+            self.metrics[job.profile.lower()] = metrics
+        loader.metrics = metrics
+        loader.postprocessor = self._postprocessor
+        try:
+            return self._download_profile(loader, job, index, metrics)
+        finally:
+            metrics.finish()
+            if loader.metadata_store is not None:
+                loader.metadata_store.close()
+            if loader.archive is not None:
+                loader.archive.close()
+            self.log(f"STATS: {metrics.summary()}", job)
+
+    def _download_profile(self, loader, job, index, metrics):
+        import instaloader
+
+        self.log("FETCHING PROFILE DATA...", job)
+        # Anonymous lookups only; a login may see a different profile
+        structure = self.prefetched.pop(job.profile.lower(), None) if self._session is None else None
+        if structure is not None:
+            prof = instaloader.load_structure(loader.context, structure)
+        else:
+            prof = instaloader.Profile.from_username(loader.context, job.profile)
+        target = prof.username
+        job.userid = prof.userid
+        metrics.total_posts = prof.mediacount
+        if self.options.metadata_store:
+            loader.metadata_store = MetadataStore.for_folder(os.path.join(job.folder, target))
+        if self.options.archive:
+            from archive import ArchiveWriter
+
+            loader.archive = ArchiveWriter.for_profile(job.folder, target, self.options.archive)
+            self.log(f"ARCHIVE: {loader.archive.path} ({len(loader.archive)} files already in it)", job)
+            if loader.archive.repaired:
+                self.log("ARCHIVE REPAIRED: it was not closed properly last time", job)
+
+        # Download Posts (pagination feeds a pool of parallel workers)
+        engine = ParallelDownloader(lambda post: loader.download_post(post, target=target),
+                                    workers=self.options.workers)
+        self.log(f"DOWNLOADING POSTS FOR: {target} ({engine.workers} workers)", job)
+        count = 0
+
+        def on_result(post, success, error):
+            nonlocal count
+            metrics.post_done(success, failed=error is not None)
+            self.emit("post", job=job, post=post, success=success, error=error)
+            if error is not None:
+                self.log(f"ERROR ({post.shortcode}): {error}", job)
+            else:
+                index.add(target, post)
+                if success:
+                    count += 1
+                    job.count = count
+                    if count % 5 == 0: self.log(f"Downloaded {count} items...", job)
+            if checkpoint is not None:
+                checkpoint.done(post, ok=error is None)
+
+        known = index.count(target)
+        metrics.skipped_posts = known
+        if known:
+            self.log(f"INDEX: {known} posts already downloaded", job)
+        posts = prof.get_posts()
+        post_filter = self.options.post_filter
+        filtering = post_filter is not None and post_filter.active
+        checkpoint = None
+        if self.options.resume:
+            from pagination_checkpoint import PaginationCheckpoint, CHECKPOINT_FILENAME
+
+            key = post_filter.describe() if filtering else ""
+            if loader.archive is not None:
+                # Next to the archive: no profile folder is created
+                checkpoint = PaginationCheckpoint(loader.archive.path + CHECKPOINT_FILENAME, key=key)
+            else:
+                checkpoint = PaginationCheckpoint.for_folder(os.path.join(job.folder, target), key=key)
+            skipped = checkpoint.resume(posts)
+            if skipped is not None:
+                self.log(f"RESUMING AFTER POST {skipped} (checkpoint of an interrupted run)", job)
+            elif checkpoint.discarded:
+                self.log(f"CHECKPOINT DISCARDED: {checkpoint.discarded}", job)
+            posts = checkpoint.track(posts)
+        if filtering:
+            self.log(f"FILTER: {post_filter.describe()}", job)
+            if post_filter.max_posts:
+                metrics.total_posts = min(metrics.total_posts, known + post_filter.max_posts)
+            posts = post_filter.apply(posts, on_stop=lambda reason: self.log(f"FILTER: {reason}, stopping", job),
+                                      taken=checkpoint.taken if checkpoint is not None else 0)
+            if checkpoint is not None:
+                posts = checkpoint.taken_posts(posts)
+        posts = index.filter_posts(target, posts, fast_update=self.options.fast_update)
+        with self._lock:
+            self._engines.add(engine)
+        completed = False
+        try:
+            if self._stop.is_set():
+                engine.stop()
+            engine.run(posts, on_result)
+            completed = not self._stop.is_set()
+        finally:
+            with self._lock:
+                self._engines.discard(engine)
+            if checkpoint is not None:
+                checkpoint.close(completed)
+
+        self.log(f"POSTS DONE. Total: {count}", job)
+
+        # Download Stories
+        if self.options.stories and not self._stop.is_set():
+            self.log("DOWNLOADING STORIES...", job)
+            loader.download_stories(userids=[prof.userid], filename_target=STORY_TARGET.format(target))
+            self.log("STORIES DONE.", job)
+        if loader.archive is not None:
+            # instaloader creates the profile folder for every post; with archive output it stays empty
+            try:
+                os.rmdir(os.path.join(job.folder, target))
+            except OSError:
+                pass
+        return count
+
+    def export_metadata(self, profiles, compress_json=False):
+        """Write the metadata stores of *profiles* back out as per-post files."""
+        from loader_ext import export_metadata
+
+        total = 0
+        for profile in profiles:
+            folder = os.path.join(self.options.folder, profile)
+            if not os.path.isfile(os.path.join(folder, METADATA_FILENAME)):
+                self.log(f"[{profile}] NO METADATA STORE IN {folder}")
+                continue
+            with MetadataStore.for_folder(folder) as store:
+                count = export_metadata(store, folder, profile, compress_json=compress_json)
+            self.log(f"[{profile}] EXPORTED METADATA OF {count} POSTS")
+            total += count
+        return total
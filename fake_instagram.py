@@ -0,0 +1,387 @@
+"""Local stand-in for Instagram, for offline benchmarks.
+
+``FakeInstagram`` serves synthetic profiles over plain HTTP on localhost, in
+the shapes the anonymous instaloader path expects:
+
+* ``/<username>/``                  - profile page with the embedded profile query
+* ``/api/v1/users/web_profile_info/`` - profile node with the first page of posts
+* ``/graphql/query``                - further pages of posts (``doc_id`` queries)
+* ``/v/<asset>``                    - media (images, sidecar children, videos),
+  with ``Range`` support so resumed transfers work
+
+Latency, bandwidth and throttling are configurable, and every request is
+counted by kind. ``route_requests()`` points all ``requests`` sessions of the
+process at the server, so the real download path runs unchanged with no
+network access.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PAGE_SIZE = 12
+CDN_HOST = "scontent.cdninstagram.com"
+# Hosts answered by the fake server once route_requests() is active
+ROUTED_HOSTS = ("instagram.com", "cdninstagram.com", "fbcdn.net")
+
+_BLOCK_SIZE = 64 * 1024
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class FakeProfile:
+    def __init__(self, username, posts=60, sidecar_every=4, sidecar_items=3, video_every=5,
+                 image_bytes=150 * 1024, video_bytes=4 * 1024 * 1024, pinned=0):
+        """A synthetic profile with *posts* posts, newest first.
+
+        Every *video_every*-th post is a video and every *sidecar_every*-th
+        (other) post a sidecar of *sidecar_items* media, the last of which is
+        a video. The first *pinned* posts are pinned (and older than the rest).
+        """
+        self.username = username
+        self.userid = int(hashlib.sha256(username.encode()).hexdigest()[:12], 16)
+        self.posts = posts
+        self.sidecar_every = sidecar_every
+        self.sidecar_items = sidecar_items
+        self.video_every = video_every
+        self.image_bytes = image_bytes
+        self.video_bytes = video_bytes
+        self.pinned = pinned
+        self.assets = {}        # asset name -> (size, content type)
+        self.nodes = [self._post_node(i) for i in range(posts)]
+
+    def _media(self, name, is_video):
+        asset = f"{self.username}_{name}.{'mp4' if is_video else 'jpg'}"
+        self.assets[asset] = ((self.video_bytes, "video/mp4") if is_video else (self.image_bytes, "image/jpeg"))
+        return f"https://{CDN_HOST}/v/{asset}?_nc_ht={CDN_HOST}&oh={hashlib.md5(asset.encode()).hexdigest()}"
+
+    def _post_node(self, i):
+        mediaid = self.userid * 10000 + (self.posts - i)
+        shortcode = f"F{mediaid:x}"
+        age = i - self.pinned if i >= self.pinned else self.posts + i
+        node = {
+            "id": str(mediaid),
+            "shortcode": shortcode,
+            "taken_at_timestamp": 1700000000 - age * 3600,
+            "owner": {"id": str(self.userid), "username": self.username},
+            "dimensions": {"height": 1080, "width": 1080},
+            "edge_media_to_caption": {"edges": [{"node": {"text": f"Synthetic post {i} #benchmark"}}]},
+            "edge_media_to_comment": {"count": 0},
+            "edge_media_preview_like": {"count": i * 7 % 1000},
+            "comments_disabled": False,
+            "is_video": False,
+        }
+        if i < self.pinned:
+            node["pinned_for_users"] = [{"id": str(self.userid), "username": self.username}]
+        if self.video_every and i % self.video_every == self.video_every - 1:
+            node.update(__typename="GraphVideo", is_video=True, video_view_count=i,
+                        display_url=self._media(f"{i}_thumb", False), video_url=self._media(f"{i}", True))
+        elif self.sidecar_every and i % self.sidecar_every == self.sidecar_every - 1:
+            children = []
+            for k in range(self.sidecar_items):
+                is_video = k == self.sidecar_items - 1
+                child = {"__typename": "GraphVideo" if is_video else "GraphImage",
+                         "id": str(mediaid * 100 + k), "shortcode": f"{shortcode}{k}", "is_video": is_video,
+                         "display_url": self._media(f"{i}_{k}{'_thumb' if is_video else ''}", False)}
+                if is_video:
+                    child["video_url"] = self._media(f"{i}_{k}", True)
+                children.append({"node": child})
+            node.update(__typename="GraphSidecar", display_url=children[0]["node"]["display_url"],
+                        edge_sidecar_to_children={"edges": children})
+        else:
+            node.update(__typename="GraphImage", display_url=self._media(f"{i}", False))
+        return node
+
+    def page(self, offset, size=PAGE_SIZE):
+        edges = [{"node": node} for node in self.nodes[offset:offset + size]]
+        end = offset + len(edges)
+        return {"count": self.posts, "edges": edges,
+                "page_info": {"has_next_page": end < self.posts, "end_cursor": str(end) if end < self.posts else None}}
+
+    def user_node(self, first_page=True):
+        node = {
+            "id": str(self.userid), "username": self.username, "full_name": self.username.title(),
+            "biography": "Synthetic benchmark profile", "is_private": False, "is_verified": False,
+            "profile_pic_url": self._media("profile_pic", False),
+            "profile_pic_url_hd": self._media("profile_pic", False),
+            "edge_followed_by": {"count": 1000}, "edge_follow": {"count": 10},
+            "edge_felix_video_timeline": {"count": 0},
+        }
+        if first_page:
+            node["edge_owner_to_timeline_media"] = self.page(0)
+        return node
+
+    def total_media(self):
+        """Number of media files a full download writes (videos without thumbnails)."""
+        return sum(len(node["edge_sidecar_to_children"]["edges"]) if node["__typename"] == "GraphSidecar" else 1
+                   for node in self.nodes)
+
+
+class FakeInstagram:
+    def __init__(self, profiles, latency=0.0, bandwidth=None, throttle_every=0, retry_after=1,
+                 metadata_fail_every=0, metadata_status=503, host="127.0.0.1", port=0):
+        """Serve *profiles* (``FakeProfile`` objects).
+
+        *latency* seconds are added to every response and media is sent at
+        most at *bandwidth* bytes/s per response. Every *throttle_every*-th
+        media request is answered ``429`` with ``Retry-After: retry_after``,
+        and every *metadata_fail_every*-th metadata request with
+        *metadata_status* (503 or 429) and Instagram's "Please wait a few
+        minutes" message.
+        """
+        self.profiles = {p.username.lower(): p for p in profiles}
+        self.assets = {}
+        for profile in profiles:
+            self.assets.update(profile.assets)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.metadata_fail_every = metadata_fail_every
+        self.metadata_status = metadata_status
+        self._lock = threading.Lock()
+        self._seen = {"metadata": 0, "media": 0}
+        self.counters = {}
+        self.bytes_sent = 0
+        self.throttled = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.counters), "bytes_sent": self.bytes_sent, "throttled": self.throttled}
+
+    # --- Bookkeeping ---
+
+    def _count(self, kind, group):
+        """Count one request; returns True if it should be refused (throttled)."""
+        with self._lock:
+            self.counters[kind] = self.counters.get(kind, 0) + 1
+            self._seen[group] += 1
+            every = self.throttle_every if group == "media" else self.metadata_fail_every
+            refuse = bool(every) and self._seen[group] % every == 0
+            if refuse:
+                self.throttled += 1
+            return refuse
+
+    def _sent(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        return Handler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._form = parse_qs(self.rfile.read(length).decode()) if length else {}
+        self._dispatch()
+
+    def do_HEAD(self):
+        self._dispatch(head=True)
+
+    def _dispatch(self, head=False):
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith("/v/"):
+            return self._media(path[3:], head)
+        if path == "/":
+            fake._count("home", "metadata")
+            return self._send(200, b"<html></html>", "text/html",
+                              {"Set-Cookie": "csrftoken=benchmark; Path=/"})
+        if path.startswith("/api/v1/users/web_profile_info"):
+            if fake._count("profile_info", "metadata"):
+                return self._unavailable()
+            username = parse_qs(url.query).get("username", [""])[0]
+            profile = fake.profiles.get(username.lower())
+            if profile is None:
+                return self._json(404, {"message": "User not found", "status": "fail"})
+            return self._json(200, {"data": {"user": profile.user_node()}, "status": "ok"})
+        if path.startswith("/graphql/query"):
+            if fake._count("graphql", "metadata"):
+                return self._unavailable()
+            form = getattr(self, "_form", {})
+            variables = json.loads(form.get("variables", ["{}"])[0])
+            profile = next((p for p in fake.profiles.values() if str(p.userid) == str(variables.get("id"))), None)
+            if profile is None:
+                return self._json(200, {"data": {"user": None}, "status": "ok"})
+            offset = int(variables.get("after") or 0)
+            return self._json(200, {"data": {"user": {"edge_owner_to_timeline_media": profile.page(offset)}},
+                                    "status": "ok"})
+        # Profile page: /<username>/
+        username = path.strip("/")
+        profile = fake.profiles.get(username.lower()) if "/" not in username else None
+        if fake._count("page", "metadata"):
+            return self._unavailable()
+        if profile is None:
+            return self._send(404, b"<html>Not found</html>", "text/html")
+        user = {"pk": str(profile.userid), "id": str(profile.userid), "username": profile.username,
+                "full_name": profile.username.title(), "is_private": False, "media_count": profile.posts,
+                "profile_pic_url": profile.user_node(False)["profile_pic_url"], "biography": "",
+                "follower_count": 1000, "following_count": 10}
+        embedded = {"require": [["ScheduledServerJS", "handle", None,
+                                 [{"__bbox": {"result": {"data": {"xig_user_by_username": user}}}}]]]}
+        body = f'<html><script type="application/json">{json.dumps(embedded)}</script></html>'
+        return self._send(200, body.encode(), "text/html")
+
+    # --- Responses ---
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _json(self, status, data):
+        self._send(status, json.dumps(data).encode(), "application/json; charset=utf-8")
+
+    def _unavailable(self):
+        self._json(self.fake.metadata_status,
+                   {"message": "Please wait a few minutes before you try again.", "status": "fail"})
+
+    def _media(self, asset, head):
+        fake = self.fake
+        if asset not in fake.assets:
+            fake._count("media_missing", "media")
+            return self._send(404, b"", "text/plain")
+        if fake._count("media", "media"):
+            return self._send(429, b"", "text/plain", {"Retry-After": str(fake.retry_after)})
+        size, content_type = fake.assets[asset]
+        start, end = 0, size - 1
+        match = _RANGE_RE.fullmatch(self.headers.get("Range") or "")
+        status = 200
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)))
+            if start >= size:
+                return self._send(416, b"", "text/plain", {"Content-Range": f"bytes */{size}"})
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+        block = _content_block(asset)
+        pos, began = start, time.monotonic()
+        while pos <= end:
+            offset = pos % _BLOCK_SIZE
+            chunk = block[offset:offset + min(_BLOCK_SIZE - offset, end - pos + 1)]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            pos += len(chunk)
+            fake._sent(len(chunk))
+            if fake.bandwidth:
+                ahead = (pos - start) / fake.bandwidth - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+_blocks = {}
+
+
+def _content_block(asset):
+    """Deterministic, asset-specific content (so dedup sees distinct files)."""
+    block = _blocks.get(asset)
+    if block is None:
+        rng = random.Random(asset)
+        block = _blocks[asset] = rng.randbytes(_BLOCK_SIZE)
+    return block
+
+
+# --- Routing ---
+
+class _LocalAdapter(HTTPAdapter):
+    """Sends requests for Instagram hosts to the fake server instead."""
+
+    def __init__(self, base_url, pool_maxsize=64):
+        self.base_url = base_url
+        super().__init__(pool_connections=4, pool_maxsize=pool_maxsize)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        local = request.copy()
+        local.url = self.base_url + url.path + (f"?{url.query}" if url.query else "")
+        response = super().send(local, **kwargs)
+        # Look like the original request to cookies, redirects and callers
+        response.request = request
+        response.url = request.url
+        return response
+
+
+def _is_routed(url):
+    host = urlsplit(url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in ROUTED_HOSTS)
+
+
+@contextmanager
+def route_requests(base_url):
+    """Send every ``requests`` call to an Instagram host to *base_url* instead."""
+    adapter = _LocalAdapter(base_url)
+    original = requests.Session.get_adapter
+
+    def get_adapter(session, url):
+        return adapter if _is_routed(url) else original(session, url)
+
+    requests.Session.get_adapter = get_adapter
+    try:
+        yield adapter
+    finally:
+        requests.Session.get_adapter = original
+        adapter.close()
@@ -1,23 +1,22 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, Canvas, simpledialog
 import threading
+import subprocess
+import multiprocessing
 import os
 import sys
-import contextlib
-import io
-
-# Force UTF-8 for stdout/stderr to avoid charmap errors (Only if console exists)
-if sys.stdout is not None:
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-if sys.stderr is not None:
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
-
-# --- CHECK DEPENDENCIES ---
-try:
-    import instaloader
-    HAS_INSTALOADER = True
-except ImportError:
-    HAS_INSTALOADER = False
+import importlib
+
+from download_engine import DEFAULT_WORKERS, MAX_WORKERS
+from batch import (parse_profile_list, load_profile_list,
+                   DEFAULT_PARALLEL_PROFILES, MAX_PARALLEL_PROFILES, FAILED)
+from log_pipeline import LogBuffer
+from post_filters import PostFilter, parse_date, MEDIA_TYPES, ALL as ALL_MEDIA
+from archive import FORMATS as ARCHIVE_FORMATS, TAR_ZST, HAS_ZSTD
+from metrics import format_summary
+from downloader_core import (Downloader, DownloadOptions, LoginCancelled, force_utf8_console, DEFAULT_BLOB_STORE,
+                             DEFAULT_RESPONSE_CACHE)
+from prewarm import Prewarmer
 
 # --- NEON GREEN PALETTE ---
 BG_COLOR = "#050a04"
@@ -28,24 +27,63 @@ NEON_DARK = "#46c34c"
 TEXT_WHITE = "#ffffff"
 INPUT_BG = "#1a2e15"
 
+# --- CONSOLE ---
+LOG_TICK_MS = 100
+MAX_CONSOLE_LINES = 2000
+LOG_FILENAME = "insta_downloader.log"
+STATS_TICK_MS = 1000
+METRICS_FILENAME = "insta_metrics.json"
+FOLDER_OUTPUT = "folder"    # loose files; the other outputs are archive formats
+
+# --- PREWARM ---
+# instaloader is imported (and connections opened) in the background once the window is up
+PREWARM_DELAY_MS = 200
+
 class GradientFrame(Canvas):
+    """Vertical gradient background drawn as one cached image instead of one line per pixel row."""
+
     def __init__(self, parent, color1="#000000", color2="#112211", **kwargs):
         Canvas.__init__(self, parent, **kwargs)
         self.color1 = color1
         self.color2 = color2
+        self._columns = {}      # height -> 1px wide gradient image
+        self._image = None      # current full-size image (kept referenced for Tk)
+        self._size = None
+        self._item = None
         self.bind("<Configure>", self._draw_gradient)
         
     def _draw_gradient(self, event=None):
-        self.delete("gradient")
         width = self.winfo_width()
         height = self.winfo_height()
-        r1, g1, b1 = self.hex_to_rgb(self.color1)
-        r2, g2, b2 = self.hex_to_rgb(self.color2)
-        for i in range(height):
-            r = int(r1 + (r2 - r1) * i / height)
-            g = int(g1 + (g2 - g1) * i / height)
-            b = int(b1 + (b2 - b1) * i / height)
-            self.create_line(0, i, width, i, tags=("gradient",), fill=f'#{r:02x}{g:02x}{b:02x}')
+        if (width, height) == self._size or width < 1 or height < 1:
+            return
+        self._size = (width, height)
+        # Scale the cached column horizontally; only a new height needs new pixels
+        self._image = self._column(height).zoom(width, 1)
+        if self._item is None:
+            self._item = self.create_image(0, 0, anchor="nw", image=self._image, tags=("gradient",))
+            self.tag_lower(self._item)
+        else:
+            self.itemconfigure(self._item, image=self._image)
+
+    def _column(self, height):
+        column = self._columns.get(height)
+        if column is None:
+            r1, g1, b1 = self.hex_to_rgb(self.color1)
+            r2, g2, b2 = self.hex_to_rgb(self.color2)
+            rows = []
+            for i in range(height):
+                r = int(r1 + (r2 - r1) * i / height)
+                g = int(g1 + (g2 - g1) * i / height)
+                b = int(b1 + (b2 - b1) * i / height)
+                rows.append(f'{{#{r:02x}{g:02x}{b:02x}}}')
+            column = tk.PhotoImage(master=self, width=1, height=height)
+            column.put(" ".join(rows))
+            # Window drags produce many heights; keep only a few recent ones
+            if len(self._columns) >= 8:
+                self._columns.pop(next(iter(self._columns)))
+            self._columns[height] = column
+        return column
 
     def hex_to_rgb(self, hex_val):
         hex_val = hex_val.lstrip('#')
@@ -62,38 +100,50 @@ class GlossyButton(Canvas):
         self.text_color = text_color
         self.state = "normal"
         self.is_hover = False
+        self._drawn = None
         
         self.bind("<Button-1>", self._on_click)
         self.bind("<Enter>", self._on_enter)
         self.bind("<Leave>", self._on_leave)
+        self._build()
         self.draw()
 
-    def draw(self):
-        self.delete("all")
+    def _build(self):
+        """Create the canvas items once; draw() only reconfigures them."""
         w = int(self['width'])
         h = int(self['height'])
         r = self.radius
         
-        if self.state == "disabled":
-            color = "#333333"
-            txt_color = "#666666"
-        else:
-            color = NEON_1 if self.is_hover else self.base_color
-            txt_color = "#000000"
-        
         # Subtle glow outline (reduced from width=2 to width=1)
-        if self.state == "normal":
-            self._round_rect(2, 2, w-2, h-2, r, fill="", outline=color, width=1)
+        self._glow = self._round_rect(2, 2, w-2, h-2, r, fill="", width=1)
             
         # Main button body
-        self._round_rect(4, 4, w-4, h-4, r-2, fill=color, outline="")
+        self._body = self._round_rect(4, 4, w-4, h-4, r-2, outline="")
         
         # Subtle shine effect (reduced opacity)
-        if self.state == "normal":
-            self.create_oval(10, 8, w-10, h/2.5, fill="#ffffff", outline="", stipple="gray12")
+        self._shine = self.create_oval(10, 8, w-10, h/2.5, fill="#ffffff", outline="", stipple="gray12")
 
         # Text
-        self.create_text(w/2, h/2, text=self.text, fill=txt_color, font=("Segoe UI", 11, "bold"))
+        self._label = self.create_text(w/2, h/2, text=self.text, font=("Segoe UI", 11, "bold"))
+
+    def draw(self):
+        if self.state == "disabled":
+            color = "#333333"
+            txt_color = "#666666"
+        else:
+            color = NEON_1 if self.is_hover else self.base_color
+            txt_color = "#000000"
+
+        look = (self.state, color, txt_color)
+        if look == self._drawn:
+            return
+        self._drawn = look
+
+        extras = "normal" if self.state == "normal" else "hidden"
+        self.itemconfigure(self._glow, outline=color, state=extras)
+        self.itemconfigure(self._body, fill=color)
+        self.itemconfigure(self._shine, state=extras)
+        self.itemconfigure(self._label, fill=txt_color)
 
     def _round_rect(self, x1, y1, x2, y2, r, **kwargs):
         points = (x1+r, y1, x1+r, y1, x2-r, y1, x2-r, y1, x2, y1, x2, y1+r, x2, y1+r, 
@@ -128,28 +178,32 @@ class NeonCheckbox(Canvas):
         self.check_color = check_color
         self.bind("<Button-1>", self._toggle)
         self.variable.trace_add("write", lambda *args: self.draw())
+
+        # Items are created once and only reconfigured on toggle
+        self._box = self.create_rectangle(2, 5, 22, 25, width=2)
+        self._check = self.create_line(5, 15, 10, 22, 22, 8, fill=self.check_color, width=3, smooth=True)
+        self._label = self.create_text(30, 15, text=self.text, anchor="w", font=("Consolas", 10, "bold"))
         self.draw()
 
     def draw(self):
-        self.delete("all")
-        checked = self.variable.get()
+        checked = bool(self.variable.get())
         box_color = self.check_color if checked else "#444"
         
         # Checkbox
-        self.create_rectangle(2, 5, 22, 25, outline=box_color, width=2)
-        if checked:
-            self.create_line(5, 15, 10, 22, 22, 8, fill=self.check_color, width=3, smooth=True)
+        self.itemconfigure(self._box, outline=box_color)
+        self.itemconfigure(self._check, state="normal" if checked else "hidden")
             
         # Text
         color = NEON_1 if checked else "#888"
-        self.create_text(30, 15, text=self.text, anchor="w", fill=color, font=("Consolas", 10, "bold"))
+        self.itemconfigure(self._label, fill=color)
 
     def _toggle(self, event):
         self.variable.set(not self.variable.get())
 
 class InstagramDownloaderApp:
-    def __init__(self, root):
+    def __init__(self, root, max_console_lines=MAX_CONSOLE_LINES):
         self.root = root
+        self.max_console_lines = max_console_lines
         self.root.title("Insta Downloader")
         self.root.geometry("900x750")
         
@@ -171,12 +225,38 @@ class InstagramDownloaderApp:
         self.login_var = tk.StringVar()
 
         self.opt_include_metadata = tk.BooleanVar(value=False)
+        self.opt_metadata_store = tk.BooleanVar(value=False)
         self.opt_stories = tk.BooleanVar(value=False)
         self.opt_stories.trace_add("write", self.toggle_login_field)
+        self.opt_fast_update = tk.BooleanVar(value=False)
+        self.opt_resume = tk.BooleanVar(value=True)
+        self.opt_dedupe = tk.BooleanVar(value=False)
+        self.opt_log_file = tk.BooleanVar(value=False)
+        self.opt_metrics = tk.BooleanVar(value=False)
+        self.opt_cache = tk.BooleanVar(value=True)
+        self.opt_thumbnails = tk.BooleanVar(value=False)
+        self.opt_phash = tk.BooleanVar(value=False)
+        self.opt_reencode = tk.BooleanVar(value=False)
+        self.stats_var = tk.StringVar()
+        self.core = None
+        self.opt_workers = tk.IntVar(value=DEFAULT_WORKERS)
+        self.opt_parallel_profiles = tk.IntVar(value=DEFAULT_PARALLEL_PROFILES)
+        # Filters (evaluated before any media request; empty/0 = no limit)
+        self.opt_since = tk.StringVar()
+        self.opt_until = tk.StringVar()
+        self.opt_max_posts = tk.IntVar(value=0)
+        self.opt_media = tk.StringVar(value=ALL_MEDIA)
+        self.opt_skip_sidecars = tk.BooleanVar(value=False)
+        self.opt_output = tk.StringVar(value=FOLDER_OUTPUT)
         
         self.is_downloading = False
+        self.log_buffer = LogBuffer()
+        self.prewarmer = Prewarmer(response_cache=DEFAULT_RESPONSE_CACHE)
         
         self.setup_ui()
+        self.root.after(LOG_TICK_MS, self._drain_log)
+        self.root.after(STATS_TICK_MS, self._refresh_stats)
+        self.root.after(PREWARM_DELAY_MS, self.prewarmer.start)
         
     def setup_ui(self):
         # Background
@@ -199,8 +279,24 @@ class InstagramDownloaderApp:
         input_box = tk.Frame(self.card, bg=CARD_BG, padx=40)
         input_box.pack(fill="x")
 
-        # Target Profile
-        self.create_input(input_box, "TARGET PROFILE", self.username_var)
+        # Target Profile(s) - a single name or a list separated by commas/spaces
+        tk.Label(input_box, text="TARGET PROFILE(S)", font=("Consolas", 10, "bold"), 
+                fg=NEON_2, bg=CARD_BG).pack(anchor="w", pady=(0,5))
+        profile_row = tk.Frame(input_box, bg=CARD_BG)
+        profile_row.pack(fill="x")
+
+        profile_entry = tk.Entry(profile_row, textvariable=self.username_var, font=("Segoe UI", 12), bg=INPUT_BG, 
+                fg=TEXT_WHITE, insertbackground=NEON_1, relief="flat", highlightbackground=NEON_DARK, 
+                highlightthickness=1)
+        profile_entry.pack(side="left", fill="x", expand=True, ipady=8, padx=(0, 15))
+        # Looked up once the name is complete, not on every keystroke (each lookup is a real request)
+        profile_entry.bind("<FocusOut>", self._prefetch_profiles)
+        profile_entry.bind("<Return>", self._prefetch_profiles)
+
+        self.list_btn = GlossyButton(profile_row, text="LOAD LIST", width=90, height=40, radius=15,
+                                   bg_color=CARD_BG, btn_color=NEON_1, text_color="black",
+                                   command=self.load_profile_file)
+        self.list_btn.pack(side="right")
         tk.Frame(input_box, bg=CARD_BG, height=15).pack()
 
         # Folder
@@ -232,8 +328,80 @@ class InstagramDownloaderApp:
         chk_row.pack(fill="x")
         
         NeonCheckbox(chk_row, "Include Metadata", self.opt_include_metadata).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row, "Metadata Store (one file)", self.opt_metadata_store).pack(side="left", padx=(0, 20))
         NeonCheckbox(chk_row, "Download Stories", self.opt_stories).pack(side="left")
 
+        chk_row2 = tk.Frame(opt_frame, bg=CARD_BG)
+        chk_row2.pack(fill="x")
+        NeonCheckbox(chk_row2, "Fast Update (stop at known post)", self.opt_fast_update).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row2, "Deduplicate Media", self.opt_dedupe).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row2, "Resume Interrupted", self.opt_resume).pack(side="left")
+
+        chk_row3 = tk.Frame(opt_frame, bg=CARD_BG)
+        chk_row3.pack(fill="x")
+        NeonCheckbox(chk_row3, f"Save Log File ({LOG_FILENAME})", self.opt_log_file).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row3, f"Export Metrics ({METRICS_FILENAME})", self.opt_metrics).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row3, "Cache Lookups", self.opt_cache).pack(side="left")
+
+        chk_row4 = tk.Frame(opt_frame, bg=CARD_BG)
+        chk_row4.pack(fill="x")
+        NeonCheckbox(chk_row4, "Thumbnails", self.opt_thumbnails).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row4, "Perceptual Hashes", self.opt_phash).pack(side="left", padx=(0, 20))
+        NeonCheckbox(chk_row4, "Re-encode JPEGs", self.opt_reencode).pack(side="left")
+
+        # Parallel Workers
+        workers_row = tk.Frame(opt_frame, bg=CARD_BG)
+        workers_row.pack(fill="x", pady=(10, 0))
+        tk.Label(workers_row, text="PARALLEL WORKERS", font=("Consolas", 10, "bold"), 
+                fg=NEON_2, bg=CARD_BG).pack(side="left")
+        tk.Spinbox(workers_row, from_=1, to=MAX_WORKERS, textvariable=self.opt_workers, width=4,
+                  font=("Consolas", 11), bg=INPUT_BG, fg=TEXT_WHITE, insertbackground=NEON_1,
+                  buttonbackground=CARD_BG, relief="flat", highlightbackground=NEON_DARK,
+                  highlightthickness=1).pack(side="left", padx=(10, 0))
+        tk.Label(workers_row, text="PARALLEL PROFILES", font=("Consolas", 10, "bold"), 
+                fg=NEON_2, bg=CARD_BG).pack(side="left", padx=(30, 0))
+        tk.Spinbox(workers_row, from_=1, to=MAX_PARALLEL_PROFILES, textvariable=self.opt_parallel_profiles,
+                  width=4, font=("Consolas", 11), bg=INPUT_BG, fg=TEXT_WHITE, insertbackground=NEON_1,
+                  buttonbackground=CARD_BG, relief="flat", highlightbackground=NEON_DARK,
+                  highlightthickness=1).pack(side="left", padx=(10, 0))
+        tk.Label(workers_row, text="OUTPUT", font=("Consolas", 10, "bold"),
+                fg=NEON_2, bg=CARD_BG).pack(side="left", padx=(30, 0))
+        outputs = [FOLDER_OUTPUT] + [fmt for fmt in ARCHIVE_FORMATS if fmt != TAR_ZST or HAS_ZSTD]
+        output_menu = tk.OptionMenu(workers_row, self.opt_output, *outputs)
+        output_menu.config(font=("Consolas", 10), bg=INPUT_BG, fg=TEXT_WHITE, activebackground=CARD_BG,
+                           activeforeground=NEON_1, relief="flat", highlightthickness=0, width=7)
+        output_menu["menu"].config(font=("Consolas", 10), bg=INPUT_BG, fg=TEXT_WHITE)
+        output_menu.pack(side="left", padx=(10, 0))
+
+        # Filters
+        filter_row = tk.Frame(opt_frame, bg=CARD_BG)
+        filter_row.pack(fill="x", pady=(10, 0))
+        for label, var in (("SINCE", self.opt_since), ("UNTIL", self.opt_until)):
+            tk.Label(filter_row, text=label, font=("Consolas", 10, "bold"),
+                    fg=NEON_2, bg=CARD_BG).pack(side="left")
+            tk.Entry(filter_row, textvariable=var, width=11, font=("Consolas", 11), bg=INPUT_BG,
+                    fg=TEXT_WHITE, insertbackground=NEON_1, relief="flat", highlightbackground=NEON_DARK,
+                    highlightthickness=1).pack(side="left", padx=(10, 20))
+        tk.Label(filter_row, text="MAX POSTS", font=("Consolas", 10, "bold"),
+                fg=NEON_2, bg=CARD_BG).pack(side="left")
+        tk.Spinbox(filter_row, from_=0, to=100000, textvariable=self.opt_max_posts, width=6,
+                  font=("Consolas", 11), bg=INPUT_BG, fg=TEXT_WHITE, insertbackground=NEON_1,
+                  buttonbackground=CARD_BG, relief="flat", highlightbackground=NEON_DARK,
+                  highlightthickness=1).pack(side="left", padx=(10, 0))
+        tk.Label(filter_row, text="(YYYY-MM-DD, 0 = all)", font=("Consolas", 9),
+                fg=NEON_DARK, bg=CARD_BG).pack(side="left", padx=(10, 0))
+
+        filter_row2 = tk.Frame(opt_frame, bg=CARD_BG)
+        filter_row2.pack(fill="x", pady=(5, 0))
+        tk.Label(filter_row2, text="MEDIA", font=("Consolas", 10, "bold"),
+                fg=NEON_2, bg=CARD_BG).pack(side="left")
+        media_menu = tk.OptionMenu(filter_row2, self.opt_media, *MEDIA_TYPES)
+        media_menu.config(font=("Consolas", 10), bg=INPUT_BG, fg=TEXT_WHITE, activebackground=CARD_BG,
+                          activeforeground=NEON_1, relief="flat", highlightthickness=0, width=7)
+        media_menu["menu"].config(font=("Consolas", 10), bg=INPUT_BG, fg=TEXT_WHITE)
+        media_menu.pack(side="left", padx=(10, 20))
+        NeonCheckbox(filter_row2, "Skip Sidecars", self.opt_skip_sidecars).pack(side="left")
+
         # Login Field (Hidden by default)
         self.login_frame = tk.Frame(opt_frame, bg=CARD_BG)
         # Will be packed by toggle_login_field if needed
@@ -245,7 +413,7 @@ class InstagramDownloaderApp:
                 bg=INPUT_BG, fg=TEXT_WHITE, insertbackground=NEON_1, relief="flat", 
                 highlightbackground=NEON_DARK, highlightthickness=1).pack(fill="x", ipady=5)
                 
-        tk.Label(self.login_frame, text="*Password/2FA will be prompted in the CONSOLE window", 
+        tk.Label(self.login_frame, text="*Password/2FA are asked once; the login session is remembered", 
                 font=("Consolas", 8, "italic"), fg=NEON_DARK, bg=CARD_BG).pack(anchor="w")
 
         # Download Button
@@ -261,6 +429,9 @@ class InstagramDownloaderApp:
         term_frame.pack(fill="both", expand=True, padx=30, pady=(0, 5))
         tk.Label(term_frame, text=">> CONSOLE OUTPUT", font=("Consolas", 10), 
                 fg=NEON_2, bg="black").pack(anchor="w", padx=5)
+        # Live job metrics (refreshed by _refresh_stats)
+        tk.Label(term_frame, textvariable=self.stats_var, font=("Consolas", 8), justify="left",
+                fg=NEON_DARK, bg="black").pack(anchor="w", padx=5)
         self.term_text = tk.Text(term_frame, bg="#0a0a0a", fg=NEON_1, font=("Consolas", 9),
                                 relief="flat", height=8, state="disabled")
         self.term_text.pack(fill="both", expand=True, padx=2, pady=2)
@@ -279,120 +450,145 @@ class InstagramDownloaderApp:
         else:
             self.login_frame.pack_forget()
 
-    def create_input(self, parent, label, var):
-        tk.Label(parent, text=label, font=("Consolas", 10, "bold"), 
-                fg=NEON_2, bg=CARD_BG).pack(anchor="w", pady=(0,5))
-        tk.Entry(parent, textvariable=var, font=("Segoe UI", 12), bg=INPUT_BG, fg=TEXT_WHITE, 
-                insertbackground=NEON_1, relief="flat", highlightbackground=NEON_DARK, 
-                highlightthickness=1).pack(fill="x", ipady=8)
-
     def log(self, text):
-        def _log():
+        # Thread-safe: lines are buffered and shown by _drain_log on the main thread
+        self.log_buffer.write(str(text))
+
+    def _drain_log(self):
+        lines, dropped = self.log_buffer.drain()
+        if dropped:
+            hint = " (see log file)" if self.log_buffer.has_file else ""
+            lines.insert(0, f">> ... {dropped} lines skipped{hint} ...")
+        if lines:
             try:
                 self.term_text.config(state="normal")
-                self.term_text.insert("end", f"{str(text)}\n")
+                self.term_text.insert("end", "\n".join(lines) + "\n")
+                # Keep the widget bounded
+                excess = int(self.term_text.index("end-1c").split(".")[0]) - 1 - self.max_console_lines
+                if excess > 0:
+                    self.term_text.delete("1.0", f"{excess + 1}.0")
                 self.term_text.see("end")
                 self.term_text.config(state="disabled")
             except Exception as e:
                 print(f"Log Error: {e}")
-        
-        # Schedule update on main thread
-        self.root.after(0, _log)
+        self.root.after(LOG_TICK_MS, self._drain_log)
+
+    def _refresh_stats(self):
+        core = self.core
+        snapshots = core.metrics_snapshot(running_only=True) if core is not None else []
+        self.stats_var.set("\n".join(f"[{snap['profile']}] {format_summary(snap)}" for snap in snapshots[:3]))
+        self.root.after(STATS_TICK_MS, self._refresh_stats)
+
+    def _prefetch_profiles(self, event=None):
+        profiles = parse_profile_list(self.username_var.get())
+        if profiles and not self.is_downloading:
+            self.prewarmer.prefetch(profiles)
 
     def browse_folder(self):
         f = filedialog.askdirectory()
         if f:
             self.folder_var.set(f)
 
+    def load_profile_file(self):
+        f = filedialog.askopenfilename(filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
+        if not f:
+            return
+        try:
+            profiles = load_profile_list(f)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not read list: {e}")
+            return
+        self.username_var.set(", ".join(profiles))
+        self.log(f">> LOADED {len(profiles)} PROFILES FROM: {f}")
+
+    def read_int(self, var, default):
+        try:
+            return int(var.get())
+        except (tk.TclError, ValueError):
+            return default
+
 
     def start_download(self):
         if self.is_downloading:
             return
             
-        profile = self.username_var.get().strip()
+        profiles = parse_profile_list(self.username_var.get())
         folder = self.folder_var.get().strip()
         
-        if not profile:
+        if not profiles:
             messagebox.showerror("Error", "Target Profile Required")
             return
 
-        # Ensure Library Loaded
-        global HAS_INSTALOADER
-        if not HAS_INSTALOADER:
-            try:
-                import instaloader
-                HAS_INSTALOADER = True
-            except:
-                if messagebox.askyesno("Setup", "Instaloader missing. Install?"):
-                    self.run_async(self.install_lib)
-                return
-
-        # Explicitly import here to ensure 'instaloader' variable exists in this function scope
-        import instaloader
+        # Ensure Library Loaded (normally imported in the background by now)
+        if not self.prewarmer.start().wait():
+            if messagebox.askyesno("Setup", "Instaloader missing. Install?"):
+                self.run_async(self.install_lib)
+            return
 
-        # 1. Initialize Instaloader (Main Thread)
         try:
-            L = instaloader.Instaloader(
-                download_pictures=True,
-                download_videos=True,
-                download_video_thumbnails=False,
-                download_geotags=False,
-                download_comments=False,
-                save_metadata=self.opt_include_metadata.get(),
-                compress_json=False
-            )
-        except Exception as e:
-            messagebox.showerror("Init Error", str(e))
+            post_filter = PostFilter(
+                since=parse_date(self.opt_since.get()),
+                until=parse_date(self.opt_until.get()),
+                media=self.opt_media.get(),
+                skip_sidecars=self.opt_skip_sidecars.get(),
+                # 0 in the spinbox: no limit
+                max_posts=max(0, self.read_int(self.opt_max_posts, 0)) or None)
+        except ValueError:
+            messagebox.showerror("Error", "Dates must look like 2024-05-31")
             return
 
-        # 2. Login Flow (Main Thread - Supports UI Popups)
-        if self.opt_stories.get():
+        # Options are read here, on the main thread; the core only sees plain values
+        options = DownloadOptions(
+            folder,
+            include_metadata=self.opt_include_metadata.get(),
+            stories=self.opt_stories.get(),
+            fast_update=self.opt_fast_update.get(),
+            resume=self.opt_resume.get(),
+            workers=self.read_int(self.opt_workers, DEFAULT_WORKERS),
+            parallel_profiles=self.read_int(self.opt_parallel_profiles, DEFAULT_PARALLEL_PROFILES),
+            blob_store=DEFAULT_BLOB_STORE if self.opt_dedupe.get() else None,
+            metrics_file=os.path.join(folder, METRICS_FILENAME) if self.opt_metrics.get() else None,
+            metadata_store=self.opt_metadata_store.get(),
+            post_filter=post_filter,
+            postprocess=[(name, {}) for name, var in (("thumbnail", self.opt_thumbnails), ("phash", self.opt_phash),
+                                                      ("reencode", self.opt_reencode)) if var.get()],
+            archive=None if self.opt_output.get() == FOLDER_OUTPUT else self.opt_output.get(),
+            response_cache=DEFAULT_RESPONSE_CACHE if self.opt_cache.get() else None,
+        )
+        core = Downloader(options, on_event=self.on_core_event, prefetched=self.prewarmer.take(profiles))
+        self.core = core
+
+        login_user = None
+        if options.stories:
             login_user = self.login_var.get().strip()
             if not login_user:
                 messagebox.showerror("Error", "Username required for Stories!")
                 return
-            
-            # Ask Password
-            pwd = simpledialog.askstring("Instagram Login", f"Enter Password for '{login_user}':", show='*')
-            if not pwd:
-                return # Cancelled
 
-            self.set_busy(True) # Lock UI during login attempt (it's brief)
-            self.log(f">> LOGGING IN AS: {login_user}...")
-            # Use 'update' to force UI refresh so user sees the log
-            self.term_text.update() 
+        # Start Download Task (Worker Thread) - login included, so the UI never blocks
+        log_path = os.path.join(folder, LOG_FILENAME) if self.opt_log_file.get() else None
+
+        self.set_busy(True)
+        self.run_async(lambda: self.do_download_task(core, profiles, login_user, log_path))
+
+    def on_core_event(self, kind, data):
+        if kind == "log":
+            self.log(data["message"])
+
+    def ask_on_main_thread(self, ask):
+        """Show a dialog on the Tk thread from a worker thread and wait for the answer."""
+        done = threading.Event()
+        answer = {}
 
+        def _ask():
             try:
-                L.login(login_user, pwd)
-                self.log(">> LOGIN SUCCESS!")
-            except instaloader.TwoFactorAuthRequiredException:
-                # 2FA REQUIRED - Ask for Code
-                self.log(">> 2FA REQUIRED! Asking for code...")
-                two_factor_code = simpledialog.askstring("2FA Required", f"Enter 2FA Code (SMS/App) for '{login_user}':")
-                
-                if not two_factor_code:
-                    self.log(">> LOGIN CANCELLED (No 2FA Code).")
-                    self.set_busy(False)
-                    return
-                
-                try:
-                    L.two_factor_login(two_factor_code)
-                    self.log(">> 2FA LOGIN SUCCESS!")
-                except Exception as e:
-                    self.log(f">> 2FA FAILED: {e}")
-                    messagebox.showerror("Login Failed", f"2FA Failed: {e}")
-                    self.set_busy(False)
-                    return
+                answer["value"] = ask()
+            finally:
+                done.set()
 
-            except Exception as e:
-                self.log(f">> LOGIN FAILED: {e}")
-                messagebox.showerror("Login Failed", str(e))
-                self.set_busy(False)
-                return
-        
-        # 3. Start Download Task (Worker Thread)
-        # Pass the prepared 'L' instance to the thread
-        self.run_async(lambda: self.do_download_task(L, profile, folder))
+        self.root.after(0, _ask)
+        done.wait()
+        return answer.get("value")
 
     def run_async(self, target):
         t = threading.Thread(target=target)
@@ -404,107 +600,52 @@ class InstagramDownloaderApp:
         self.log(">> Installing instaloader...")
         try:
             subprocess.check_call([sys.executable, "-m", "pip", "install", "instaloader"])
-            global HAS_INSTALOADER
-            HAS_INSTALOADER = True
+            importlib.invalidate_caches()
+            self.prewarmer = Prewarmer(response_cache=DEFAULT_RESPONSE_CACHE).start()
             self.log(">> Installation complete.")
         except Exception as e:
             self.log(f">> ERROR: {e}")
         self.set_busy(False)
 
-    def do_download_task(self, loader, profile, folder):
+    def do_download_task(self, core, profiles, login_user=None, log_path=None):
         self.set_busy(True)
-        # Re-import locally for thread safety just in case, though object is passed
-        import instaloader
-        
-        self.log(f">> TARGET: {profile}")
-        self.log(f">> SAVE TO: {folder}")
-        
-        # 3. Change Directory
-        try:
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            os.chdir(folder)
-        except Exception as e:
-            self.log(f">> FOLDER ERROR: {e}")
-            self.set_busy(False)
-            return
-
-        # 4. Start Download
-        try:
-            self.log(">> FETCHING PROFILE DATA...")
-            # Use 'loader' parameter, NOT 'L'
-            prof = instaloader.Profile.from_username(loader.context, profile)
-            target = prof.username
-            
-            # Download Posts
-            self.log(f">> DOWNLOADING POSTS FOR: {target}")
-            count = 0
-            for post in prof.get_posts():
-                # Use 'loader' parameter
-                success = loader.download_post(post, target=target)
-                if success:
-                    count += 1
-                    if count % 5 == 0: self.log(f">> Downloaded {count} items...")
-            
-            self.log(f">> POSTS DONE. Total: {count}")
-
-            # Download Stories
-            if self.opt_stories.get():
-                self.log(">> DOWNLOADING STORIES...")
-                # Use 'loader' parameter
-                loader.download_stories(userids=[prof.userid], filename_target='{}/%Y-%m-%d_%H-%M-%S'.format(target))
-                self.log(">> STORIES DONE.")
-                
-            self.log(">> ALL TASKS COMPLETED SUCCESSFULLY.")
-            messagebox.showinfo("Success", "Download Finished!")
-
-        except Exception as e:
-            self.log(f">> ERROR: {e}")
-        finally:
-            self.set_busy(False)
-
-        # 3. Change Directory
         try:
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            os.chdir(folder)
-        except Exception as e:
-            self.log(f">> FOLDER ERROR: {e}")
-            self.set_busy(False)
-            return
-
-        # 4. Start Download
-        try:
-            self.log(">> FETCHING PROFILE DATA...")
-            prof = instaloader.Profile.from_username(L.context, profile)
-            target = prof.username
-            
-            # Download Posts
-            self.log(f">> DOWNLOADING POSTS FOR: {target}")
-            # Iterating posts prevents "fast-update" logic but is safer for API usage in simple app
-            # For this 'Neon Lite' version, we download recent posts or all
-            count = 0
-            for post in prof.get_posts():
-                success = L.download_post(post, target=target)
-                if success:
-                    count += 1
-                    # Basic log to show progress
-                    if count % 5 == 0: self.log(f">> Downloaded {count} items...")
-            
-            self.log(f">> POSTS DONE. Total: {count}")
-
-            # Download Stories
-            if self.opt_stories.get():
-                self.log(">> DOWNLOADING STORIES...")
-                L.download_stories(userids=[prof.userid], filename_target='{}/%Y-%m-%d_%H-%M-%S'.format(target))
-                self.log(">> STORIES DONE.")
-                
-            self.log(">> ALL TASKS COMPLETED SUCCESSFULLY.")
-            messagebox.showinfo("Success", "Download Finished!")
+            if log_path:
+                try:
+                    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                    self.log_buffer.open_file(log_path)
+                    self.log(f">> LOG FILE: {log_path}")
+                except OSError as e:
+                    self.log(f">> LOG FILE ERROR: {e}")
+
+            # Login Flow (saved session first; popups are shown on the Tk thread)
+            if login_user:
+                try:
+                    core.login(
+                        login_user,
+                        lambda user: self.ask_on_main_thread(lambda: simpledialog.askstring(
+                            "Instagram Login", f"Enter Password for '{user}':", show='*')),
+                        lambda user: self.ask_on_main_thread(lambda: simpledialog.askstring(
+                            "2FA Required", f"Enter 2FA Code (SMS/App) for '{user}':")),
+                    )
+                except LoginCancelled:
+                    return
+                except Exception as e:
+                    error = str(e)
+                    self.root.after(0, lambda: messagebox.showerror("Login Failed", error))
+                    return
 
+            jobs = core.run(profiles)
+            failed = [job for job in jobs if job.state == FAILED]
+            if not failed:
+                self.log(">> ALL TASKS COMPLETED SUCCESSFULLY.")
+                self.root.after(0, lambda: messagebox.showinfo("Success", "Download Finished!"))
+            elif len(jobs) > 1:
+                self.log(f">> {len(failed)} OF {len(jobs)} PROFILES FAILED.")
         except Exception as e:
             self.log(f">> ERROR: {e}")
         finally:
+            self.log_buffer.close_file()
             self.set_busy(False)
 
     def set_busy(self, busy):
@@ -512,6 +653,9 @@ class InstagramDownloaderApp:
         self.download_btn.set_state("disabled" if busy else "normal")
 
 if __name__ == "__main__":
+    # Post-processing uses a process pool, also from the frozen .exe
+    multiprocessing.freeze_support()
+    force_utf8_console()
     root = tk.Tk()
     app = InstagramDownloaderApp(root)
     root.mainloop()
@@ -0,0 +1,382 @@
+"""instaloader extensions used by the download core.
+
+Kept apart from ``downloader_core`` because it imports instaloader at module
+level; the core only imports it once a loader is actually built.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import instaloader
+import requests
+
+from archive import SPOOL_SIZE
+from rate_limit import shared_scheduler, throttle_status, is_throttle_status
+from response_cache import PROFILE, PROFILE_INFO, POSTS
+from transfer import shared_transfer, shared_api_adapter, url_extension, header_extension
+
+# Hosts whose connections all loaders share
+API_PREFIXES = ("https://www.instagram.com/", "https://i.instagram.com/")
+
+_PROFILE_PAGE_RE = re.compile(r"^[A-Za-z0-9._]+/$")
+_PROFILE_INFO_PATH = "api/v1/users/web_profile_info/"
+
+
+def _doc_id_kind(response):
+    """Cache kind of a doc_id GraphQL response: post pages and profile metadata only."""
+    data = (response or {}).get("data") or {}
+    if "xdt_api__v1__feed__user_timeline_graphql_connection" in data:
+        return POSTS
+    user = data.get("user")
+    if isinstance(user, dict):
+        return POSTS if "edge_owner_to_timeline_media" in user else PROFILE_INFO
+    return None
+
+
+def _mount_shared(session):
+    for prefix in API_PREFIXES:
+        session.mount(prefix, shared_api_adapter())
+
+
+def _is_transient(error):
+    """A metadata request that failed on the way (connection, truncated JSON) rather than being refused."""
+    return isinstance(error.__cause__, (requests.RequestException, ValueError))
+
+
+class ScheduledRateController(instaloader.RateController):
+    """instaloader's own per-context limits, with their waits reported to the loader.
+
+    The shared metadata budget and the retries are applied around each request
+    (``MediaLoader._install_scheduling``); instaloader's own 429 handling, a
+    fixed wait of about 11 minutes, is never reached.
+    """
+
+    def __init__(self, context, loader):
+        super().__init__(context)
+        self.loader = loader
+
+    def wait_before_query(self, query_type):
+        start = time.monotonic()
+        super().wait_before_query(query_type)
+        self.loader._on_wait(time.monotonic() - start)
+
+
+class MediaLoader(instaloader.Instaloader):
+    """Instaloader whose requests are paced by a ``rate_limit.RequestScheduler``.
+
+    Metadata requests (JSON queries and the logged-out profile pages) run in a
+    slot of the scheduler's metadata budget and are retried with its backoff
+    when Instagram throttles (429/5xx, "Please wait a few minutes") or the
+    connection drops. Media downloads stream through a resumable
+    ``transfer.MediaTransfer`` inside a media budget slot and are retried with
+    backoff when the CDN throttles. With a ``blob_store.BlobStore`` media is
+    deduplicated by content and CDN asset ID.
+
+    Set ``metrics`` to a ``metrics.JobMetrics`` to record latencies, bytes,
+    retries and throttle waits of the job using this loader, and
+    ``metadata_store`` to a ``metadata_store.MetadataStore`` to keep post and
+    story metadata there instead of in per-post ``.json`` files. Newly written
+    files are handed to ``postprocessor`` (a ``postprocess.PostProcessor``).
+    With ``archive`` set to an ``archive.ArchiveWriter``, media, ``.json``
+    and ``.txt`` files are appended to it instead of being written to disk.
+
+    With a ``response_cache.ResponseCache``, profile lookups, profile
+    metadata and post pages are answered from it while they are fresh.
+    """
+
+    def __init__(self, *args, scheduler=None, transfer=None, blob_store=None, response_cache=None, **kwargs):
+        self.scheduler = scheduler or shared_scheduler()
+        self.blob_store = blob_store
+        self.response_cache = response_cache
+        self.metrics = None
+        self.metadata_store = None
+        self.postprocessor = None
+        self.archive = None
+        # Status of the last metadata response, per requesting thread
+        self._responses = threading.local()
+        self.transfer = transfer or shared_transfer(instaloader.instaloadercontext.default_user_agent())
+        kwargs.setdefault("rate_controller", lambda context: ScheduledRateController(context, self))
+        super().__init__(*args, **kwargs)
+        self._install_hooks()
+        self._install_scheduling()
+        if response_cache is not None:
+            self._install_cache()
+
+    def _install_hooks(self):
+        # login() and load_session() replace the context session, so this is
+        # re-run after each of them
+        session = self.context._session
+        hooks = session.hooks.setdefault("response", [])
+        if self._on_response not in hooks:
+            hooks.append(self._on_response)
+        _mount_shared(session)
+
+    def _install_scheduling(self):
+        # Wrapped on this instance like the cache below (which wraps these, so
+        # that cache hits take no budget). instaloader's own retries are
+        # skipped by starting at its last attempt.
+        context = self.context
+        get_json = context.get_json
+        get_page_data = context.get_page_data
+        get_anonymous_session = context.get_anonymous_session
+
+        def scheduled_get_json(path, params, host='www.instagram.com', session=None, _attempt=1,
+                               response_headers=None, use_post=False):
+            # GraphQL queries come with a copy of the session, made without its hooks
+            if session is not None and self._on_response not in session.hooks["response"]:
+                session.hooks["response"].append(self._on_response)
+            return self._scheduled(lambda: get_json(path, params, host=host, session=session,
+                                                    _attempt=context.max_connection_attempts,
+                                                    response_headers=response_headers, use_post=use_post))
+
+        def scheduled_get_page_data(path):
+            return self._scheduled(lambda: get_page_data(path))
+
+        def hooked_anonymous_session():
+            # Profile pages are loaded logged out, through a new session each
+            # time; it reuses the pooled (prewarmed) connections as well
+            session = get_anonymous_session()
+            session.hooks["response"].append(self._on_response)
+            _mount_shared(session)
+            return session
+
+        context.get_json = scheduled_get_json
+        context.get_page_data = scheduled_get_page_data
+        context.get_anonymous_session = hooked_anonymous_session
+
+    def _scheduled(self, fetch):
+        def attempt():
+            self._responses.status = None
+            return fetch()
+
+        return self.scheduler.call(self.scheduler.metadata, attempt, on_retry=self._on_retry,
+                                   on_wait=self._on_wait, transient=_is_transient,
+                                   throttled=self._throttle_status)
+
+    def _throttle_status(self, error):
+        """The 429/5xx behind a failed metadata request, or None.
+
+        instaloader raises a ConnectionException that names the status only
+        in its message, so 5xx are taken from the response the hook saw.
+        """
+        for e in (error, error.__cause__):
+            if isinstance(e, instaloader.TooManyRequestsException):
+                return 429
+            if (isinstance(e, instaloader.QueryReturnedBadRequestException)
+                    and "wait a few minutes" in str(e).lower()):
+                return 429
+        status = getattr(self._responses, "status", None)
+        if isinstance(error, instaloader.ConnectionException) and is_throttle_status(status):
+            return status
+        return throttle_status(error)
+
+    def _install_cache(self):
+        # The context has no hook for this, so its request methods are wrapped
+        # on this instance (the session changes on login, the context does not)
+        context = self.context
+        get_page_data = context.get_page_data
+        get_json = context.get_json
+        doc_id_graphql_query = context.doc_id_graphql_query
+
+        def cached_get_page_data(path):
+            if not _PROFILE_PAGE_RE.match(path):
+                return get_page_data(path)
+            # Always loaded logged out
+            return self._cached(PROFILE, f"page|{path}", lambda: get_page_data(path))
+
+        def cached_get_json(path, params, *args, **kwargs):
+            # Retries and requests with their own session pass keyword arguments
+            if path != _PROFILE_INFO_PATH or args or kwargs:
+                return get_json(path, params, *args, **kwargs)
+            return self._cached(PROFILE_INFO, self._cache_key(path, params), lambda: get_json(path, params))
+
+        def cached_doc_id_graphql_query(doc_id, variables, referer=None):
+            key = self._cache_key("doc_id", {"doc_id": doc_id, "variables": variables})
+            return self._cached(_doc_id_kind, key, lambda: doc_id_graphql_query(doc_id, variables, referer))
+
+        context.get_page_data = cached_get_page_data
+        context.get_json = cached_get_json
+        context.doc_id_graphql_query = cached_doc_id_graphql_query
+
+    def _cache_key(self, path, params):
+        # Logged-in users may get other answers than visitors
+        return f"{self.context.username or ''}|{path}|{json.dumps(params, sort_keys=True)}"
+
+    def _cached(self, kind, key, fetch):
+        """The cached response for *key*, or ``fetch()`` stored as *kind* (or
+        as ``kind(response)``, None for responses that are not cached)."""
+        cache = self.response_cache
+        data = cache.get(key)
+        if data is None:
+            data = fetch()
+            kind = kind(data) if callable(kind) else kind
+            if kind is not None:
+                cache.put(kind, key, data)
+        return data
+
+    def _on_response(self, response, *args, **kwargs):
+        # Statuses are fed back to the budget by scheduler.call()
+        self._responses.status = response.status_code
+        if self.metrics is not None:
+            self.metrics.observe("metadata", response.elapsed.total_seconds())
+
+    def _on_wait(self, seconds):
+        if self.metrics is not None:
+            self.metrics.add_wait(seconds)
+
+    def _on_retry(self):
+        if self.metrics is not None:
+            self.metrics.add_retry()
+
+    def warm_up(self):
+        """Open pooled connections to Instagram before the first real request."""
+        try:
+            self.context._session.head(API_PREFIXES[0], timeout=self.context.request_timeout,
+                                       allow_redirects=False).close()
+            return True
+        except requests.RequestException:
+            return False
+
+    def login(self, user, passwd):
+        try:
+            super().login(user, passwd)
+        finally:
+            self._install_hooks()
+
+    def two_factor_login(self, two_factor_code):
+        super().two_factor_login(two_factor_code)
+        self._install_hooks()
+
+    def load_session(self, username, session_data):
+        super().load_session(username, session_data)
+        self._install_hooks()
+
+    def load_session_from_file(self, username, filename=None):
+        super().load_session_from_file(username, filename)
+        self._install_hooks()
+
+    def save_metadata_json(self, filename, structure):
+        store = self.metadata_store
+        if store is not None and isinstance(structure, (instaloader.Post, instaloader.StoryItem)):
+            store.add(structure, instaloader.get_json_structure(structure))
+            return
+        if self.archive is not None:
+            data = json.dumps(instaloader.get_json_structure(structure), indent=4, sort_keys=True)
+            if self.archive.add_bytes(filename + '.json', data.encode('utf-8')):
+                self.context.log('json', end=' ', flush=True)
+            return
+        super().save_metadata_json(filename, structure)
+
+    def save_caption(self, filename, mtime, caption):
+        if self.archive is None:
+            return super().save_caption(filename, mtime, caption)
+        if self.archive.add_bytes(filename + '.txt', (caption + '\n').encode('utf-8'), mtime.timestamp()):
+            self.context.log('txt', end=' ', flush=True)
+        else:
+            self.context.log('txt exists', end=' ', flush=True)
+
+    def download_pic(self, filename, url, mtime, filename_suffix=None, _attempt=1):
+        """Same contract as instaloader's download_pic: False if the file already exists."""
+        if filename_suffix is not None:
+            filename += '_' + filename_suffix
+        nominal_filename = filename + '.' + url_extension(url)
+        if self.archive is not None:
+            return self._download_to_archive(filename, nominal_filename, url, mtime)
+        if os.path.isfile(nominal_filename):
+            self.context.log(nominal_filename + ' exists', end=' ', flush=True)
+            return False
+
+        # Same CDN asset fetched before (e.g. a repost): link it, skip the download
+        store = self.blob_store
+        blob = store.lookup(url) if store is not None else None
+        if blob is not None:
+            dest = filename + os.path.splitext(blob)[1]
+            if os.path.isfile(dest):
+                self.context.log(dest + ' exists', end=' ', flush=True)
+                return False
+            store.materialize(blob, dest)
+            return True
+
+        def resolve(response):
+            content_type = response.headers.get('Content-Type')
+            return filename + header_extension(content_type) if content_type else nominal_filename
+
+        written, elapsed = self._fetch_media(lambda: self.transfer.fetch(url, nominal_filename, mtime, resolve))
+        if written is None:
+            self.context.log(filename + ' exists', end=' ', flush=True)
+            return False
+        if self.metrics is not None:
+            self.metrics.observe("media", elapsed)
+            self.metrics.add_bytes(os.path.getsize(written))
+        if store is not None:
+            store.ingest(written, url)
+        if self.postprocessor is not None:
+            self.postprocessor.submit(written)
+        return True
+
+    def _fetch_media(self, fetch):
+        """Run ``fetch()`` in a media budget slot, retried when throttled.
+
+        Returns its result and the duration of the attempt that succeeded:
+        the transfer alone, without budget waits and backoffs (those are
+        reported through ``_on_wait``).
+        """
+        elapsed = 0.0
+
+        def attempt():
+            nonlocal elapsed
+            start = time.monotonic()
+            try:
+                return fetch()
+            finally:
+                elapsed = time.monotonic() - start
+
+        result = self.scheduler.call(self.scheduler.media, attempt, on_retry=self._on_retry, on_wait=self._on_wait)
+        return result, elapsed
+
+    def _download_to_archive(self, filename, nominal_filename, url, mtime):
+        archive = self.archive
+        # The member may have been stored under the extension of its Content-Type
+        if archive.contains(nominal_filename):
+            self.context.log(nominal_filename + ' exists', end=' ', flush=True)
+            return False
+
+        def resolve(response):
+            content_type = response.headers.get('Content-Type')
+            return filename + header_extension(content_type) if content_type else nominal_filename
+
+        # Small files stay in memory; only large videos spill to an (unnamed) temporary file
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            name, elapsed = self._fetch_media(lambda: self.transfer.fetch_into(url, spool, resolve))
+            size = spool.seek(0, os.SEEK_END)
+            # Recorded even for a duplicate, so the next re-sync skips the download
+            if not archive.add(name, spool, mtime.timestamp() if mtime else None, alias=nominal_filename):
+                self.context.log(name + ' exists', end=' ', flush=True)
+                return False
+        if self.metrics is not None:
+            self.metrics.observe("media", elapsed)
+            self.metrics.add_bytes(size)
+        return True
+
+
+def export_metadata(store, folder, target, compress_json=False):
+    """Write the posts of a ``MetadataStore`` back as per-post files in *folder*.
+
+    Produces the same ``.json`` (``.json.xz`` with *compress_json*) and
+    caption ``.txt`` files as instaloader's default layout; returns the
+    number of posts written.
+    """
+    loader = instaloader.Instaloader(quiet=True, compress_json=compress_json)
+    count = 0
+    for structure in store.structures():
+        item = instaloader.load_structure(loader.context, structure)
+        filename = os.path.join(folder, loader.format_filename(item, target=target))
+        loader.save_metadata_json(filename, item)
+        caption = item.caption if isinstance(item, instaloader.Post) else None
+        if caption:
+            loader.save_caption(filename, item.date_local, caption)
+        count += 1
+    return count
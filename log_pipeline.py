@@ -0,0 +1,60 @@
+"""Thread-safe console log pipeline.
+
+Worker threads append lines to a bounded ring buffer; the GUI drains it in
+batches on a fixed tick instead of scheduling one Tk callback per line. When
+the producers outrun the GUI the oldest lines are dropped from the buffer (and
+counted), but an optional log file still receives every line.
+"""
+import threading
+import time
+from collections import deque
+
+DEFAULT_BUFFER_LINES = 5000
+
+
+class LogBuffer:
+    def __init__(self, maxlen=DEFAULT_BUFFER_LINES):
+        self._lines = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._file = None
+
+    def write(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+            if self._file is not None:
+                self._file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {line}\n")
+
+    def drain(self, max_lines=None):
+        """Take up to *max_lines* pending lines; returns (lines, dropped_count)."""
+        with self._lock:
+            if max_lines is None or max_lines >= len(self._lines):
+                lines = list(self._lines)
+                self._lines.clear()
+            else:
+                lines = [self._lines.popleft() for _ in range(max_lines)]
+            dropped, self._dropped = self._dropped, 0
+            if self._file is not None:
+                self._file.flush()
+        return lines, dropped
+
+    @property
+    def has_file(self):
+        with self._lock:
+            return self._file is not None
+
+    def open_file(self, path):
+        """Also stream every line to *path* (appending) until close_file()."""
+        f = open(path, "a", encoding="utf-8", buffering=64 * 1024)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = f
+
+    def close_file(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,143 @@
+"""Compact per-profile metadata store.
+
+Instead of one ``.json`` (and ``.txt``) file per post, the metadata of a
+profile can be appended to a single SQLite database inside the profile folder.
+Each row keeps instaloader's JSON structure of the post zlib-compressed, next
+to indexed columns (date, likes, typename, shortcode) so queries and re-syncs
+read the whole profile in one pass.
+
+``loader_ext.export_metadata`` writes the per-post files back out in
+instaloader's usual layout when they are needed.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+METADATA_FILENAME = "metadata.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    shortcode TEXT PRIMARY KEY,
+    mediaid   INTEGER,
+    typename  TEXT,
+    date_utc  TEXT,
+    likes     INTEGER,
+    comments  INTEGER,
+    caption   TEXT,
+    data      BLOB NOT NULL,
+    saved_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_date ON posts (date_utc);
+CREATE INDEX IF NOT EXISTS posts_likes ON posts (likes);
+CREATE INDEX IF NOT EXISTS posts_typename ON posts (typename);
+"""
+
+_COLUMNS = ("shortcode", "mediaid", "typename", "date_utc", "likes", "comments", "caption")
+
+
+def _count(node, *edges):
+    for edge in edges:
+        value = (node.get(edge) or {}).get("count")
+        if value is not None:
+            return value
+    return None
+
+
+def _caption(node):
+    edges = (node.get("edge_media_to_caption") or {}).get("edges") or []
+    if edges:
+        return edges[0]["node"]["text"]
+    caption = node.get("caption")
+    return caption if isinstance(caption, str) else None
+
+
+class MetadataStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    @classmethod
+    def for_folder(cls, folder):
+        """Open (or create) the store of the profile folder *folder*."""
+        os.makedirs(folder, exist_ok=True)
+        return cls(os.path.join(folder, METADATA_FILENAME))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, item, structure):
+        """Store *structure* (instaloader's JSON structure) of the post or story *item*.
+
+        The indexed columns are read from the node data only, so this never
+        triggers a request.
+        """
+        node = structure.get("node") or {}
+        date_utc = getattr(item, "date_utc", None)
+        data = zlib.compress(json.dumps(structure, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item.shortcode, getattr(item, "mediaid", None), getattr(item, "typename", None),
+                 date_utc.isoformat() if date_utc else None,
+                 _count(node, "edge_media_preview_like", "edge_liked_by"),
+                 _count(node, "edge_media_to_comment", "edge_media_to_parent_comment"),
+                 _caption(node), data, time.time()))
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def get(self, shortcode):
+        """The stored JSON structure of *shortcode*, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM posts WHERE shortcode = ?", (shortcode,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def query(self, since=None, until=None, typename=None, min_likes=None, newest_first=True):
+        """Rows (dicts of the indexed columns) matching the filters, by date.
+
+        *since* and *until* are ``datetime`` objects in UTC (until is exclusive).
+        """
+        where, args = [], []
+        if since is not None:
+            where.append("date_utc >= ?")
+            args.append(since.isoformat())
+        if until is not None:
+            where.append("date_utc < ?")
+            args.append(until.isoformat())
+        if typename is not None:
+            where.append("typename = ?")
+            args.append(typename)
+        if min_likes is not None:
+            where.append("likes >= ?")
+            args.append(min_likes)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM posts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date_utc " + ("DESC" if newest_first else "ASC")
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def structures(self):
+        """Yield every stored JSON structure, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM posts ORDER BY date_utc").fetchall()
+        for (data,) in rows:
+            yield json.loads(zlib.decompress(data))
@@ -0,0 +1,219 @@
+"""Per-job throughput and latency metrics.
+
+Each download job owns a ``JobMetrics`` that the loader and the download core
+feed while the job runs: finished posts, written bytes, request latencies
+(split into ``metadata`` requests and ``media`` fetches), retries and the time
+spent waiting on rate limits. ``MetricsExporter`` periodically writes a
+snapshot of all jobs as JSON, or as Prometheus text exposition format when the
+file name ends in ``.prom`` (suitable for node_exporter's textfile collector).
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+LATENCY_SAMPLES = 2048
+LATENCY_KINDS = ("metadata", "media")
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of *samples* (0 < q <= 100), or None."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, int(round(q / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60:02d}:{rest % 60:02d}"
+
+
+class JobMetrics:
+    def __init__(self, profile):
+        self.profile = profile
+        self.total_posts = None     # the profile's mediacount, once known
+        self.skipped_posts = 0      # already downloaded before this run
+        self.posts_done = 0
+        self.posts_failed = 0
+        self.items = 0
+        self.bytes = 0
+        self.retries = 0
+        self.throttle_wait = 0.0
+        self.started = time.time()
+        self.finished = None
+        self._latency = {kind: deque(maxlen=LATENCY_SAMPLES) for kind in LATENCY_KINDS}
+        self._requests = dict.fromkeys(LATENCY_KINDS, 0)
+        self._lock = threading.Lock()
+
+    # --- Recording (any thread) ---
+
+    def observe(self, kind, seconds):
+        with self._lock:
+            self._latency[kind].append(seconds)
+            self._requests[kind] += 1
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes += count
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def add_wait(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self.throttle_wait += seconds
+
+    def post_done(self, success, failed=False):
+        with self._lock:
+            if failed:
+                self.posts_failed += 1
+            else:
+                self.posts_done += 1
+                if success:
+                    self.items += 1
+
+    def finish(self):
+        self.finished = time.time()
+
+    # --- Reading ---
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max((self.finished or time.time()) - self.started, 1e-6)
+            processed = self.posts_done + self.posts_failed
+            posts_rate = processed / elapsed
+            eta = None
+            if self.total_posts and not self.finished and posts_rate > 0:
+                remaining = max(0, self.total_posts - self.skipped_posts - processed)
+                eta = remaining / posts_rate
+            latency = {}
+            for kind in LATENCY_KINDS:
+                samples = list(self._latency[kind])
+                latency[kind] = {"requests": self._requests[kind],
+                                 "p50": percentile(samples, 50),
+                                 "p95": percentile(samples, 95)}
+            return {
+                "profile": self.profile,
+                "running": self.finished is None,
+                "elapsed": round(elapsed, 3),
+                "total_posts": self.total_posts,
+                "skipped_posts": self.skipped_posts,
+                "posts_done": self.posts_done,
+                "posts_failed": self.posts_failed,
+                "items": self.items,
+                "bytes": self.bytes,
+                "posts_per_second": round(posts_rate, 3),
+                "bytes_per_second": round(self.bytes / elapsed, 1),
+                "latency": latency,
+                "retries": self.retries,
+                "throttle_wait": round(self.throttle_wait, 3),
+                "eta": None if eta is None else round(eta, 1),
+            }
+
+    def summary(self):
+        return format_summary(self.snapshot())
+
+
+def format_summary(snap):
+    """One console line with the most useful numbers of a job snapshot."""
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    meta, media = snap["latency"]["metadata"], snap["latency"]["media"]
+    return (f"{snap['posts_per_second']:.2f} posts/s | {snap['bytes_per_second'] / 1e6:.2f} MB/s | "
+            f"meta p50/p95 {ms(meta['p50'])}/{ms(meta['p95'])} ms | "
+            f"media p50/p95 {ms(media['p50'])}/{ms(media['p95'])} ms | "
+            f"retries {snap['retries']} | throttled {snap['throttle_wait']:.1f}s | "
+            f"ETA {format_duration(snap['eta'])}")
+
+
+def to_prometheus(snapshots):
+    """Render job snapshots in Prometheus text exposition format."""
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP insta_{name} {help_text}")
+        lines.append(f"# TYPE insta_{name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            text = ",".join(f'{k}="{label(v)}"' for k, v in labels.items())
+            lines.append(f"insta_{name}{{{text}}} {value}")
+
+    metric("posts_total", "counter", "Posts processed in this run.",
+           [({"profile": s["profile"], "status": "ok"}, s["posts_done"]) for s in snapshots] +
+           [({"profile": s["profile"], "status": "failed"}, s["posts_failed"]) for s in snapshots])
+    metric("profile_posts", "gauge", "Posts on the profile (mediacount).",
+           [({"profile": s["profile"]}, s["total_posts"]) for s in snapshots])
+    metric("bytes_total", "counter", "Media bytes written.",
+           [({"profile": s["profile"]}, s["bytes"]) for s in snapshots])
+    metric("posts_per_second", "gauge", "Average post throughput.",
+           [({"profile": s["profile"]}, s["posts_per_second"]) for s in snapshots])
+    metric("bytes_per_second", "gauge", "Average media throughput.",
+           [({"profile": s["profile"]}, s["bytes_per_second"]) for s in snapshots])
+    metric("request_latency_seconds", "gauge", "Request latency quantiles by kind.",
+           [({"profile": s["profile"], "kind": kind, "quantile": q}, s["latency"][kind][key])
+            for s in snapshots for kind in LATENCY_KINDS for q, key in (("0.5", "p50"), ("0.95", "p95"))])
+    metric("requests_total", "counter", "Requests by kind.",
+           [({"profile": s["profile"], "kind": kind}, s["latency"][kind]["requests"])
+            for s in snapshots for kind in LATENCY_KINDS])
+    metric("retries_total", "counter", "Retried requests after throttling or errors.",
+           [({"profile": s["profile"]}, s["retries"]) for s in snapshots])
+    metric("throttle_wait_seconds_total", "counter", "Time spent waiting on rate limits.",
+           [({"profile": s["profile"]}, s["throttle_wait"]) for s in snapshots])
+    metric("eta_seconds", "gauge", "Estimated time until the profile is done.",
+           [({"profile": s["profile"]}, s["eta"]) for s in snapshots])
+    metric("job_running", "gauge", "1 while the job is running.",
+           [({"profile": s["profile"]}, int(s["running"])) for s in snapshots])
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, snapshots):
+    """Atomically write *snapshots* as Prometheus text (``.prom``) or JSON."""
+    if path.endswith(".prom"):
+        data = to_prometheus(snapshots)
+    else:
+        data = json.dumps({"updated": time.time(), "jobs": snapshots}, indent=2)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class MetricsExporter:
+    def __init__(self, path, snapshot, interval=5.0):
+        """Write ``snapshot()`` (a list of job snapshots) to *path* every *interval* seconds."""
+        self.path = path
+        self.snapshot = snapshot
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer and write one final snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        write_metrics(self.path, self.snapshot())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write_metrics(self.path, self.snapshot())
+            except OSError:
+                pass
@@ -0,0 +1,165 @@
+"""Crash-safe checkpoints of a profile's post pagination.
+
+Builds on instaloader's freezable ``NodeIterator``: the iterator is frozen
+each time it yields a post, and that snapshot becomes the checkpoint once the
+post and every post before it have been processed (the download engine
+reports results in post order). Posts still in flight never end up behind a
+checkpoint, and neither does a post that failed.
+
+The checkpoint is written to the profile folder every few posts and whenever
+a job is stopped or fails, and deleted once the profile was gone through
+completely. A restarted job thaws it and continues from there instead of
+paginating from the newest post again. How many posts passed the post
+filter up to the checkpoint is saved with it (``taken``), so that a resumed
+``max_posts`` limit counts the posts of the interrupted run as well.
+Checkpoints that are too old (the
+media URLs in the saved page expire), were written with other settings, or
+do not thaw are discarded.
+
+Imports instaloader at module level, like ``loader_ext``.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import instaloader
+
+CHECKPOINT_FILENAME = ".pagination_checkpoint.json"
+DEFAULT_MAX_AGE = 24 * 3600
+SAVE_EVERY = 12     # one page
+
+
+class PaginationCheckpoint:
+    def __init__(self, path, key="", max_age=DEFAULT_MAX_AGE, save_every=SAVE_EVERY):
+        """*key* describes the settings the iteration depends on (e.g. filters)."""
+        self.path = path
+        self.key = key
+        self.max_age = max_age
+        self.save_every = save_every
+        # Why the saved checkpoint was not used, if it was discarded
+        self.discarded = None
+        # Posts that passed the filter up to the checkpoint (see taken_posts)
+        self.taken = 0
+        self._lock = threading.Lock()
+        self._pending = deque()     # (post, frozen iterator) in iteration order
+        self._committed = None
+        self._marked = set()        # media IDs of pending posts that passed the filter
+        self._unsaved = 0
+        self._failed = False
+        self._skip_first = False
+
+    @classmethod
+    def for_folder(cls, folder, **kwargs):
+        os.makedirs(folder, exist_ok=True)
+        return cls(os.path.join(folder, CHECKPOINT_FILENAME), **kwargs)
+
+    def resume(self, iterator):
+        """Thaw the saved checkpoint into the unused *iterator*.
+
+        Returns the number of posts that are skipped, or None when there was
+        no usable checkpoint (see ``discarded``).
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            return self._discard_saved(f"unreadable ({e})")
+
+        if data.get("key") != self.key:
+            return self._discard_saved("written with other settings")
+        try:
+            frozen = instaloader.FrozenNodeIterator(**data["iterator"])
+        except (KeyError, TypeError) as e:
+            return self._discard_saved(f"unreadable ({e})")
+        now = time.time()
+        if now - data.get("saved_at", 0) > self.max_age or (frozen.best_before or 0) < now:
+            return self._discard_saved("too old")
+        try:
+            iterator.thaw(frozen)
+        except instaloader.InvalidArgumentException as e:
+            return self._discard_saved(f"does not match ({e})")
+
+        # The thawed iterator repeats the last post that was done
+        self._skip_first = True
+        self._committed = frozen
+        self.taken = data.get("taken", 0)
+        return frozen.total_index + 1
+
+    def _discard_saved(self, reason):
+        self.discarded = reason
+        self.discard()
+        return None
+
+    def track(self, iterator):
+        """Yield the posts of *iterator*, remembering where to resume from each."""
+        for post in iterator:
+            frozen = iterator.freeze()
+            if self._skip_first:
+                self._skip_first = False
+                continue
+            with self._lock:
+                self._pending.append((post, frozen))
+            yield post
+
+    def taken_posts(self, posts):
+        """Yield *posts* (the output of the post filter), counting them into ``taken``
+        once the checkpoint moves past them."""
+        for post in posts:
+            with self._lock:
+                self._marked.add(post.mediaid)
+            yield post
+
+    def done(self, post, ok=True):
+        """*post* and all posts yielded before it are processed; a failed post
+        (*ok* False) stops the checkpoint from moving past it."""
+        with self._lock:
+            while self._pending:
+                item, frozen = self._pending.popleft()
+                marked = item.mediaid in self._marked
+                self._marked.discard(item.mediaid)
+                if item is post:
+                    if ok and not self._failed:
+                        self._commit(frozen, marked)
+                    self._failed = self._failed or not ok
+                    break
+                # Posts filtered out (or already downloaded) before reaching the engine
+                if not self._failed:
+                    self._commit(frozen, marked)
+            self._unsaved += 1
+            due = self._unsaved >= self.save_every
+        if due:
+            self.save()
+
+    def _commit(self, frozen, taken):
+        self._committed = frozen
+        self.taken += taken
+
+    def save(self):
+        with self._lock:
+            frozen = self._committed
+            taken = self.taken
+            self._unsaved = 0
+        if frozen is None:
+            return
+        data = {"key": self.key, "saved_at": time.time(), "taken": taken, "iterator": frozen._asdict()}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self, completed):
+        """Delete the checkpoint after a complete pass, otherwise save it."""
+        if completed:
+            self.discard()
+        else:
+            self.save()
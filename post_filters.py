@@ -0,0 +1,109 @@
+"""Post filters evaluated on the node data that pagination already returned.
+
+A ``PostFilter`` decides per post, before any media request is made, whether
+it is wanted (date range, media type, sidecars, maximum count). Profiles list
+their posts newest first, so as soon as a (non-pinned) post is older than the
+``since`` date the iteration ends and no further pages are requested.
+"""
+from datetime import datetime, timedelta
+
+ALL = "all"
+POSTS = "posts"     # images and sidecars, no videos
+VIDEOS = "videos"
+REELS = "reels"
+MEDIA_TYPES = (ALL, POSTS, VIDEOS, REELS)
+
+
+def parse_date(text):
+    """A ``YYYY-MM-DD`` date (UTC) as a datetime, or None for an empty string."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    return datetime.strptime(text, "%Y-%m-%d")
+
+
+def _product_type(post):
+    # instaloader has no accessor for it; reels are "clips"
+    node = getattr(post, "_node", None) or {}
+    return node.get("product_type") or (node.get("iphone_struct") or {}).get("product_type")
+
+
+class PostFilter:
+    def __init__(self, since=None, until=None, media=ALL, skip_sidecars=False, max_posts=None):
+        """Keep posts from *since* up to and including the day *until* (UTC datetimes).
+
+        *media* is one of ``MEDIA_TYPES``; *max_posts* limits the number of
+        matching posts (the newest ones), None means no limit.
+        """
+        if media not in MEDIA_TYPES:
+            raise ValueError(f"unknown media type: {media}")
+        if max_posts is not None and max_posts < 1:
+            raise ValueError(f"max_posts must be at least 1, not {max_posts}")
+        self.since = since
+        # Whole days: "until 2024-05-31" includes that day
+        self.until = until + timedelta(days=1) if until is not None else None
+        self.media = media
+        self.skip_sidecars = skip_sidecars
+        self.max_posts = max_posts
+
+    @property
+    def active(self):
+        return bool(self.since or self.until or self.media != ALL or self.skip_sidecars or self.max_posts)
+
+    def describe(self):
+        parts = []
+        if self.since:
+            parts.append(f"since {self.since:%Y-%m-%d}")
+        if self.until:
+            parts.append(f"until {self.until - timedelta(days=1):%Y-%m-%d}")
+        if self.media != ALL:
+            parts.append(f"{self.media} only")
+        if self.skip_sidecars:
+            parts.append("no sidecars")
+        if self.max_posts:
+            parts.append(f"max {self.max_posts} posts")
+        return ", ".join(parts) or "none"
+
+    def matches(self, post):
+        """Whether *post* passes the type and date filters (no request is made)."""
+        typename = post.typename
+        if self.skip_sidecars and typename == "GraphSidecar":
+            return False
+        if self.media == POSTS and post.is_video:
+            return False
+        if self.media == VIDEOS and not post.is_video:
+            return False
+        if self.media == REELS and _product_type(post) != "clips":
+            return False
+        date = post.date_utc
+        if self.until is not None and date >= self.until:
+            return False
+        if self.since is not None and date < self.since:
+            return False
+        return True
+
+    def apply(self, posts, on_stop=None, taken=0):
+        """Yield the matching *posts* (newest first), ending pagination early.
+
+        ``on_stop(reason)`` is called when the iteration ends before *posts*
+        is exhausted. *taken* matching posts were already yielded before, by
+        an interrupted run that is resumed; they count towards ``max_posts``.
+        """
+        if self.max_posts and taken >= self.max_posts:
+            if on_stop:
+                on_stop(f"reached {self.max_posts} posts")
+            return
+        for post in posts:
+            pinned = getattr(post, "is_pinned", False)
+            if self.since is not None and not pinned and post.date_utc < self.since:
+                if on_stop:
+                    on_stop(f"reached posts older than {self.since:%Y-%m-%d}")
+                return
+            if self.matches(post):
+                taken += 1
+                yield post
+                if self.max_posts and taken >= self.max_posts:
+                    # Checked before the next post, which may cost a page request
+                    if on_stop:
+                        on_stop(f"reached {self.max_posts} posts")
+                    return
@@ -0,0 +1,213 @@
+"""Post-processing of downloaded images in a process pool.
+
+The loader hands every newly written image to a ``PostProcessor``. Paths wait
+in a bounded backlog and a dispatcher thread feeds them to a
+``ProcessPoolExecutor``, keeping only a few files in flight per process. So
+CPU-heavy work never runs on the download threads, and a slow processor
+cannot pile up an unbounded amount of work in memory. ``submit()`` only blocks
+once the backlog is full.
+
+Each file is decoded once per pass and then handed to every task in turn:
+
+* ``thumbnail`` - a small JPEG in ``<folder>/thumbnails/``
+* ``phash``     - a perceptual (difference) hash, appended to
+  ``<folder>/perceptual_hashes.tsv``
+* ``reencode``  - re-encode JPEGs to a maximum size and quality in place
+  (which also strips EXIF); kept only when the result is smaller
+
+Further tasks are top-level functions ``task(image, path, **params)`` (so
+that they can be pickled) passed in place of a task name.
+
+Requires Pillow; check ``HAS_PIL`` first. Pillow itself is only imported by
+the worker processes, so that the CLI can read the defaults below cheaply.
+"""
+import importlib.util
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+HAS_PIL = importlib.util.find_spec("PIL") is not None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+THUMBNAIL_DIR = "thumbnails"
+HASHES_FILENAME = "perceptual_hashes.tsv"
+
+DEFAULT_THUMBNAIL_SIZE = 320
+DEFAULT_MAX_SIDE = 2048
+DEFAULT_QUALITY = 85
+DEFAULT_BACKLOG = 1000
+
+
+# --- Tasks (run in the worker processes) ---
+
+def thumbnail(image, path, size=DEFAULT_THUMBNAIL_SIZE):
+    folder, name = os.path.split(path)
+    dest = os.path.join(folder, THUMBNAIL_DIR, os.path.splitext(name)[0] + ".jpg")
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    thumb = image.convert("RGB")
+    thumb.thumbnail((size, size))
+    thumb.save(dest, "JPEG", quality=80)
+    return dest
+
+
+def phash(image, path, hash_size=8):
+    """Difference hash: similar images differ in only a few bits."""
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            value = value << 1 | (left > pixels[row * (hash_size + 1) + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def reencode(image, path, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY):
+    if os.path.splitext(path)[1].lower() not in (".jpg", ".jpeg"):
+        return None
+    out = image.convert("RGB")
+    if max(out.size) > max_side:
+        out.thumbnail((max_side, max_side))
+    stat = os.stat(path)
+    tmp = path + ".reencode.tmp"
+    out.save(tmp, "JPEG", quality=quality, optimize=True)
+    size = os.path.getsize(tmp)
+    if size >= stat.st_size:
+        os.remove(tmp)
+        return None
+    # Replaces the file (not a hardlinked blob's content); keep the post date as mtime
+    os.replace(tmp, path)
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+    return stat.st_size - size
+
+
+TASKS = {"thumbnail": thumbnail, "phash": phash, "reencode": reencode}
+# Tasks that change the file run after the ones that only read it
+_ORDER = {"reencode": 1}
+
+
+def parse_tasks(text):
+    """``"thumbnail,phash"`` -> ``[("thumbnail", {}), ("phash", {})]``."""
+    names = [name.strip().lower() for name in (text or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in TASKS]
+    if unknown:
+        raise ValueError(f"unknown post-processing task(s): {', '.join(unknown)}")
+    return [(name, {}) for name in dict.fromkeys(names)]
+
+
+def process_file(path, tasks):
+    """Run *tasks* on the image at *path*; returns ``{task name: result}``."""
+    from PIL import Image
+
+    results = {}
+    with Image.open(path) as image:
+        image.load()
+        for task, params in sorted(tasks, key=lambda t: _ORDER.get(t[0], 0) if isinstance(t[0], str) else 0):
+            func = TASKS[task] if isinstance(task, str) else task
+            results[task if isinstance(task, str) else func.__name__] = func(image, path, **params)
+    return results
+
+
+# --- Dispatcher (runs in the download process) ---
+
+class PostProcessor:
+    def __init__(self, tasks, workers=None, max_backlog=DEFAULT_BACKLOG, on_error=None):
+        """Run *tasks* (``(name or function, params)`` pairs) on submitted files.
+
+        ``on_error(path, exception)`` is called from a background thread.
+        """
+        if not HAS_PIL:
+            raise RuntimeError("post-processing needs Pillow (pip install Pillow)")
+        self.tasks = list(tasks)
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.on_error = on_error
+        self._backlog = queue.Queue(maxsize=max_backlog)
+        # Files handed to the pool but not finished yet
+        self._in_flight = threading.BoundedSemaphore(self.workers * 2)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._thread = None
+
+        # Counters
+        self.submitted = 0
+        self.done = 0
+        self.failed = 0
+        self.saved_bytes = 0
+
+    def start(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, path):
+        """Queue *path* if it is an image; blocks only while the backlog is full."""
+        if os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS:
+            return False
+        self._backlog.put(path)
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def pending(self):
+        with self._lock:
+            return self.submitted - self.done - self.failed
+
+    def close(self, cancel=False):
+        """Finish all queued files (or drop the backlog with *cancel*) and stop."""
+        if cancel:
+            while True:
+                try:
+                    self._backlog.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self.submitted -= 1
+        self._backlog.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {"submitted": self.submitted, "done": self.done, "failed": self.failed,
+                    "saved_bytes": self.saved_bytes}
+
+    def _dispatch(self):
+        while True:
+            path = self._backlog.get()
+            if path is None:
+                return
+            self._in_flight.acquire()
+            try:
+                future = self._pool.submit(process_file, path, self.tasks)
+            except RuntimeError as e:
+                # Pool already shut down or broken
+                self._in_flight.release()
+                self._finished(path, None, e)
+                continue
+            future.add_done_callback(lambda f, path=path: self._collect(path, f))
+
+    def _collect(self, path, future):
+        self._in_flight.release()
+        error = future.exception()
+        self._finished(path, None if error else future.result(), error)
+
+    def _finished(self, path, results, error):
+        with self._lock:
+            if error is not None:
+                self.failed += 1
+            else:
+                self.done += 1
+                self.saved_bytes += results.get("reencode") or 0
+                if results.get("phash"):
+                    # Only this (pool callback) side writes the hash files
+                    folder, name = os.path.split(path)
+                    with open(os.path.join(folder, HASHES_FILENAME), "a", encoding="utf-8") as f:
+                        f.write(f"{name}\t{results['phash']}\n")
+        if error is not None and self.on_error:
+            self.on_error(path, error)
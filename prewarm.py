@@ -0,0 +1,122 @@
+"""Background warm-up while the user is still filling in the form.
+
+The Tk app starts a ``Prewarmer`` once its window is shown. On a background
+thread it imports instaloader and ``loader_ext``, builds a speculative loader
+and opens pooled connections to Instagram (``transfer.shared_api_adapter``,
+which every later loader mounts), so the first request of a download skips
+the import, DNS and TLS setup.
+
+``prefetch(usernames)`` also looks the entered profiles up on that thread and
+warms the media CDN host of their profile pictures. The app calls it once a
+name is complete (Enter, or leaving the field): every lookup is a real
+request from the shared metadata budget. A ``Downloader`` given the
+results of ``take()`` starts from them instead of requesting the profile
+again. Lookups are dropped after ``PREFETCH_TTL`` seconds. With a
+``response_cache`` (path of a ``response_cache.ResponseCache``) the full
+profile metadata is requested as well and stored there, where the download
+finds it when it starts listing the posts.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+PREFETCH_TTL = 300
+MAX_PREFETCH = 3    # profiles looked up per prefetch
+
+
+class Prewarmer:
+    def __init__(self, scheduler=None, response_cache=None):
+        self.scheduler = scheduler
+        self.response_cache = response_cache
+        # None until the import was tried, then whether instaloader is available
+        self.available = None
+        self.error = None
+        self._imported = threading.Event()
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._profiles = {}     # lowercase username -> (fetched at, JSON structure)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Wait for the import; returns whether instaloader is available."""
+        self._imported.wait(timeout)
+        return bool(self.available)
+
+    def prefetch(self, usernames):
+        """Look up (the first few of) *usernames* in the background; the newest call wins."""
+        self._requests.put([name.lower() for name in usernames[:MAX_PREFETCH]])
+
+    def take(self, usernames):
+        """Remove and return the fresh lookups of *usernames* (lowercase name -> structure)."""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for name in usernames:
+                entry = self._profiles.pop(name.lower(), None)
+                if entry is not None and now - entry[0] < PREFETCH_TTL:
+                    found[name.lower()] = entry[1]
+        return found
+
+    def _run(self):
+        try:
+            import instaloader  # noqa: F401
+            from loader_ext import MediaLoader
+            self.available = True
+        except ImportError as e:
+            self.available = False
+            self.error = e
+        finally:
+            self._imported.set()
+        if not self.available:
+            return
+
+        cache = None
+        if self.response_cache:
+            from response_cache import ResponseCache
+            try:
+                os.makedirs(os.path.dirname(self.response_cache) or ".", exist_ok=True)
+                cache = ResponseCache(self.response_cache)
+            except (OSError, sqlite3.Error):
+                # Prefetching still saves the profile lookup
+                cache = None
+        loader = MediaLoader(quiet=True, download_pictures=False, download_videos=False,
+                             save_metadata=False, scheduler=self.scheduler, response_cache=cache)
+        loader.warm_up()
+        while True:
+            usernames = self._requests.get()
+            # Only the latest request matters while the user is typing
+            while not self._requests.empty():
+                usernames = self._requests.get_nowait()
+            for name in usernames:
+                self._lookup(loader, name)
+
+    def _lookup(self, loader, name):
+        import instaloader
+
+        with self._lock:
+            entry = self._profiles.get(name)
+        if entry is not None and time.time() - entry[0] < PREFETCH_TTL:
+            return
+        try:
+            profile = instaloader.Profile.from_username(loader.context, name)
+            if loader.response_cache is not None:
+                # The request that get_posts() makes first, answered from the cache then
+                profile._obtain_metadata()
+        except Exception:
+            # Most likely a mistyped name; prefetching is best effort
+            return
+        structure = instaloader.get_json_structure(profile)
+        with self._lock:
+            self._profiles[name] = (time.time(), structure)
+        # Read from the node data; the property may request the full metadata
+        picture = structure["node"].get("profile_pic_url_hd") or structure["node"].get("profile_pic_url")
+        if picture:
+            loader.transfer.warm(picture)
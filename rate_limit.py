@@ -0,0 +1,250 @@
+"""Adaptive request scheduling shared by all download jobs.
+
+Requests are split into two budgets: ``metadata`` (GraphQL / API calls, which
+Instagram throttles aggressively) and ``media`` (CDN fetches, which tolerate
+far more parallelism). Each budget combines
+
+* a token bucket that caps the request rate, and
+* an adaptive concurrency limit.
+
+Both follow AIMD: a 429 or 5xx halves the rate and the concurrency limit and
+starts an exponential backoff, while a run of healthy responses ramps them up
+again one step at a time.
+
+This module only uses the standard library; the hooks that plug it into
+instaloader live in ``loader_ext``.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+def is_throttle_status(status):
+    return status == 429 or (status is not None and 500 <= status < 600)
+
+
+def throttle_status(error):
+    """Return the HTTP status (429 / 5xx) that caused *error*, or None.
+
+    Only a ``status_code`` or ``response`` on the error or one of its causes
+    counts; the message is never parsed.
+    """
+    while error is not None:
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        if is_throttle_status(status):
+            return status
+        error = error.__cause__
+    return None
+
+
+def retry_after(source):
+    """Seconds from a Retry-After header on a response (or an error's response)."""
+    response = getattr(source, "response", source)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Budget:
+    def __init__(self, name, rate, burst, concurrency, min_rate, max_rate,
+                 min_concurrency=1, max_concurrency=None, ramp_every=20,
+                 base_backoff=2.0, max_backoff=300.0):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.limit = int(concurrency)
+        self.min_concurrency = int(min_concurrency)
+        self.max_concurrency = int(max_concurrency or concurrency)
+        self.ramp_every = ramp_every
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._healthy = 0
+        self._strikes = 0
+        self._penalty_until = 0.0
+
+        # Counters
+        self.requests = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+
+    def __repr__(self):
+        return f"Budget({self.name!r}, rate={self.rate:.2f}/s, limit={self.limit})"
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _wait_for(self, need_slot, timeout=None):
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(0.0, self._penalty_until - now)
+                if not delay and self._tokens < 1:
+                    delay = (1 - self._tokens) / self.rate
+                slot_free = not need_slot or self._in_flight < self.limit
+                if not delay and slot_free:
+                    self._tokens -= 1
+                    if need_slot:
+                        self._in_flight += 1
+                    self.requests += 1
+                    waited = now - start
+                    self.wait_time += waited
+                    return waited
+                if deadline is not None and now >= deadline:
+                    raise TimeoutError(f"{self.name} budget exhausted")
+                # A busy slot is released with notify(); tokens just need time
+                wait = delay if slot_free else (delay or None)
+                if deadline is not None:
+                    wait = min(wait, deadline - now) if wait is not None else deadline - now
+                self._cond.wait(wait)
+
+    def acquire(self, timeout=None):
+        """Take one token (no concurrency slot); returns the seconds waited."""
+        return self._wait_for(False, timeout)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Hold one token and one concurrency slot for the duration of a request.
+
+        Yields the seconds spent waiting for them.
+        """
+        waited = self._wait_for(True, timeout)
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._strikes = 0
+            self._healthy += 1
+            if self._healthy >= self.ramp_every:
+                # Additive increase
+                self._healthy = 0
+                self.limit = min(self.max_concurrency, self.limit + 1)
+                self.rate = min(self.max_rate, self.rate + self.min_rate)
+                self._cond.notify_all()
+
+    def on_throttle(self, delay=None):
+        """Multiplicative decrease plus exponential (jittered) backoff."""
+        with self._cond:
+            self.throttled += 1
+            self._healthy = 0
+            self._strikes += 1
+            self.limit = max(self.min_concurrency, self.limit // 2)
+            self.rate = max(self.min_rate, self.rate / 2)
+            if delay is None:
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (self._strikes - 1))
+                delay *= random.uniform(0.5, 1.0)
+            else:
+                # A Retry-After of hours would stall every job sharing the budget
+                delay = min(self.max_backoff, delay)
+            self._penalty_until = max(self._penalty_until, time.monotonic() + delay)
+            self._tokens = min(self._tokens, 0.0)
+        return delay
+
+    def record(self, status, delay=None):
+        """Feed back one HTTP status; returns True if it was a throttle."""
+        if is_throttle_status(status):
+            self.on_throttle(delay)
+            return True
+        if status is not None and status < 400:
+            self.on_success()
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "rate": round(self.rate, 3),
+                "concurrency": self.limit,
+                "in_flight": self._in_flight,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "wait_time": round(self.wait_time, 3),
+            }
+
+
+class RequestScheduler:
+    def __init__(self, metadata=None, media=None):
+        self.metadata = metadata or Budget(
+            "metadata", rate=0.5, burst=10, concurrency=2,
+            min_rate=0.05, max_rate=2.0, max_concurrency=4)
+        self.media = media or Budget(
+            "media", rate=20, burst=40, concurrency=8,
+            min_rate=1.0, max_rate=100.0, max_concurrency=32, ramp_every=10)
+
+    def call(self, budget, fn, retries=4, stop=None, on_retry=None, on_wait=None, transient=None,
+             throttled=throttle_status):
+        """Run ``fn()`` inside a slot of *budget*, retrying throttled attempts.
+
+        A throttle is either a returned response with a 429/5xx status or an
+        exception for which ``throttled(error)`` returns one (by default
+        ``throttle_status``). Exceptions for which ``transient(error)``
+        is true (e.g. a dropped connection) are retried after a short backoff
+        that leaves the budget's rate alone. Other exceptions are raised
+        unchanged. ``on_wait(seconds)`` reports time spent waiting for the
+        budget (and in transient backoffs) and ``on_retry()`` each retried
+        attempt.
+        """
+        for attempt in range(retries + 1):
+            if attempt and on_retry:
+                on_retry()
+            delay = None
+            with budget.slot() as waited:
+                if on_wait:
+                    on_wait(waited)
+                try:
+                    result = fn()
+                except Exception as e:
+                    status = throttled(e)
+                    retry = status is not None or (transient is not None and transient(e))
+                    if not retry or attempt == retries or (stop and stop.is_set()):
+                        raise
+                    if status is not None:
+                        budget.on_throttle(retry_after(e))
+                        continue
+                    delay = budget.base_backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+            if delay is not None:
+                # Outside the slot, so other requests go on meanwhile
+                time.sleep(delay)
+                if on_wait:
+                    on_wait(delay)
+                continue
+            status = getattr(result, "status_code", None)
+            if is_throttle_status(status) and attempt < retries:
+                budget.on_throttle(retry_after(result))
+                continue
+            budget.record(status if status is not None else 200)
+            return result
+
+    def stats(self):
+        return {"metadata": self.metadata.stats(), "media": self.media.stats()}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler():
+    """The process-wide scheduler, so that all jobs draw from the same budgets."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RequestScheduler()
+        return _shared
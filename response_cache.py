@@ -0,0 +1,131 @@
+"""Persistent cache of Instagram API responses.
+
+Re-running the same accounts a few minutes apart (to fix the save folder,
+toggle stories, or after a failed batch) used to repeat every profile lookup
+and post page request. A ``ResponseCache`` keeps those responses in a SQLite
+file shared by all runs, each kind for its own time to live:
+
+* ``profile``      - the profile page that resolves a username (user ID etc.)
+* ``profile_info`` - the full profile metadata, including the first posts
+* ``posts``        - further pages of a profile's post list
+
+Entries are evicted least recently used first once the cache grows beyond
+``max_bytes``. Hits and misses (responses that were requested and then
+stored) are counted per kind (``stats()``).
+
+``loader_ext.MediaLoader`` decides what to cache; this module knows nothing
+about instaloader.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+PROFILE = "profile"
+PROFILE_INFO = "profile_info"
+POSTS = "posts"
+KINDS = (PROFILE, PROFILE_INFO, POSTS)
+
+DEFAULT_TTL = {
+    PROFILE: 6 * 3600,      # usernames rarely move to another user ID
+    PROFILE_INFO: 10 * 60,
+    POSTS: 10 * 60,         # also bounds how stale "fast update" may see a profile
+}
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    kind       TEXT NOT NULL,
+    data       BLOB NOT NULL,
+    size       INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=None, max_bytes=DEFAULT_MAX_BYTES):
+        """*ttl* overrides ``DEFAULT_TTL`` per kind (seconds; 0 disables a kind)."""
+        self.path = path
+        self.ttl = dict(DEFAULT_TTL, **(ttl or {}))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._hits = dict.fromkeys(KINDS, 0)
+        self._misses = dict.fromkeys(KINDS, 0)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, key):
+        """The cached, unexpired response for *key*, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT data, kind, expires_at FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+            # Also ignore entries of kinds that are disabled for this cache
+            if row is None or row[2] < now or self.ttl.get(row[1], 0) <= 0:
+                return None
+            self._hits[row[1]] += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, kind, key, value):
+        """Store the response *value* of *kind*, which was requested after a miss."""
+        ttl = self.ttl.get(kind, 0)
+        with self._lock:
+            self._misses[kind] += 1
+        if ttl <= 0:
+            return
+        data = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, kind, data, len(data), now + ttl, now))
+            self._size += len(data) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Least recently used first, down to 90% so that not every put evicts
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if self._size <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._size = 0
+
+    def stats(self):
+        """``{kind: {"hits": n, "misses": n}}`` since the cache was opened."""
+        with self._lock:
+            return {kind: {"hits": self._hits[kind], "misses": self._misses[kind]} for kind in KINDS}
+
+
+def format_stats(stats):
+    """One-line summary of ``ResponseCache.stats()``."""
+    hits = sum(s["hits"] for s in stats.values())
+    misses = sum(s["misses"] for s in stats.values())
+    parts = ", ".join(f"{kind} {s['hits']}/{s['hits'] + s['misses']}" for kind, s in stats.items()
+                      if s["hits"] or s["misses"])
+    return f"{hits} hits, {misses} misses" + (f" ({parts})" if parts else "")
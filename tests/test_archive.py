@@ -0,0 +1,101 @@
+"""Archives whose writer was killed mid-profile.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from archive import ArchiveReader, ArchiveWriter, TAR, ZIP  # noqa: E402
+
+# Appends three members, then dies without close(), like a killed app
+KILLED_WRITER = """
+import os, sys
+sys.path.insert(0, {root!r})
+from archive import ArchiveWriter
+writer = ArchiveWriter({path!r}, {fmt!r})
+for i in range(3):
+    writer.add_bytes(os.path.join({folder!r}, "alice", f"{{i}}.jpg"), bytes([i]) * 5000)
+writer.add_bytes(os.path.join({folder!r}, "alice", "0.json"), b'{{"id": 0}}')
+os._exit(1)
+"""
+
+
+class KilledWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+
+    def kill_writer(self, fmt):
+        path = os.path.join(self.folder, f"alice.{fmt}")
+        script = KILLED_WRITER.format(root=ROOT, path=path, fmt=fmt, folder=self.folder)
+        subprocess.run([sys.executable, "-c", script], check=False)
+        return path
+
+    def test_zip_directory_is_rebuilt(self):
+        path = self.kill_writer(ZIP)
+        self.assertFalse(zipfile.is_zipfile(path))
+
+        with ArchiveWriter(path, ZIP) as writer:
+            self.assertTrue(writer.repaired)
+            self.assertEqual(len(writer), 4)
+            self.assertTrue(writer.contains(os.path.join(self.folder, "alice", "1.jpg")))
+            self.assertTrue(writer.add_bytes(os.path.join(self.folder, "alice", "3.jpg"), b"new"))
+
+        with zipfile.ZipFile(path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()), ["alice/0.jpg", "alice/0.json", "alice/1.jpg",
+                                                     "alice/2.jpg", "alice/3.jpg"])
+        with ArchiveReader(path) as reader:
+            self.assertEqual(reader.read("alice/2.jpg"), bytes([2]) * 5000)
+            self.assertEqual(reader.read("alice/0.json"), b'{"id": 0}')
+            self.assertEqual(reader.read("alice/3.jpg"), b"new")
+
+    def test_zip_partial_member_is_cut_off(self):
+        path = self.kill_writer(ZIP)
+        size = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(b"PK\x03\x04 half a member")
+
+        with ArchiveWriter(path, ZIP) as writer:
+            self.assertEqual(len(writer), 4)
+        with zipfile.ZipFile(path) as zf:
+            self.assertEqual(len(zf.namelist()), 4)
+            self.assertEqual(zf.start_dir, size)
+
+    def test_intact_zip_is_not_repaired(self):
+        path = os.path.join(self.folder, "alice.zip")
+        with ArchiveWriter(path, ZIP) as writer:
+            writer.add_bytes(os.path.join(self.folder, "alice", "0.jpg"), b"x")
+        with ArchiveWriter(path, ZIP) as writer:
+            self.assertFalse(writer.repaired)
+            self.assertEqual(len(writer), 1)
+
+    def test_zip_is_readable_while_being_written(self):
+        path = os.path.join(self.folder, "alice.zip")
+        with ArchiveWriter(path, ZIP) as writer:
+            writer.add_bytes(os.path.join(self.folder, "alice", "0.jpg"), bytes(range(256)) * 40)
+            writer.add_bytes(os.path.join(self.folder, "alice", "0.json"), b'{"id": 0}' * 50)
+            with ArchiveReader(path) as reader:
+                self.assertEqual(reader.read("alice/0.jpg"), bytes(range(256)) * 40)
+                self.assertEqual(reader.read("alice/0.json"), b'{"id": 0}' * 50)
+
+    def test_tar_stays_readable(self):
+        path = self.kill_writer(TAR)
+        with tarfile.open(path) as tf:
+            self.assertEqual(len(tf.getnames()), 4)
+        with ArchiveWriter(path, TAR) as writer:
+            self.assertFalse(writer.repaired)
+            self.assertEqual(len(writer), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
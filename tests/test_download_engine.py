@@ -0,0 +1,74 @@
+"""Result order and stop() of the parallel download engine.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from download_engine import ParallelDownloader  # noqa: E402
+
+
+class ParallelDownloaderTest(unittest.TestCase):
+    def test_results_come_in_post_order(self):
+        def download(post):
+            # Earlier posts finish last
+            time.sleep((10 - post) * 0.005)
+            return post % 2 == 0
+
+        results = []
+        engine = ParallelDownloader(download, workers=4)
+        count = engine.run(range(10), lambda post, success, error: results.append((post, success)))
+        self.assertEqual(results, [(post, post % 2 == 0) for post in range(10)])
+        self.assertEqual(count, 5)
+
+    def test_posts_skipped_after_stop_are_not_reported(self):
+        downloaded = set()
+        lock = threading.Lock()
+
+        def download(post):
+            time.sleep(0.01)
+            with lock:
+                downloaded.add(post)
+            return True
+
+        reported = []
+        engine = ParallelDownloader(download, workers=4)
+
+        def on_result(post, success, error):
+            reported.append(post)
+            if len(reported) == 3:
+                engine.stop()
+
+        count = engine.run(iter(range(100)), on_result)
+        self.assertTrue(engine.stopped)
+        self.assertLess(len(reported), 100)
+        self.assertEqual(reported, list(range(len(reported))))
+        self.assertLessEqual(set(reported), downloaded)
+        self.assertEqual(count, len(reported))
+
+    def test_failures_are_reported_and_pagination_errors_raised(self):
+        def download(post):
+            if post == 1:
+                raise OSError("disk full")
+            return True
+
+        def posts():
+            yield from range(3)
+            raise RuntimeError("pagination failed")
+
+        results = []
+        engine = ParallelDownloader(download, workers=2)
+        with self.assertRaisesRegex(RuntimeError, "pagination failed"):
+            engine.run(posts(), lambda post, success, error: results.append((post, success, error)))
+        self.assertEqual([(post, success) for post, success, _ in results], [(0, True), (1, False), (2, True)])
+        self.assertIsInstance(results[1][2], OSError)
+
+
+if __name__ == "__main__":
+    unittest.main()
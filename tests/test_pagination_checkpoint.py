@@ -0,0 +1,83 @@
+"""Interrupted profile downloads that resume from their pagination checkpoint.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from download_index import DownloadIndex  # noqa: E402
+from fake_instagram import FakeInstagram, FakeProfile, route_requests  # noqa: E402
+from post_filters import PostFilter  # noqa: E402
+from rate_limit import RequestScheduler  # noqa: E402
+
+
+class StopResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.profile = FakeProfile("alice", posts=60, image_bytes=1024, video_bytes=4096)
+        self.server = FakeInstagram([self.profile]).start()
+        self.addCleanup(self.server.stop)
+
+    def download(self, stop_after=None, post_filter=None):
+        """One run; stopped once *stop_after* posts are done. Returns the log and the graphql requests."""
+        from downloader_core import Downloader, DownloadOptions
+
+        lines = []
+        done = 0
+        options = DownloadOptions(self.folder, workers=2, response_cache=None, post_filter=post_filter)
+
+        def on_event(kind, data):
+            nonlocal done
+            if kind == "log":
+                lines.append(data["message"])
+            elif kind == "post":
+                done += 1
+                if done == stop_after:
+                    core.stop()
+
+        core = Downloader(options, on_event=on_event, scheduler=RequestScheduler())
+        before = self.server.stats()["requests"].get("graphql", 0)
+        with route_requests(self.server.url), contextlib.redirect_stdout(io.StringIO()):
+            core.run([self.profile.username])
+        return "\n".join(lines), self.server.stats()["requests"].get("graphql", 0) - before
+
+    def indexed(self):
+        with DownloadIndex.for_folder(self.folder) as index:
+            return index.count(self.profile.username)
+
+    def checkpoint_exists(self):
+        return os.path.isfile(os.path.join(self.folder, self.profile.username, ".pagination_checkpoint.json"))
+
+    def test_resumes_after_the_stopped_posts(self):
+        self.download(stop_after=30)
+        first = self.indexed()
+        self.assertLess(first, 60)
+        self.assertTrue(self.checkpoint_exists())
+
+        log, pages = self.download()
+        self.assertIn("RESUMING AFTER POST", log)
+        self.assertEqual(self.indexed(), 60)
+        # The pages before the checkpoint are not requested again
+        self.assertLess(pages, 4)
+        self.assertFalse(self.checkpoint_exists())
+
+    def test_max_posts_counts_the_interrupted_run(self):
+        self.download(stop_after=15, post_filter=PostFilter(max_posts=40))
+        self.assertLess(self.indexed(), 40)
+
+        log, _ = self.download(post_filter=PostFilter(max_posts=40))
+        self.assertIn("RESUMING AFTER POST", log)
+        self.assertEqual(self.indexed(), 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Early termination of the post filters.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import os
+import sys
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from post_filters import PostFilter, VIDEOS, parse_date  # noqa: E402
+
+
+def post(day, is_video=False, pinned=False):
+    return SimpleNamespace(date_utc=datetime(2024, 5, day), is_video=is_video, is_pinned=pinned,
+                           typename="GraphVideo" if is_video else "GraphImage", day=day)
+
+
+class Pagination:
+    """Posts as pagination yields them, counting how many were requested."""
+
+    def __init__(self, posts):
+        self.posts = posts
+        self.pulled = 0
+
+    def __iter__(self):
+        for p in self.posts:
+            self.pulled += 1
+            yield p
+
+
+class PostFilterTest(unittest.TestCase):
+    def run_filter(self, post_filter, posts, taken=0):
+        stops = []
+        pagination = Pagination(posts)
+        days = [p.day for p in post_filter.apply(pagination, on_stop=stops.append, taken=taken)]
+        return days, pagination.pulled, stops
+
+    def test_pinned_posts_do_not_end_the_since_range(self):
+        posts = [post(2, pinned=True), post(1, pinned=True), post(20), post(15), post(9), post(8)]
+        days, pulled, stops = self.run_filter(PostFilter(since=parse_date("2024-05-10")), posts)
+        self.assertEqual(days, [20, 15])
+        # Stopped at the first older post that is not pinned
+        self.assertEqual(pulled, 5)
+        self.assertEqual(stops, ["reached posts older than 2024-05-10"])
+
+    def test_max_posts_stops_before_the_next_post(self):
+        posts = [post(20), post(19, is_video=True), post(18), post(17, is_video=True), post(16)]
+        days, pulled, stops = self.run_filter(PostFilter(media=VIDEOS, max_posts=2), posts)
+        self.assertEqual(days, [19, 17])
+        self.assertEqual(pulled, 4)
+        self.assertEqual(stops, ["reached 2 posts"])
+
+    def test_posts_of_a_resumed_run_count_towards_max_posts(self):
+        posts = [post(20), post(19), post(18)]
+        self.assertEqual(self.run_filter(PostFilter(max_posts=3), posts, taken=2)[0], [20])
+        self.assertEqual(self.run_filter(PostFilter(max_posts=3), posts, taken=3)[:2], ([], 0))
+
+    def test_until_skips_without_stopping(self):
+        posts = [post(20), post(12), post(11)]
+        days, pulled, stops = self.run_filter(PostFilter(until=parse_date("2024-05-12")), posts)
+        self.assertEqual(days, [12, 11])
+        self.assertEqual(stops, [])
+
+    def test_max_posts_must_be_positive(self):
+        for value in (0, -1):
+            with self.assertRaises(ValueError):
+                PostFilter(max_posts=value)
+        self.assertFalse(PostFilter(max_posts=None).active)
+
+
+if __name__ == "__main__":
+    unittest.main()
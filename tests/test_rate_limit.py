@@ -0,0 +1,111 @@
+"""The request scheduler against the local fake Instagram server.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_instagram import FakeInstagram, FakeProfile, route_requests  # noqa: E402
+from rate_limit import Budget, RequestScheduler, throttle_status  # noqa: E402
+from transfer import TransferError  # noqa: E402
+
+
+def fast_scheduler():
+    """Budgets that throttle like the real ones, in milliseconds instead of minutes."""
+    return RequestScheduler(
+        metadata=Budget("metadata", rate=50, burst=50, concurrency=2, min_rate=5, max_rate=100,
+                        max_concurrency=4, ramp_every=3, base_backoff=0.02, max_backoff=0.1),
+        media=Budget("media", rate=200, burst=200, concurrency=8, min_rate=20, max_rate=400,
+                     max_concurrency=16, ramp_every=3, base_backoff=0.02, max_backoff=0.1))
+
+
+def media_urls(server, profile):
+    return [f"{server.url}/v/{asset}" for asset in profile.assets]
+
+
+class BudgetTest(unittest.TestCase):
+    def test_throttle_halves_and_successes_ramp_up(self):
+        budget = Budget("test", rate=8, burst=8, concurrency=8, min_rate=1, max_rate=8, ramp_every=2,
+                        max_backoff=0.01)
+        budget.on_throttle()
+        self.assertEqual((budget.rate, budget.limit), (4, 4))
+        for _ in range(4):
+            budget.on_success()
+        self.assertEqual((budget.rate, budget.limit), (6, 6))
+
+    def test_retry_after_is_capped(self):
+        budget = Budget("test", rate=1, burst=1, concurrency=1, min_rate=1, max_rate=1, max_backoff=5)
+        self.assertEqual(budget.on_throttle(86400), 5)
+
+    def test_numbers_in_messages_are_no_throttle(self):
+        self.assertIsNone(throttle_status(TransferError("Size mismatch: got 503 bytes, expected 512")))
+        self.assertEqual(throttle_status(TransferError("HTTP error code 503.", 503)), 503)
+        try:
+            try:
+                raise TransferError("throttled", 429)
+            except TransferError as e:
+                raise ValueError("wrapped") from e
+        except ValueError as e:
+            self.assertEqual(throttle_status(e), 429)
+
+
+class ThrottledServerTest(unittest.TestCase):
+    def setUp(self):
+        self.profile = FakeProfile("alice", posts=30, image_bytes=1024, video_bytes=4096)
+
+    def test_throttled_media_is_retried(self):
+        scheduler = fast_scheduler()
+        budget = scheduler.media
+        start_rate = budget.rate
+        retries = []
+        rates = []
+        with FakeInstagram([self.profile], throttle_every=4, retry_after=60) as server, \
+                requests.Session() as session:
+            responses = []
+            for url in media_urls(server, self.profile):
+                responses.append(scheduler.call(budget, lambda: session.get(url), on_retry=lambda: retries.append(1)))
+                rates.append(budget.rate)
+            throttled = server.stats()["throttled"]
+
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertGreater(throttled, 0)
+        self.assertEqual(len(retries), throttled)
+        self.assertEqual(budget.throttled, throttled)
+        # Halved by the throttles, ramped up again by the healthy responses in between
+        self.assertLess(min(rates), start_rate)
+        self.assertTrue(any(later > earlier for earlier, later in zip(rates, rates[1:])))
+
+    def test_throttled_metadata_download_completes(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        from downloader_core import Downloader, DownloadOptions
+
+        scheduler = fast_scheduler()
+        options = DownloadOptions(os.path.join(folder, "out"), workers=2, response_cache=None)
+        core = Downloader(options, scheduler=scheduler)
+        for status in (503, 429):
+            with self.subTest(status=status):
+                server = FakeInstagram([self.profile], metadata_fail_every=2, metadata_status=status)
+                with server, route_requests(server.url), contextlib.redirect_stdout(io.StringIO()):
+                    jobs = core.run([self.profile.username])
+                self.assertIsNone(jobs[0].error)
+                self.assertGreater(server.stats()["throttled"], 0)
+                files = os.listdir(os.path.join(folder, "out", self.profile.username))
+                self.assertEqual(sum(1 for f in files if f.endswith((".jpg", ".mp4"))),
+                                 self.profile.total_media())
+                shutil.rmtree(os.path.join(folder, "out"))
+        self.assertGreater(scheduler.metadata.throttled, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Resumable media transfers against a local HTTP server.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from transfer import MediaTransfer, TransferError, header_extension, PART_SUFFIX  # noqa: E402
+
+BODY = bytes(range(256)) * 64     # 16 KiB
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set per test: honour Range, cut the first response short, claim a wrong total
+    ranges = True
+    cut_first_at = None
+    wrong_total = False
+    requests = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.requests.append(("HEAD", None))
+        self._headers(200, len(BODY))
+
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        self.requests.append(("GET", requested))
+        match = re.match(r"bytes=(\d+)-", requested or "")
+        if not match or not self.ranges:
+            body = BODY
+            if self.cut_first_at is not None and len(self.requests) == 1:
+                # Announce everything, send a part, drop the connection
+                self._headers(200, len(BODY))
+                self.wfile.write(BODY[:self.cut_first_at])
+                self.close_connection = True
+                return
+            self._headers(200, len(body))
+            self.wfile.write(body)
+            return
+        start = int(match.group(1))
+        if start >= len(BODY):
+            self._headers(416, 0, {"Content-Range": f"bytes */{len(BODY)}"})
+            return
+        body = BODY[start:]
+        total = len(BODY) - 1 if self.wrong_total else len(BODY)
+        self._headers(206, len(body), {"Content-Range": f"bytes {start}-{len(BODY) - 1}/{total}"})
+        self.wfile.write(body)
+
+    def _headers(self, status, length, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "image/webp")
+        self.send_header("Content-Length", str(length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.requests = []
+        handler = type("Handler", (_Handler,), {"requests": self.requests})
+        self.handler = handler
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address[:2]
+        self.url = f"http://{host}:{port}/v/clip.jpg"
+        self.transfer = MediaTransfer(chunk_size=1024)
+        self.addCleanup(self.transfer.close)
+        self.dest = os.path.join(self.folder, "clip.jpg")
+
+    def write_part(self, data):
+        with open(self.dest + PART_SUFFIX, "wb") as f:
+            f.write(data)
+
+    def resolve(self, response):
+        return os.path.join(self.folder, "clip") + header_extension(response.headers["Content-Type"])
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_part_of_an_earlier_run_is_resumed(self):
+        self.write_part(BODY[:5000])
+        final = self.transfer.fetch(self.url, self.dest)
+        self.assertEqual(final, self.dest)
+        self.assertEqual(self.read(final), BODY)
+        self.assertEqual(self.requests, [("GET", "bytes=5000-")])
+        self.assertFalse(os.path.exists(self.dest + PART_SUFFIX))
+
+    def test_dropped_connection_is_resumed_within_the_call(self):
+        self.handler.cut_first_at = 3072
+        final = self.transfer.fetch(self.url, self.dest)
+        self.assertEqual(self.read(final), BODY)
+        self.assertEqual(self.requests[-1], ("GET", "bytes=3072-"))
+
+    def test_full_response_to_a_range_request_replaces_the_part(self):
+        self.handler.ranges = False
+        self.write_part(b"stale bytes")
+        final = self.transfer.fetch(self.url, self.dest)
+        self.assertEqual(self.read(final), BODY)
+        self.assertEqual(self.requests, [("GET", "bytes=11-")])
+
+    def test_complete_part_is_named_from_a_head_request(self):
+        self.write_part(BODY)
+        final = self.transfer.fetch(self.url, self.dest, resolve=self.resolve)
+        self.assertEqual(final, os.path.join(self.folder, "clip.webp"))
+        self.assertEqual(self.read(final), BODY)
+        self.assertEqual(self.requests, [("GET", f"bytes={len(BODY)}-"), ("HEAD", None)])
+
+    def test_existing_resolved_file_is_not_downloaded_again(self):
+        with open(os.path.join(self.folder, "clip.webp"), "wb") as f:
+            f.write(BODY)
+        self.assertIsNone(self.transfer.fetch(self.url, self.dest, resolve=self.resolve))
+        self.assertFalse(os.path.exists(self.dest + PART_SUFFIX))
+
+    def test_size_mismatch_discards_the_part(self):
+        self.handler.wrong_total = True
+        self.write_part(BODY[:5000])
+        with self.assertRaises(TransferError):
+            self.transfer.fetch(self.url, self.dest)
+        self.assertFalse(os.path.exists(self.dest + PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.dest))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Poll schedule of the watch mode, on a fake clock.
+
+Run with ``python -m unittest discover tests`` from the repository root.
+"""
+import heapq
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from downloader_core import DownloadOptions  # noqa: E402
+from watch import Watcher, JITTER, MAX_BACKOFF  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class WatcherScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.clock = FakeClock()
+
+    def watcher(self, profiles=("alice", "bob", "carol"), **kwargs):
+        watcher = Watcher(DownloadOptions(self.folder, response_cache=None), list(profiles), clock=self.clock,
+                          interval=600, **kwargs)
+        watcher._load_stamps(self.folder)
+        watcher.core.build_loader = lambda folder=None: None
+        return watcher
+
+    def pop(self, watcher):
+        """(delay, profile) of the next poll due."""
+        due, _, watched = heapq.heappop(watcher._queue)
+        return due - self.clock.now, watched.profile
+
+    def test_first_round_is_spread_over_one_interval(self):
+        watcher = self.watcher()
+        watcher._interval = watcher.poll_interval()
+        watcher._schedule_first_round()
+        polls = [self.pop(watcher) for _ in range(3)]
+        self.assertEqual([profile for _, profile in polls], ["alice", "bob", "carol"])
+        for i, (delay, _) in enumerate(polls):
+            self.assertTrue(200 * i <= delay < 200 * (i + 1))
+
+    def test_interval_is_stretched_to_the_budget(self):
+        watcher = self.watcher([f"user{i}" for i in range(100)], budget=200)
+        self.assertEqual(watcher.poll_interval(), 3600)
+        # The story requests of all profiles come out of the same budget
+        self.assertGreater(watcher.poll_interval(stories=True), 3600)
+
+    def test_failed_polls_back_off_until_one_succeeds(self):
+        watcher = self.watcher(["alice"])
+        watcher._interval = 600
+        watched = watcher._watched[0]
+
+        def fail(loader, job, index):
+            raise ConnectionError("offline")
+
+        watcher.core.download_profile = fail
+        for failures in range(1, 8):
+            watcher._poll(watched, None)
+            delay, _ = self.pop(watcher)
+            expected = min(600 * 2 ** failures, MAX_BACKOFF)
+            self.assertEqual(watched.failures, failures)
+            self.assertTrue(expected * (1 - JITTER) <= delay <= expected * (1 + JITTER))
+
+        watcher.core.download_profile = lambda loader, job, index: 0
+        watcher._poll(watched, None)
+        delay, _ = self.pop(watcher)
+        self.assertEqual(watched.failures, 0)
+        self.assertTrue(600 * (1 - JITTER) <= delay <= 600 * (1 + JITTER))
+
+    def test_stories_are_checked_once_a_user_id_is_known(self):
+        watcher = self.watcher(["alice"])
+        watcher._interval = 600
+        watcher._stories = True
+        self.assertEqual(watcher._next_stories, math.inf)
+
+        def resolve(loader, job, index):
+            job.userid = 42
+            return 0
+
+        watcher.core.download_profile = resolve
+        self.clock.now += 150
+        watcher._poll(watcher._watched[0], None)
+        self.assertEqual(watcher._next_stories, self.clock.now)
+        self.assertEqual(watcher._stamps.get_profile_id("alice"), 42)
+
+        # A restarted watcher knows the ID and checks stories right away
+        self.assertEqual(self.watcher(["alice"])._watched[0].userid, 42)
+
+
+if __name__ == "__main__":
+    unittest.main()
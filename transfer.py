@@ -0,0 +1,276 @@
+"""Resumable, chunked media transfers over a pooled keep-alive session.
+
+A transfer streams into ``<file>.part`` in fixed-size chunks. When the
+connection drops, it resumes from the bytes already on disk with an HTTP
+Range request, both within the same call and on a later run (for example
+after the app was closed mid-download). The finished file is checked against
+the expected size and then atomically renamed into place.
+
+``fetch_into`` streams into a file object instead (for archive output),
+with the same resume logic within the call.
+"""
+import contextlib
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 256 * 1024
+PART_SUFFIX = ".part"
+
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+|\*)-?(\d*)/(\d+|\*)")
+
+
+class TransferError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IncompleteTransfer(TransferError):
+    """The stream ended before the announced size was reached."""
+
+
+def url_extension(url):
+    """File extension guessed from a CDN URL, the same way instaloader does."""
+    match = re.search(r"\.[a-z0-9]*\?", url)
+    return url[-3:] if match is None else match.group(0)[1:-1]
+
+
+def header_extension(content_type):
+    """File extension (with dot) for a Content-Type header value."""
+    return "." + content_type.split(";")[0].split("/")[-1].lower().replace("jpeg", "jpg")
+
+
+def _content_range(response):
+    """(start, total) from a Content-Range header; unknown parts are None."""
+    match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+    if not match:
+        return None, None
+    start, _, total = match.groups()
+    return (None if start == "*" else int(start)), (None if total == "*" else int(total))
+
+
+class MediaTransfer:
+    def __init__(self, session=None, chunk_size=CHUNK_SIZE, pool_size=32, timeout=(10, 60),
+                 max_resumes=5, user_agent=None):
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        if user_agent:
+            session.headers["User-Agent"] = user_agent
+        self.session = session
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_resumes = max_resumes
+
+    def close(self):
+        self.session.close()
+
+    def warm(self, url):
+        """Open a pooled connection to the host of *url* ahead of the first download."""
+        try:
+            self.session.head(url, timeout=self.timeout, allow_redirects=False).close()
+            return True
+        except requests.RequestException:
+            return False
+
+    def fetch(self, url, dest, mtime=None, resolve=None):
+        """Download *url* to *dest* and return the final path.
+
+        ``resolve(response)`` may choose a different final path from the first
+        response (e.g. by Content-Type). If that path already exists nothing is
+        written and None is returned. A ``.part`` file left by an earlier
+        attempt is resumed rather than downloaded again.
+        """
+        part = _PartFile(dest + PART_SUFFIX)
+        chosen = []
+
+        def choose(resp):
+            chosen.append(resolve(resp) if resolve and resp.ok else dest)
+            return chosen[0] == dest or not os.path.isfile(chosen[0])
+
+        if not self._transfer(url, part, choose):
+            return None
+        final = chosen[0]
+        os.replace(part.path, final)
+        if mtime is not None:
+            os.utime(final, (datetime.now().timestamp(), mtime.timestamp()))
+        return final
+
+    def fetch_into(self, url, f, resolve=None):
+        """Download *url* into the seekable file object *f* (e.g. a spooled
+        temporary file), rewound afterwards.
+
+        Resumes within the call like ``fetch``. Returns ``resolve(response)``
+        of the first response, or None without *resolve*.
+        """
+        chosen = []
+
+        def choose(resp):
+            chosen.append(resolve(resp) if resolve and resp.ok else None)
+            return True
+
+        self._transfer(url, _Buffer(f), choose)
+        f.seek(0)
+        return chosen[0]
+
+    def _transfer(self, url, sink, choose):
+        """Stream *url* into *sink*; False if ``choose(first response)`` declined it.
+
+        ``choose`` gets the first response with a body, or a HEAD response
+        when the server answers 416 because *sink* is complete already.
+        """
+        chosen = False
+        resumes = 0
+        while True:
+            offset = sink.size()
+            # identity: byte offsets must refer to the stored bytes
+            headers = {"Accept-Encoding": "identity"}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+                    # A 416 for a complete part says nothing about the media itself
+                    if not chosen and resp.status_code != 416:
+                        if not choose(resp):
+                            return False
+                        chosen = True
+                    total = self._write(resp, sink, offset)
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IncompleteTransfer) as e:
+                resumes += 1
+                if resumes > self.max_resumes:
+                    raise TransferError(f"Transfer of {url} failed after {resumes} attempts: {e}") from e
+                time.sleep(min(2 ** resumes, 30) / 4)
+                continue
+
+            size = sink.size()
+            if total is not None and size != total:
+                sink.reset()
+                raise TransferError(f"Size mismatch for {url}: got {size} bytes, expected {total}")
+            if not chosen:
+                # The part had all the bytes already: its name comes from the headers alone
+                with self.session.head(url, timeout=self.timeout, allow_redirects=True) as resp:
+                    return choose(resp)
+            return True
+
+    def _write(self, resp, sink, offset):
+        """Stream *resp* into *sink*; returns the expected total size or None."""
+        length = resp.headers.get("Content-Length")
+        length = int(length) if length and length.isdigit() else None
+
+        if resp.status_code == 416 and offset:
+            # Nothing left to send: either the part is already complete or stale
+            _, total = _content_range(resp)
+            if total == offset:
+                return total
+            sink.reset()
+            raise IncompleteTransfer(f"Stale partial file {sink}")
+        if resp.status_code == 206 and offset:
+            start, total = _content_range(resp)
+            if start != offset:
+                # Server resumed somewhere else: start over
+                sink.reset()
+                raise IncompleteTransfer(f"Unexpected range start {start} for {sink}")
+            append = True
+            if total is None and length is not None:
+                total = offset + length
+        elif resp.status_code == 200:
+            # Full body (Range unsupported or first attempt)
+            append = False
+            total = length
+        else:
+            raise TransferError(f"HTTP error code {resp.status_code}.", resp.status_code)
+
+        with sink.open(append) as f:
+            for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                if chunk:
+                    f.write(chunk)
+        if total is not None and sink.size() < total:
+            raise IncompleteTransfer(f"Connection closed at {sink.size()} of {total} bytes")
+        return total
+
+
+class _PartFile:
+    """Transfer target on disk: the ``.part`` file, kept for a later run."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+    def open(self, append):
+        return open(self.path, "ab" if append else "wb")
+
+    def reset(self):
+        os.remove(self.path)
+
+
+class _Buffer:
+    """Transfer target in a file object; nothing survives the process."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def __str__(self):
+        return "buffer"
+
+    def size(self):
+        return self.f.seek(0, os.SEEK_END)
+
+    def open(self, append):
+        if not append:
+            self.reset()
+        self.f.seek(0, os.SEEK_END)
+        return contextlib.nullcontext(self.f)
+
+    def reset(self):
+        self.f.seek(0)
+        self.f.truncate()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_transfer(user_agent=None):
+    """The process-wide transfer, so that all jobs share one connection pool."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MediaTransfer(user_agent=user_agent)
+        return _shared
+
+
+class SharedAdapter(HTTPAdapter):
+    """An adapter mounted on several sessions; closing one of them keeps the pool."""
+
+    def close(self):
+        pass
+
+
+_api_adapter = None
+
+
+def shared_api_adapter(pool_size=16):
+    """The process-wide connection pool for Instagram's API hosts.
+
+    Every loader session mounts it, so connections opened by one loader (or
+    by ``prewarm``) are reused by the next instead of paying DNS and TLS again.
+    """
+    global _api_adapter
+    with _shared_lock:
+        if _api_adapter is None:
+            _api_adapter = SharedAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        return _api_adapter
@@ -0,0 +1,373 @@
+"""Watch mode: keep polling profiles for new posts and stories.
+
+A ``Watcher`` is one long-running loop over a list of profiles, meant to
+cover hundreds of accounts from a single process::
+
+    python cli.py -l accounts.txt -o /data/mirror --watch
+
+* Posts: every profile is polled on its own jittered schedule with a fast
+  update (``DownloadOptions.fast_update``) that bypasses the response cache
+  for profile metadata and post pages. A profile without new posts costs its
+  first page; new posts are downloaded like in a normal run, into the same
+  folders and index.
+* Stories (logged in only): the stories of all watched profiles are checked
+  together every ``story_interval``; instaloader asks for 50 profiles per
+  request, and the answer carries the time of each profile's latest item.
+  Only items newer than the last one seen are downloaded. What was seen is
+  kept in ``<folder>/.watch_stamps.ini`` (instaloader's ``LatestStamps``
+  format), together with the user IDs, so a restarted watcher checks stories
+  right away. A new one checks them once the first poll has looked up a
+  profile's user ID.
+* Budget: all polls together stay under ``budget`` metadata requests per
+  hour. The poll interval is stretched when the profiles cannot all be polled
+  that often, and polls wait while the requests of the last hour (counted by
+  the ``rate_limit`` scheduler) are over budget.
+
+Failed polls are retried with exponential backoff, up to ``MAX_BACKOFF``.
+"""
+import copy
+import heapq
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+from batch import BatchJob, MAX_PARALLEL_PROFILES
+from download_index import DownloadIndex
+from downloader_core import Downloader, STORY_TARGET
+from metrics import MetricsExporter
+from response_cache import PROFILE_INFO, POSTS
+
+DEFAULT_INTERVAL = 30 * 60
+DEFAULT_STORY_INTERVAL = 60 * 60    # stories stay up for 24 hours
+DEFAULT_BUDGET = 200                # metadata requests per hour, all polls together
+JITTER = 0.2
+MAX_BACKOFF = 6 * 3600
+POLL_REQUESTS = 2                   # profile metadata and first post page
+STORIES_PER_REQUEST = 50            # profiles per story request (instaloader's chunk size)
+STAMPS_FILENAME = ".watch_stamps.ini"
+SUMMARY_EVERY = 3600
+
+
+def jittered(seconds):
+    return seconds * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+class _Watched:
+    """Schedule state of one watched profile."""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.userid = None
+        self.failures = 0
+        # Held by its poll and its story download: both may write the same archive
+        self.busy = threading.Lock()
+
+
+class Watcher:
+    def __init__(self, options, profiles, on_event=None, scheduler=None, interval=DEFAULT_INTERVAL,
+                 story_interval=DEFAULT_STORY_INTERVAL, budget=DEFAULT_BUDGET, verbose=False,
+                 clock=time.monotonic):
+        """Watch *profiles* with the settings of *options* (``DownloadOptions``).
+
+        *interval* and *story_interval* are in seconds, *budget* in metadata
+        requests per hour. Of the polls themselves only errors are logged,
+        unless *verbose*. Log in through ``watcher.core`` before ``run()``.
+        *clock* returns the (monotonic) time the schedule is kept in.
+        """
+        self.on_event = on_event
+        self.interval = interval
+        self.story_interval = story_interval
+        self.budget = budget
+        self.verbose = verbose
+        self.stories = options.stories
+        options = copy.copy(options)
+        # Stories of all profiles are checked at once (_check_stories)
+        options.stories = False
+        options.fast_update = True
+        options.resume = False
+        # Polls must see new posts; username lookups may stay cached
+        options.cache_ttl = dict(options.cache_ttl or {}, **{PROFILE_INFO: 0, POSTS: 0})
+        self.options = options
+        self.core = Downloader(options, on_event=self._on_core_event, scheduler=scheduler)
+        self._watched = [_Watched(profile) for profile in profiles]
+        self._queue = []            # (due, sequence number, _Watched), a heap
+        self._sequence = 0
+        self._interval = interval
+        self._clock = clock
+        self._stories = False
+        self._next_stories = math.inf   # no user ID known yet
+        self._stamps = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._usage = deque()       # (time, metadata requests since the previous sample)
+        self._counted = 0
+        self._totals = dict.fromkeys(("polls", "failed", "posts", "stories"), 0)
+
+    # --- Events ---
+
+    def log(self, text, profile=None):
+        if profile is not None:
+            text = f"[{profile}] {text}"
+        if self.on_event:
+            self.on_event("log", {"message": f">> {text}"})
+
+    def _on_core_event(self, kind, data):
+        if kind == "log" and not self.verbose and "ERROR" not in data["message"]:
+            return
+        if self.on_event:
+            self.on_event(kind, data)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._totals[key] += n
+
+    # --- Schedule ---
+
+    def poll_interval(self, stories=False):
+        """Seconds between two polls of a profile: ``interval``, or longer to stay within the budget."""
+        n = len(self._watched)
+        budget = self.budget
+        if stories:
+            budget -= math.ceil(n / STORIES_PER_REQUEST) * 3600 / self.story_interval
+        # Whatever the stories take, a tenth of the budget is left for the posts
+        budget = max(budget, self.budget / 10)
+        return max(self.interval, n * POLL_REQUESTS * 3600 / budget)
+
+    def _schedule(self, watched, delay):
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._queue, (self._clock() + delay, self._sequence, watched))
+        self._wake.set()
+
+    def _next_delay(self, watched):
+        if not watched.failures:
+            return jittered(self._interval)
+        return jittered(max(self._interval, min(self._interval * 2 ** watched.failures, MAX_BACKOFF)))
+
+    def _requests_last_hour(self):
+        now = self._clock()
+        requests = self.core.scheduler.metadata.requests
+        if requests != self._counted:
+            self._usage.append((now, requests - self._counted))
+            self._counted = requests
+        while self._usage and self._usage[0][0] < now - 3600:
+            self._usage.popleft()
+        return sum(n for _, n in self._usage)
+
+    # --- Run ---
+
+    def stop(self):
+        """Stop after the polls that are currently running."""
+        self._stop.set()
+        self._wake.set()
+        self.core.stop()
+
+    def run(self):
+        """Poll until ``stop()`` is called."""
+        self._stop.clear()
+        folder = self.options.folder
+        os.makedirs(folder, exist_ok=True)
+        self._load_stamps(folder)
+
+        stories = self.stories and self.core.login_user is not None
+        if self.stories and not stories:
+            self.log("STORIES ARE NOT WATCHED: they need a login")
+        self._stories = stories
+        known = any(watched.userid is not None for watched in self._watched)
+        # Otherwise the first poll that looks up a user ID schedules the first check
+        self._next_stories = self._clock() if stories and known else math.inf
+        self._interval = self.poll_interval(stories)
+        self.log(f"WATCHING {len(self._watched)} PROFILES: each every {self._interval / 60:.0f} min "
+                 f"(±{JITTER:.0%}), at most {self.budget} requests/h"
+                 + (f", stories every {self.story_interval / 60:.0f} min" if stories else ""))
+        self.log(f"SAVE TO: {folder}")
+
+        self._schedule_first_round()
+
+        exporter = None
+        if self.options.metrics_file:
+            exporter = MetricsExporter(self.options.metrics_file, self.core.metrics_snapshot)
+            exporter.start()
+        self.core._postprocessor = self.core._start_postprocessor()
+        parallel = max(1, min(int(self.options.parallel_profiles), MAX_PARALLEL_PROFILES))
+        slots = threading.Semaphore(parallel)
+        self._counted = self.core.scheduler.metadata.requests
+
+        with DownloadIndex.for_folder(folder) as index:
+            pool = ThreadPoolExecutor(max_workers=parallel)
+            try:
+                self._loop(pool, slots, index)
+            finally:
+                self.stop()
+                pool.shutdown(wait=True)
+                if self.core._postprocessor is not None:
+                    self.core._finish_postprocessor()
+                if exporter is not None:
+                    try:
+                        exporter.stop()
+                    except OSError as e:
+                        self.log(f"METRICS FILE ERROR: {e}")
+        self._log_summary("WATCH STOPPED")
+
+    def _schedule_first_round(self):
+        # Spread the first round over one interval instead of polling everything at once
+        step = self._interval / max(1, len(self._watched))
+        for i, watched in enumerate(self._watched):
+            self._schedule(watched, step * (i + random.random()))
+
+    def _loop(self, pool, slots, index):
+        next_summary = self._clock() + SUMMARY_EVERY
+        while not self._stop.is_set():
+            self._wake.clear()
+            now = self._clock()
+            if now >= next_summary:
+                self._log_summary("LAST HOUR")
+                next_summary = now + SUMMARY_EVERY
+            with self._lock:
+                due = self._queue[0][0] if self._queue else math.inf
+                next_stories = self._next_stories
+            wake = min(due, next_stories, next_summary)
+            if wake > now:
+                self._wake.wait(wake - now)
+                continue
+
+            used = self._requests_last_hour()
+            if used >= self.budget:
+                # Until the oldest requests drop out of the window
+                self._wake.wait(max(1.0, self._usage[0][0] + 3600 - now))
+                continue
+            if not slots.acquire(timeout=1):
+                continue
+
+            if next_stories <= now:
+                with self._lock:
+                    self._next_stories = now + jittered(self.story_interval)
+                task = self._check_stories
+            else:
+                with self._lock:
+                    watched = heapq.heappop(self._queue)[2]
+                task = lambda watched=watched: self._poll(watched, index)
+            pool.submit(self._run_task, task, slots)
+
+    def _run_task(self, task, slots):
+        try:
+            task()
+        except Exception as e:
+            self.log(f"WATCH ERROR: {e}")
+        finally:
+            slots.release()
+            self._wake.set()
+
+    def _log_summary(self, title):
+        with self._lock:
+            totals = dict(self._totals)
+            for key in self._totals:
+                self._totals[key] = 0
+        self.log(f"{title}: {totals['polls']} polls ({totals['failed']} failed), {totals['posts']} new posts, "
+                 f"{totals['stories']} new story items, {self._requests_last_hour()} requests in the last hour")
+
+    # --- Posts ---
+
+    def _poll(self, watched, index):
+        if self._stop.is_set():
+            return
+        job = BatchJob(watched.profile, self.options.folder)
+        self._count("polls")
+        try:
+            with watched.busy:
+                count = self.core.download_profile(self.core.build_loader(job.folder), job, index)
+        except Exception as e:
+            watched.failures += 1
+            self._count("failed")
+            delay = self._next_delay(watched)
+            self.log(f"POLL FAILED: {e} (next try in {delay / 60:.0f} min)", watched.profile)
+        else:
+            watched.failures = 0
+            delay = self._next_delay(watched)
+            if count:
+                self._count("posts", count)
+                self.log(f"{count} NEW POSTS", watched.profile)
+            if job.userid is not None and job.userid != watched.userid:
+                watched.userid = job.userid
+                with self._lock:
+                    self._stamps.save_profile_id(watched.profile.lower(), job.userid)
+                    if self._stories and self._next_stories == math.inf:
+                        # The first user ID is known: stories can be checked from now on
+                        self._next_stories = self._clock()
+        self._schedule(watched, delay)
+
+    # --- Stories ---
+
+    def _load_stamps(self, folder):
+        import instaloader
+
+        self._stamps = instaloader.LatestStamps(os.path.join(folder, STAMPS_FILENAME))
+        for watched in self._watched:
+            watched.userid = self._stamps.get_profile_id(watched.profile.lower())
+
+    def _check_stories(self):
+        by_userid = {watched.userid: watched for watched in self._watched if watched.userid is not None}
+        if not by_userid or self._stop.is_set():
+            return
+        loader = self.core.build_loader()
+        new = profiles = 0
+        try:
+            for story in loader.get_stories(userids=list(by_userid)):
+                if self._stop.is_set():
+                    break
+                watched = by_userid.get(story.owner_id)
+                if watched is None:
+                    continue
+                with watched.busy:
+                    count = self._download_story(loader, story)
+                new += count
+                profiles += bool(count)
+        except Exception as e:
+            self.log(f"STORY CHECK FAILED: {e}")
+        if new:
+            self._count("stories", new)
+            self.log(f"STORIES: {new} new items from {profiles} profiles")
+
+    def _download_story(self, loader, story):
+        """Download the items of *story* newer than the last one seen; returns their count."""
+        name = story.owner_username
+        with self._lock:
+            last = self._stamps.get_last_story_timestamp(name)
+        # One look at the reel is enough when nothing is new (instaloader dates are naive UTC)
+        latest = story.latest_media_utc.replace(tzinfo=timezone.utc)
+        if latest <= last:
+            return 0
+
+        if self.options.archive:
+            from archive import ArchiveWriter
+
+            loader.archive = ArchiveWriter.for_profile(self.options.folder, name, self.options.archive)
+        count = 0
+        complete = True
+        try:
+            for item in story.get_items():
+                if item.date_utc.replace(tzinfo=timezone.utc) <= last:
+                    continue
+                try:
+                    if loader.download_storyitem(item, STORY_TARGET.format(name)):
+                        count += 1
+                except Exception as e:
+                    # Keep the stamp before this item, so the next check tries it again
+                    complete = False
+                    self.log(f"STORY ERROR ({item.mediaid}): {e}", name)
+        finally:
+            if loader.archive is not None:
+                loader.archive.close()
+                loader.archive = None
+        if complete:
+            with self._lock:
+                self._stamps.set_last_story_timestamp(name, latest)
+        if count:
+            self.log(f"{count} NEW STORY ITEMS", name)
+        return count